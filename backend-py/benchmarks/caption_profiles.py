@@ -0,0 +1,87 @@
+"""Benchmarks the caption profiles of the captioning task, without the database.
+
+For each profile and batch size, Florence-2 captions the same images and the benchmark
+reports the time per image, the generated tokens per second and the caption length in
+words. For profiles with several prompts, it also times each prompt on its own, which
+encodes the images again for every prompt, to show what reusing the encoded images saves.
+
+Usage:
+    uv run python -m benchmarks.caption_profiles [IMAGE ...] [--profiles detailed fast tags] [--batch-sizes 1 4 8] [--backend torch]
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from PIL import Image, ImageOps
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.inference import INFERENCE_BACKENDS, backend_class  # noqa: E402
+from src.tasks.image_captioning import CAPTION_PROFILES, ImageCaptioningTask  # noqa: E402
+from benchmarks.decode_once import make_synthetic_jpeg  # noqa: E402
+
+def time_generate(backend, images: list, profile, repeat: int) -> tuple[float, dict, int]:
+    """Returns the median seconds of one `generate` call, with the texts and tokens of the last call."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        generated_texts, generated_tokens = backend.generate(images, *profile)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), generated_texts, generated_tokens
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*", help="Images to caption. A synthetic JPEG is used if none are given.")
+    parser.add_argument("--profiles", nargs="+", default=list(CAPTION_PROFILES), choices=list(CAPTION_PROFILES), help="Profiles to time.")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8], help="Batch sizes to time.")
+    parser.add_argument("--backend", default="torch", choices=INFERENCE_BACKENDS, help="Inference backend to run Florence-2 on.")
+    parser.add_argument("--megapixels", type=float, default=2, help="Size of the synthetic image.")
+    parser.add_argument("--repeat", type=int, default=2, help="Timed runs per profile and batch size.")
+    args = parser.parse_args()
+
+    directory = None
+    paths = args.images
+    if not paths:
+        directory = tempfile.mkdtemp()
+        paths = [make_synthetic_jpeg(directory, args.megapixels)]
+    images = []
+    for path in paths:
+        with Image.open(path) as img:
+            images.append(ImageOps.exif_transpose(img).convert("RGB"))
+
+    try:
+        options = {"precision": "fp32"} if args.backend == "onnx" else {}
+        backend = backend_class("image_captioning", args.backend)(**options)
+        backend.load()
+        backend.acquire()
+        task = ImageCaptioningTask()
+        task.backend = backend
+        # Compile kernels and fill caches before timing.
+        backend.generate(images[:1], *CAPTION_PROFILES["fast"])
+
+        print(f"{'profile':<9} {'batch':>5} {'ms/image':>9} {'tokens/s':>9} {'words':>6} {'ms/image w/o reuse':>19}")
+        for name in args.profiles:
+            profile = CAPTION_PROFILES[name]
+            for batch_size in args.batch_sizes:
+                batch = (images * batch_size)[:batch_size]
+                seconds, generated_texts, generated_tokens = time_generate(backend, batch, profile, args.repeat)
+                words = [
+                    len(" ".join(task._parse_caption(image, prompt, generated_texts[prompt][index]) for prompt in profile.prompts).split())
+                    for index, image in enumerate(batch)
+                ]
+                without_reuse = ""
+                if len(profile.prompts) > 1:
+                    separate_seconds = sum(
+                        time_generate(backend, batch, profile._replace(prompts=(prompt,)), args.repeat)[0] for prompt in profile.prompts
+                    )
+                    without_reuse = f"{separate_seconds * 1000 / batch_size:.1f}"
+                print(f"{name:<9} {batch_size:>5} {seconds * 1000 / batch_size:>9.1f} {generated_tokens / seconds:>9.1f} "
+                      f"{statistics.mean(words):>6.1f} {without_reuse:>19}")
+    finally:
+        if directory:
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Benchmarks the decode time saved per image by the decode-once analyze pipeline.
+
+The baseline mimics what the per-image tasks do today: EXIF analysis parses the header,
+while thumbnail generation, similarity hashing, quality assessment, object detection and
+captioning each open and fully decode the original on their own. The pipeline reads the
+file once, decodes it once and lets the EXIF stage parse the header from memory.
+
+Usage:
+    uv run python -m benchmarks.decode_once [IMAGE ...] [--megapixels 24] [--repeat 3]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from PIL import Image, ImageOps
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.imaging import DecodedImage  # noqa: E402
+
+FULL_DECODE_TASKS = ["thumbnail_generation", "similarity_grouping", "quality_assessment", "object_detection", "image_captioning"]
+
+def make_synthetic_jpeg(directory: str, megapixels: float) -> str:
+    """Writes a photo-like synthetic 3:2 JPEG of roughly the given size and returns its path.
+
+    The image is made of smooth gradients and shapes with sensor-like noise on top, so that
+    it compresses and hashes more like a photo than pure noise would.
+    """
+    from PIL import ImageDraw
+
+    width = int((megapixels * 1_000_000 * 3 / 2) ** 0.5)
+    height = width * 2 // 3
+    path = os.path.join(directory, f"synthetic_{megapixels:g}mp.jpg")
+    small = (width // 8, height // 8)
+    red = Image.linear_gradient("L").resize(small)
+    green = Image.radial_gradient("L").resize(small)
+    blue = Image.linear_gradient("L").rotate(90).resize(small)
+    base = Image.merge("RGB", (red, green, blue))
+    draw = ImageDraw.Draw(base)
+    draw.ellipse((small[0] // 5, small[1] // 4, small[0] // 2, small[1] * 3 // 4), fill=(220, 180, 40))
+    draw.rectangle((small[0] * 3 // 5, small[1] // 6, small[0] * 9 // 10, small[1] // 2), fill=(30, 60, 150))
+    base = base.resize((width, height), Image.Resampling.BICUBIC)
+    noise = Image.merge("RGB", [Image.effect_noise((width, height), 24)] * 3)
+    Image.blend(base, noise, 0.08).save(path, "JPEG", quality=90)
+    return path
+
+def decode_per_task(path: str):
+    """Opens and decodes the original once per task, like the individual tasks do."""
+    with Image.open(path) as img:
+        img.getexif()
+    for _ in FULL_DECODE_TASKS:
+        with Image.open(path) as img:
+            ImageOps.exif_transpose(img).convert("RGB")
+
+def decode_once(path: str):
+    """Reads and decodes the original once and shares it between all stages."""
+    decoded = DecodedImage.from_path(path)
+    with decoded.open() as img:
+        img.getexif()
+    for _ in FULL_DECODE_TASKS:
+        decoded.image
+
+def measure(fn, path: str, repeat: int) -> float:
+    """Returns the median wall-clock time of `fn(path)` in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(path)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*", help="Images to benchmark. A synthetic JPEG is used if none are given.")
+    parser.add_argument("--megapixels", type=float, default=24, help="Size of the synthetic JPEG.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per image; the median is reported.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        images = args.images or [make_synthetic_jpeg(tmp, args.megapixels)]
+        print(f"{'image':<40} {'per-task ms':>12} {'decode-once ms':>15} {'saved ms':>10} {'speedup':>8}")
+        for path in images:
+            baseline = measure(decode_per_task, path, args.repeat)
+            pipeline = measure(decode_once, path, args.repeat)
+            print(f"{os.path.basename(path):<40} {baseline:>12.1f} {pipeline:>15.1f} {baseline - pipeline:>10.1f} {baseline / pipeline:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Benchmarks the throughput of the CPU-only task workloads under each execution policy.
+
+The workloads are the CPU parts of the light tasks, without the database:
+
+- thumbnail: reduced JPEG decode, LANCZOS resize to 256 px wide and WebP encode.
+- phash: 1/8 scale decode and perceptual hash, as in similarity grouping.
+
+Each workload runs over the same images inline (one at a time, like the solo pool), on a
+thread pool and on a spawned process pool, for every worker count given.
+
+Usage:
+    uv run python -m benchmarks.execution_policy [IMAGE ...] [--count 64] [--workers 1 2 4 8]
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import imagehash
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.imaging import load_reduced  # noqa: E402
+from benchmarks.decode_once import make_synthetic_jpeg  # noqa: E402
+
+def thumbnail(path: str) -> int:
+    """Makes a WebP thumbnail like the thumbnail task and returns its size in bytes."""
+    img = load_reduced(path, 512)
+    height = int(img.size[1] * 256 / img.size[0])
+    buffer = io.BytesIO()
+    img.resize((256, height), Image.Resampling.LANCZOS).save(buffer, "WEBP", quality=80)
+    return buffer.tell()
+
+def phash(path: str) -> str:
+    """Computes the perceptual hash like the similarity grouping task."""
+    return str(imagehash.phash(load_reduced(path, 256)))
+
+WORKLOADS = {"thumbnail": thumbnail, "phash": phash}
+
+def run_inline(fn, paths: list[str], workers: int) -> float:
+    started = time.perf_counter()
+    for path in paths:
+        fn(path)
+    return time.perf_counter() - started
+
+def run_threads(fn, paths: list[str], workers: int) -> float:
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        started = time.perf_counter()
+        list(executor.map(fn, paths))
+        return time.perf_counter() - started
+
+def run_processes(fn, paths: list[str], workers: int) -> float:
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        # Start the processes before timing, as the worker does once at startup.
+        list(executor.map(abs, range(workers)))
+        started = time.perf_counter()
+        list(executor.map(fn, paths, chunksize=1))
+        return time.perf_counter() - started
+
+POLICIES = {"inline": run_inline, "thread": run_threads, "process": run_processes}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*", help="Images to process. Copies of a synthetic JPEG are used if none are given.")
+    parser.add_argument("--count", type=int, default=64, help="Number of synthetic images.")
+    parser.add_argument("--megapixels", type=float, default=12, help="Size of the synthetic JPEG.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32], help="Worker counts to measure.")
+    parser.add_argument("--workloads", nargs="+", default=list(WORKLOADS), choices=list(WORKLOADS))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = args.images
+        if not paths:
+            source = make_synthetic_jpeg(tmp, args.megapixels)
+            paths = [shutil.copy(source, os.path.join(tmp, f"image_{index}.jpg")) for index in range(args.count)]
+
+        print(f"{len(paths)} images, {os.cpu_count()} CPU(s)")
+        print(f"{'workload':<10} {'policy':<8} {'workers':>7} {'images/s':>9} {'speedup':>8}")
+        for workload in args.workloads:
+            fn = WORKLOADS[workload]
+            baseline = len(paths) / run_inline(fn, paths, 1)
+            print(f"{workload:<10} {'inline':<8} {1:>7} {baseline:>9.1f} {1.0:>7.1f}x")
+            for policy in ("thread", "process"):
+                for workers in args.workers:
+                    throughput = len(paths) / POLICIES[policy](fn, paths, workers)
+                    print(f"{workload:<10} {policy:<8} {workers:>7} {throughput:>9.1f} {throughput / baseline:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
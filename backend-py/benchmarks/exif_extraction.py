@@ -0,0 +1,92 @@
+"""Benchmarks header-only EXIF extraction against the Pillow based `_get_exif_data_from_img`.
+
+A photo-like JPEG carrying camera and GPS EXIF is copied `--count` times, then both
+extraction paths read every copy. Wall-clock and CPU time are reported; when the
+header parser is I/O-bound, its CPU time is a small fraction of its wall-clock time.
+
+Usage:
+    uv run python -m benchmarks.exif_extraction [--count 10000] [--megapixels 24]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from PIL import Image, TiffImagePlugin
+from PIL.ExifTags import IFD
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.exif_reader import read_image_header  # noqa: E402
+from src.tasks.exif_analysis import ExifAnalysisTask  # noqa: E402
+from benchmarks.decode_once import make_synthetic_jpeg  # noqa: E402
+
+def add_exif(path: str):
+    """Rewrites the JPEG at `path` with typical camera and GPS EXIF tags."""
+    rational = TiffImagePlugin.IFDRational
+    exif = Image.Exif()
+    exif[0x010F] = "Canon"
+    exif[0x0110] = "EOS R5"
+    exif[0x0112] = 1
+    exif[0x0132] = "2024:05:01 10:00:00"
+    exif_ifd = exif.get_ifd(IFD.Exif)
+    exif_ifd.update({
+        0x829A: rational(1, 250), 0x829D: rational(28, 10), 0x8822: 3, 0x8827: 400,
+        0x9003: "2024:05:01 09:59:58", 0x9209: 16, 0x920A: rational(50, 1), 0xA434: "RF24-70mm F2.8",
+    })
+    gps_ifd = exif.get_ifd(IFD.GPSInfo)
+    gps_ifd.update({
+        1: "N", 2: (rational(37, 1), rational(33, 1), rational(1234, 100)),
+        3: "E", 4: (rational(126, 1), rational(58, 1), rational(5, 1)), 6: rational(1500, 10),
+    })
+    with Image.open(path) as img:
+        img.load()
+    img.save(path, "JPEG", quality=90, exif=exif.tobytes())
+
+def extract_with_pillow(task: ExifAnalysisTask, path: str):
+    """The extraction path used before: `Image.open` plus `_get_exif_data_from_img`."""
+    with Image.open(path) as img:
+        width, height = img.size
+        exif_data, gps_info = task._get_exif_data_from_img(img)
+    return width, height, exif_data, gps_info
+
+def timed(fn, paths: list[str]) -> tuple[float, float]:
+    """Runs `fn` on every path and returns (wall seconds, CPU seconds)."""
+    wall, cpu = time.perf_counter(), time.process_time()
+    for path in paths:
+        fn(path)
+    return time.perf_counter() - wall, time.process_time() - cpu
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=10000, help="Number of files to extract.")
+    parser.add_argument("--megapixels", type=float, default=24, help="Size of the synthetic JPEG.")
+    args = parser.parse_args()
+
+    task = ExifAnalysisTask()
+    with tempfile.TemporaryDirectory() as tmp:
+        source = make_synthetic_jpeg(tmp, args.megapixels)
+        add_exif(source)
+        paths = []
+        for index in range(args.count):
+            path = os.path.join(tmp, f"{index:06d}.jpg")
+            shutil.copyfile(source, path)
+            paths.append(path)
+
+        baseline = extract_with_pillow(task, paths[0])
+        header = read_image_header(paths[0])
+        assert header[:2] == baseline[:2], (header, baseline)
+        for key, value in baseline[2].items():
+            if key in header[2]:
+                assert header[2][key] == value, (key, header[2][key], value)
+
+        print(f"{args.count} files of {os.path.getsize(source) / 1e6:.1f} MB")
+        for label, fn in (
+            ("Pillow _get_exif_data_from_img", lambda path: extract_with_pillow(task, path)),
+            ("read_image_header", read_image_header),
+        ):
+            wall, cpu = timed(fn, paths)
+            print(f"  {label:<32} {args.count / wall:9.0f} files/s  wall {wall:6.2f}s  CPU {cpu:6.2f}s ({cpu / wall:5.0%} of wall)")
+
+if __name__ == "__main__":
+    main()
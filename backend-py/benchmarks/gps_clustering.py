@@ -0,0 +1,99 @@
+"""Benchmarks project-wide GPS clustering against the per-image GPS grouping algorithm.
+
+Coordinates are generated like a travel project: photos cluster around stops along a
+route, with some scattered shots in between. The per-image algorithm (a +/-0.1 degree
+bounding box followed by `math` haversine on each candidate, as `GpsGroupingTask.run`
+does in SQL and Python) is timed on `--sample` points and extrapolated; its database
+round trips are not included. The project mode (`radius_components`) clusters all points,
+and its components are checked against a brute-force clustering up to `--verify-max` points.
+
+Usage:
+    uv run python -m benchmarks.gps_clustering [--sizes 1000 10000 100000] [--sample 200]
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.clustering import UnionFind, haversine_distances, radius_components  # noqa: E402
+from src.tasks.gps_grouping import GpsGroupingTask  # noqa: E402
+
+def make_points(count: int, stops: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """Generates (latitudes, longitudes) of photos taken around stops along a route."""
+    rng = np.random.default_rng(seed)
+    route = np.cumsum(rng.normal(0, 0.05, size=(stops, 2)), axis=0) + [45.0, 7.0]
+    stop = rng.integers(stops, size=count)
+    spread = rng.uniform(0.0001, 0.002, size=stops)[stop]
+    latitudes = route[stop, 0] + rng.normal(0, 1, count) * spread
+    longitudes = route[stop, 1] + rng.normal(0, 1, count) * spread
+    scattered = rng.random(count) < 0.1
+    latitudes[scattered] += rng.normal(0, 0.02, scattered.sum())
+    longitudes[scattered] += rng.normal(0, 0.02, scattered.sum())
+    return latitudes, longitudes
+
+def per_image_matches(task: GpsGroupingTask, latitudes, longitudes, index: int) -> list[int]:
+    """The candidate search of `GpsGroupingTask.run` for one image."""
+    lat1, lon1 = latitudes[index], longitudes[index]
+    in_box = np.nonzero(
+        (np.abs(latitudes - lat1) <= 0.1) & (np.abs(longitudes - lon1) <= 0.1)
+    )[0].tolist()
+    return [
+        candidate for candidate in in_box
+        if candidate != index
+        and task._haversine_distance(lat1, lon1, latitudes[candidate], longitudes[candidate]) <= task.max_distance_m
+    ]
+
+def brute_force_labels(latitudes, longitudes, radius_m: float) -> list[int]:
+    """Clusters all pairs within the radius without any index."""
+    union_find = UnionFind(len(latitudes))
+    for start in range(0, len(latitudes), 1000):
+        distances = haversine_distances(
+            latitudes[start:start + 1000, None], longitudes[start:start + 1000, None],
+            latitudes[None, :], longitudes[None, :],
+        )
+        rows, columns = np.nonzero(distances <= radius_m)
+        union_find.union_pairs(rows + start, columns)
+    return [union_find.find(x) for x in range(len(latitudes))]
+
+def same_partition(a, b) -> bool:
+    """Returns whether two labelings describe the same partition."""
+    pairs = set(zip(list(a), list(b)))
+    return len(pairs) == len(set(a)) == len(set(b))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Numbers of points")
+    parser.add_argument("--sample", type=int, default=200, help="Number of points to run the per-image search on")
+    parser.add_argument("--verify-max", type=int, default=10000, help="Largest size checked against brute force")
+    args = parser.parse_args()
+
+    task = GpsGroupingTask()
+    for size in args.sizes:
+        latitudes, longitudes = make_points(size, stops=max(10, size // 100))
+
+        sample = min(args.sample, size)
+        start = time.perf_counter()
+        for index in range(sample):
+            per_image_matches(task, latitudes, longitudes, index)
+        per_image = (time.perf_counter() - start) / sample
+
+        start = time.perf_counter()
+        labels = radius_components(latitudes, longitudes, task.max_distance_m)
+        project_seconds = time.perf_counter() - start
+        groups = sum(1 for count in np.unique(labels, return_counts=True)[1] if count > 1)
+
+        verified = ""
+        if size <= args.verify_max:
+            reference = brute_force_labels(latitudes, longitudes, task.max_distance_m)
+            if not same_partition(labels.tolist(), reference):
+                raise SystemExit(f"Project mode and brute force disagree for {size} points")
+            verified = ", matches brute force"
+
+        print(f"{size} points: {groups} groups{verified}")
+        print(f"  per-image search: {per_image * 1000:8.3f} ms per image, {per_image * size:8.2f} s estimated in total")
+        print(f"  project mode:     {project_seconds:8.3f} s in total, {per_image * size / project_seconds:.0f}x faster")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Benchmarks Hamming radius queries on `HammingIndex` against the linear scan it replaced.
+
+The linear scan is what `SimilarityGroupingTask` did for every image: `hex_to_hash` on
+every candidate hash followed by an `imagehash` subtraction. Hashes are generated in
+bursts of near-duplicates (a few flipped bits around a random base hash), like burst
+shooting produces. Both paths must return the same matches.
+
+Usage:
+    uv run python -m benchmarks.hash_index [--sizes 10000 100000] [--queries 1000] [--radius 10]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import imagehash
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.hash_index import HammingIndex, hash_to_int  # noqa: E402
+
+def make_hashes(count: int, burst_size: int, seed: int = 0) -> list[str]:
+    """Generates 64-bit hex hashes in bursts of near-duplicates."""
+    rng = random.Random(seed)
+    hashes = []
+    while len(hashes) < count:
+        base = rng.getrandbits(64)
+        for _ in range(min(burst_size, count - len(hashes))):
+            value = base
+            for bit in rng.sample(range(64), rng.randint(0, 8)):
+                value ^= 1 << bit
+            hashes.append(f"{value:016x}")
+    return hashes
+
+def linear_scan(query: str, candidates: list[tuple[int, str]], radius: int) -> set[int]:
+    """The per-candidate comparison of the original similarity grouping."""
+    query_hash = imagehash.hex_to_hash(query)
+    return {key for key, candidate in candidates if query_hash - imagehash.hex_to_hash(candidate) <= radius}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000], help="Numbers of indexed hashes")
+    parser.add_argument("--queries", type=int, default=1000, help="Number of index queries per size")
+    parser.add_argument("--linear-queries", type=int, default=20, help="Number of linear scans per size")
+    parser.add_argument("--radius", type=int, default=10, help="Hamming distance threshold")
+    parser.add_argument("--burst-size", type=int, default=20, help="Near-duplicate hashes per burst")
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        hashes = make_hashes(size, args.burst_size)
+        candidates = list(enumerate(hashes))
+        rng = random.Random(size)
+        queries = [rng.randrange(size) for _ in range(args.queries)]
+
+        start = time.perf_counter()
+        index = HammingIndex()
+        for key, hash_str in candidates:
+            index.add(key, hash_to_int(hash_str))
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index_results = [{key for key, _, _ in index.query(hash_to_int(hashes[q]), args.radius)} for q in queries]
+        index_per_query = (time.perf_counter() - start) / len(queries)
+
+        linear_queries = queries[:args.linear_queries]
+        start = time.perf_counter()
+        linear_results = [linear_scan(hashes[q], candidates, args.radius) for q in linear_queries]
+        linear_per_query = (time.perf_counter() - start) / len(linear_queries)
+
+        if linear_results != index_results[:len(linear_queries)]:
+            raise SystemExit(f"Index and linear scan disagree for {size} hashes")
+
+        matches = sum(len(result) for result in index_results) / len(index_results)
+        print(f"{size} hashes, radius {args.radius}, {matches:.1f} matches per query on average")
+        print(f"  linear scan: {linear_per_query * 1000:10.3f} ms per query")
+        print(f"  index:       {index_per_query * 1000:10.3f} ms per query (built in {build_seconds:.2f} s), "
+              f"{linear_per_query / index_per_query:.0f}x faster")
+        print(f"  all-pairs grouping estimate: linear {linear_per_query * size:.1f} s, "
+              f"index {build_seconds + index_per_query * size:.1f} s")
+
+if __name__ == "__main__":
+    main()
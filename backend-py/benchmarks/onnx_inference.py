@@ -0,0 +1,163 @@
+"""Compares the PyTorch and ONNX Runtime inference backends of the model tasks on the CPU.
+
+For each task, both backends run on the same images, without the database:
+
+- parity: how far the ONNX outputs are from PyTorch's. Quality scores are compared by
+  their absolute difference, detections by matching boxes of the same class with an IoU
+  of at least 0.5, and captions by the share that are identical and by their word-level
+  similarity.
+- latency: the median time per batch and the throughput, for each batch size, with
+  PyTorch and ONNX Runtime limited to each given number of intra-op threads.
+
+The ONNX models must have been exported first (`python -m scripts.export_onnx`).
+
+Usage:
+    uv run python -m benchmarks.onnx_inference [IMAGE ...] [--tasks quality_assessment object_detection image_captioning] [--batch-sizes 1 4 8] [--threads 1 4]
+"""
+import argparse
+import difflib
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from PIL import Image, ImageOps
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.inference import backend_class  # noqa: E402
+from src.tasks import get_task_class  # noqa: E402
+from src.tasks.image_captioning import CAPTION_PROFILES  # noqa: E402
+from benchmarks.decode_once import make_synthetic_jpeg  # noqa: E402
+
+# TOPIQ scores a batch of images of the same dimensions, so they are all resized to this.
+QUALITY_SIZE = (768, 512)
+
+def run_quality(backend, images: list) -> list:
+    return backend.score([backend.to_input(image.resize(QUALITY_SIZE)) for image in images])
+
+def run_detection(backend, images: list) -> list:
+    return backend.detect(images)
+
+def run_captioning(backend, images: list) -> list:
+    profile = CAPTION_PROFILES["detailed"]
+    generated_texts, _ = backend.generate(images, *profile)
+    return generated_texts[profile.prompts[0]]
+
+def iou(a: tuple, b: tuple) -> float:
+    """Returns the intersection over union of two (x1, y1, x2, y2) boxes."""
+    width = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    height = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    intersection = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+def compare_quality(expected: list, actual: list) -> str:
+    """Compares the scores of a baseline (`expected`) and of another model (`actual`)."""
+    differences = [abs(a - b) for a, b in zip(expected, actual)]
+    return f"score abs diff: max {max(differences):.2e}, mean {statistics.mean(differences):.2e}"
+
+def compare_detection(expected: list, actual: list) -> str:
+    """Matches the detections of another model (`actual`) to those of a baseline (`expected`)."""
+    matched, confidence_differences = 0, []
+    baseline_boxes = sum(len(detections) for detections in expected)
+    boxes = sum(len(detections) for detections in actual)
+    for baseline_detections, detections in zip(expected, actual):
+        unmatched = list(detections)
+        for tag, confidence, *box in baseline_detections:
+            candidates = [(iou(box, other[2:]), other) for other in unmatched if other[0] == tag]
+            best_iou, best = max(candidates, key=lambda candidate: candidate[0], default=(0.0, None))
+            if best is not None and best_iou >= 0.5:
+                unmatched.remove(best)
+                matched += 1
+                confidence_differences.append(abs(confidence - best[1]))
+    mean_difference = statistics.mean(confidence_differences) if confidence_differences else 0.0
+    return (f"boxes: baseline {baseline_boxes}, compared {boxes}, matched {matched} "
+            f"({matched / max(baseline_boxes, 1):.1%} of baseline); confidence abs diff mean {mean_difference:.2e}")
+
+def compare_captioning(expected: list, actual: list) -> str:
+    """Compares the captions of a baseline (`expected`) and of another model (`actual`)."""
+    identical = sum(a == b for a, b in zip(expected, actual))
+    # Word-level similarity, so that captions that differ by a word do not count as misses.
+    similarity = statistics.mean(difflib.SequenceMatcher(None, a.split(), b.split()).ratio() for a, b in zip(expected, actual))
+    return f"identical captions: {identical}/{len(expected)}, mean word similarity {similarity:.1%}"
+
+TASKS = {
+    "quality_assessment": (run_quality, compare_quality),
+    "object_detection": (run_detection, compare_detection),
+    "image_captioning": (run_captioning, compare_captioning),
+}
+
+def run_batched(run, backend, images: list, batch_size: int) -> list:
+    outputs = []
+    for start in range(0, len(images), batch_size):
+        outputs.extend(run(backend, images[start:start + batch_size]))
+    return outputs
+
+def time_batches(run, backend, images: list, batch_size: int, repeat: int) -> float:
+    """Returns the median seconds per batch of `batch_size` images, after one warm-up batch."""
+    batch = (images * batch_size)[:batch_size]
+    run(backend, batch)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run(backend, batch)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*", help="Images to run on. Synthetic JPEGs are used if none are given.")
+    parser.add_argument("--tasks", nargs="+", default=list(TASKS), choices=list(TASKS), help="Model tasks to compare.")
+    parser.add_argument("--count", type=int, default=8, help="Number of synthetic images.")
+    parser.add_argument("--megapixels", type=float, default=2, help="Size of the synthetic images.")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8], help="Batch sizes to time.")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, os.cpu_count() or 1], help="Intra-op thread counts to time.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per batch size.")
+    args = parser.parse_args()
+
+    import torch
+
+    directory = None
+    paths = args.images
+    if not paths:
+        directory = tempfile.mkdtemp()
+        source = make_synthetic_jpeg(directory, args.megapixels)
+        paths = [source] * args.count
+    images = []
+    for path in paths:
+        with Image.open(path) as img:
+            images.append(ImageOps.exif_transpose(img).convert("RGB"))
+
+    try:
+        for task_name in args.tasks:
+            run, compare = TASKS[task_name]
+            get_task_class(task_name)  # Registers the task's backends.
+            torch_backend = backend_class(task_name, "torch")()
+            torch_backend.load()
+            onnx_backends = {}
+            for threads in args.threads:
+                onnx_backends[threads] = backend_class(task_name, "onnx")(precision="fp32", intra_op_threads=threads)
+                onnx_backends[threads].load()
+
+            print(f"\n{task_name}")
+            with torch.no_grad():
+                expected = run_batched(run, torch_backend, images, max(args.batch_sizes))
+            actual = run_batched(run, onnx_backends[args.threads[-1]], images, max(args.batch_sizes))
+            print(f"  parity over {len(images)} images: {compare(expected, actual)}")
+
+            print(f"  {'backend':<8} {'threads':>7} {'batch':>5} {'ms/batch':>9} {'images/s':>9}")
+            for threads in args.threads:
+                torch.set_num_threads(threads)
+                for batch_size in args.batch_sizes:
+                    with torch.no_grad():
+                        torch_seconds = time_batches(run, torch_backend, images, batch_size, args.repeat)
+                    onnx_seconds = time_batches(run, onnx_backends[threads], images, batch_size, args.repeat)
+                    for name, seconds in (("torch", torch_seconds), ("onnx", onnx_seconds)):
+                        print(f"  {name:<8} {threads:>7} {batch_size:>5} {seconds * 1000:>9.1f} {batch_size / seconds:>9.2f}")
+    finally:
+        if directory:
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Benchmarks how busy the model stays with and without prefetching upcoming images.
+
+Both modes process the same images in model-sized batches. The baseline reads, decodes
+and prepares the images of a batch and only then runs the model, like `run_batch` does.
+The prefetching mode uses `src.prefetch.Prefetcher`, so the next images are loaded while
+the model runs. The model is a stand-in that keeps an accelerator busy for `--model-ms`
+per image without using the CPU, which is how a GPU forward pass looks to the host.
+
+Usage:
+    uv run python -m benchmarks.prefetch_pipeline [IMAGE ...] [--count 64] [--batch-size 8] [--model-ms 40]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.imaging import DecodedImage  # noqa: E402
+from src.prefetch import Prefetcher  # noqa: E402
+from benchmarks.decode_once import make_synthetic_jpeg  # noqa: E402
+
+def load(path: str):
+    """Reads, decodes and prepares one image the way the quality task does."""
+    decoded = DecodedImage.from_path(path)
+    return np.asarray(decoded.image, dtype=np.float32).transpose(2, 0, 1) / 255.0
+
+def run_model(batch: list, model_ms: float):
+    """Stands in for a forward pass on an accelerator."""
+    time.sleep(len(batch) * model_ms / 1000)
+
+def sequential(paths: list[str], batch_size: int, model_ms: float) -> tuple[float, float]:
+    """Loads each batch, then runs the model on it. Returns the wall time and the model time."""
+    started = time.perf_counter()
+    busy = 0.0
+    for start in range(0, len(paths), batch_size):
+        batch = [load(path) for path in paths[start:start + batch_size]]
+        model_started = time.perf_counter()
+        run_model(batch, model_ms)
+        busy += time.perf_counter() - model_started
+    return time.perf_counter() - started, busy
+
+def prefetched(paths: list[str], batch_size: int, model_ms: float, depth: int) -> tuple[float, float]:
+    """Runs the model while the next images load. Returns the wall time and the model time."""
+    started = time.perf_counter()
+    busy = 0.0
+    for batch in Prefetcher(load, paths, depth).batches(batch_size):
+        model_started = time.perf_counter()
+        run_model([value for _, value, _ in batch], model_ms)
+        busy += time.perf_counter() - model_started
+    return time.perf_counter() - started, busy
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*", help="Images to process. Copies of a synthetic JPEG are used if none are given.")
+    parser.add_argument("--count", type=int, default=64, help="Number of synthetic images.")
+    parser.add_argument("--megapixels", type=float, default=12, help="Size of the synthetic JPEG.")
+    parser.add_argument("--batch-size", type=int, default=8, help="Images per model batch.")
+    parser.add_argument("--model-ms", type=float, default=40, help="Simulated model time per image.")
+    parser.add_argument("--depth", type=int, default=16, help="Images loaded ahead of the model.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = args.images
+        if not paths:
+            source = make_synthetic_jpeg(tmp, args.megapixels)
+            paths = []
+            for index in range(args.count):
+                # Separate files, so every read goes to disk or the page cache like in production.
+                paths.append(shutil.copy(source, os.path.join(tmp, f"image_{index}.jpg")))
+
+        print(f"{len(paths)} images, batches of {args.batch_size}, {args.model_ms:g} ms model time per image")
+        print(f"{'mode':<12} {'wall s':>8} {'images/s':>9} {'model busy':>11}")
+        for name, run in (
+            ("sequential", lambda: sequential(paths, args.batch_size, args.model_ms)),
+            ("prefetched", lambda: prefetched(paths, args.batch_size, args.model_ms, args.depth)),
+        ):
+            wall, busy = run()
+            print(f"{name:<12} {wall:>8.2f} {len(paths) / wall:>9.1f} {busy / wall:>10.0%}")
+
+if __name__ == "__main__":
+    main()
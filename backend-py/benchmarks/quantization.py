@@ -0,0 +1,89 @@
+"""Reports the accuracy and speed of the INT8 model variants against the FP32 baseline.
+
+For each model task, the ONNX backend runs every variant on the same images, without
+the database. Each quantized variant is compared with FP32 the same way
+`benchmarks.onnx_inference` compares ONNX Runtime with PyTorch: quality scores by their
+absolute difference, detections by matching boxes of the same class with an IoU of at
+least 0.5, and captions by the share that are identical and their word-level similarity.
+The median time per batch, the throughput and the speedup over FP32 are reported for
+each batch size.
+
+Accuracy is only meaningful on real photos: pass images, or `--sample N` to draw them
+from the `image` table. The variants must have been exported first
+(`python -m scripts.export_onnx --precision fp32 int8-dynamic int8-static`).
+
+Usage:
+    uv run python -m benchmarks.quantization [IMAGE ...] [--sample 32] [--tasks quality_assessment object_detection image_captioning] [--batch-sizes 1 4 8]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from PIL import Image, ImageOps
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.inference import INFERENCE_PRECISIONS, backend_class  # noqa: E402
+from src.tasks import get_task_class  # noqa: E402
+from benchmarks.decode_once import make_synthetic_jpeg  # noqa: E402
+from benchmarks.onnx_inference import TASKS, run_batched, time_batches  # noqa: E402
+from scripts.export_onnx import sample_image_paths  # noqa: E402
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*", help="Images to run on.")
+    parser.add_argument("--sample", type=int, default=0, help="Draw this many images from the image table.")
+    parser.add_argument("--tasks", nargs="+", default=list(TASKS), choices=list(TASKS), help="Model tasks to compare.")
+    parser.add_argument("--precisions", nargs="+", default=list(INFERENCE_PRECISIONS[1:]), choices=INFERENCE_PRECISIONS[1:],
+                        help="Quantized variants to compare with FP32.")
+    parser.add_argument("--count", type=int, default=8, help="Number of synthetic images, without images or --sample.")
+    parser.add_argument("--megapixels", type=float, default=2, help="Size of the synthetic images.")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8], help="Batch sizes to time.")
+    parser.add_argument("--threads", type=int, default=0, help="Intra-op threads; 0 for one per physical core.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per batch size.")
+    args = parser.parse_args()
+
+    import torch
+
+    directory = None
+    paths = args.images + (sample_image_paths(args.sample) if args.sample else [])
+    if not paths:
+        print("No images given: accuracy on synthetic images says little about real photos.")
+        directory = tempfile.mkdtemp()
+        source = make_synthetic_jpeg(directory, args.megapixels)
+        paths = [source] * args.count
+    images = []
+    for path in paths:
+        with Image.open(path) as img:
+            images.append(ImageOps.exif_transpose(img).convert("RGB"))
+
+    try:
+        for task_name in args.tasks:
+            run, compare = TASKS[task_name]
+            get_task_class(task_name)  # Registers the task's backends.
+            backends = {}
+            for precision in ("fp32", *args.precisions):
+                backends[precision] = backend_class(task_name, "onnx")(precision=precision, intra_op_threads=args.threads)
+                backends[precision].load()
+
+            print(f"\n{task_name} over {len(images)} images")
+            with torch.no_grad():
+                baseline = run_batched(run, backends["fp32"], images, max(args.batch_sizes))
+                for precision in args.precisions:
+                    outputs = run_batched(run, backends[precision], images, max(args.batch_sizes))
+                    print(f"  {precision} vs fp32: {compare(baseline, outputs)}")
+
+                print(f"  {'variant':<13} {'batch':>5} {'ms/batch':>9} {'images/s':>9} {'speedup':>8}")
+                for batch_size in args.batch_sizes:
+                    fp32_seconds = None
+                    for precision, backend in backends.items():
+                        seconds = time_batches(run, backend, images, batch_size, args.repeat)
+                        fp32_seconds = fp32_seconds or seconds
+                        print(f"  {precision:<13} {batch_size:>5} {seconds * 1000:>9.1f} {batch_size / seconds:>9.2f} {fp32_seconds / seconds:>7.2f}x")
+            del backends
+    finally:
+        if directory:
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
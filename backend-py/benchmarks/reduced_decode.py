@@ -0,0 +1,75 @@
+"""Benchmarks reduced-resolution (JPEG draft mode) decoding for thumbnails and perceptual hashing.
+
+For each image the full decode path used before is compared with `load_reduced`:
+CPU time, size of the decoded bitmap, the mean absolute pixel difference between the
+resulting 256px thumbnails and the Hamming distance between the perceptual hashes.
+
+Usage:
+    uv run python -m benchmarks.reduced_decode [IMAGE ...] [--megapixels 24] [--repeat 3]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import imagehash
+import numpy as np
+from PIL import Image, ImageOps
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.imaging import load_reduced  # noqa: E402
+from benchmarks.decode_once import make_synthetic_jpeg  # noqa: E402
+
+THUMBNAIL_WIDTH = 256
+
+def load_full(path: str) -> Image.Image:
+    """Decodes the full resolution image, as the tasks did before."""
+    with Image.open(path) as img:
+        return ImageOps.exif_transpose(img).convert("RGB")
+
+def thumbnail(img: Image.Image) -> Image.Image:
+    """Resizes to the thumbnail width with LANCZOS, like `ThumbnailGenerationTask`."""
+    height = int(img.size[1] * THUMBNAIL_WIDTH / float(img.size[0]))
+    return img.resize((THUMBNAIL_WIDTH, height), Image.Resampling.LANCZOS)
+
+def cpu_ms(fn, repeat: int) -> tuple[float, object]:
+    """Returns the median process CPU time of `fn()` in milliseconds, and its last result."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.process_time()
+        result = fn()
+        timings.append((time.process_time() - started) * 1000)
+    return statistics.median(timings), result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*", help="Images to benchmark. A synthetic JPEG is used if none are given.")
+    parser.add_argument("--megapixels", type=float, default=24, help="Size of the synthetic JPEG.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement; the median is reported.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        images = args.images or [make_synthetic_jpeg(tmp, args.megapixels)]
+        for path in images:
+            print(os.path.basename(path))
+            for label, min_side in (("thumbnail", 512), ("phash", 256)):
+                full_ms, full_img = cpu_ms(lambda: load_full(path), args.repeat)
+                reduced_ms, reduced_img = cpu_ms(lambda: load_reduced(path, min_side), args.repeat)
+                full_mb = full_img.size[0] * full_img.size[1] * 3 / 1e6
+                reduced_mb = reduced_img.size[0] * reduced_img.size[1] * 3 / 1e6
+                if label == "thumbnail":
+                    diff = np.abs(
+                        np.asarray(thumbnail(full_img), dtype=np.int16) - np.asarray(thumbnail(reduced_img.convert("RGB")), dtype=np.int16)
+                    ).mean()
+                    quality = f"mean abs pixel diff {diff:.2f}/255"
+                else:
+                    quality = f"phash distance {imagehash.phash(full_img) - imagehash.phash(reduced_img)}"
+                print(
+                    f"  {label:<10} full {full_ms:7.1f} ms CPU, {full_mb:6.1f} MB bitmap | "
+                    f"reduced {reduced_ms:7.1f} ms CPU, {reduced_mb:6.1f} MB bitmap {reduced_img.size} | {quality}"
+                )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Benchmarks project-wide similarity clustering against running the per-image task over a project.
+
+A throwaway user and project with `--count` pre-hashed images is created in the database
+at `DB_DSN`. The images are shot in bursts of near-duplicates, a few seconds apart, and
+were last updated an hour ago, as if uploaded and analyzed before grouping runs. The
+per-image task is timed on `--sample` images and extrapolated to the whole project; the
+project mode groups every image. Everything is deleted again afterwards.
+
+Usage:
+    DB_DSN=... uv run python -m benchmarks.similarity_clustering [--count 10000] [--sample 500]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from psycopg2.extras import execute_values
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.db import get_db_connection, release_db_connection  # noqa: E402
+from src.tasks.similarity_grouping import SimilarityGroupingTask  # noqa: E402
+
+def create_project(cur, count: int, burst_size: int) -> tuple[str, str, list[str]]:
+    """Creates a user and a project with `count` hashed images and returns (user ID, project ID, image IDs)."""
+    rng = random.Random(0)
+    user_id, project_id = str(uuid.uuid4()), str(uuid.uuid4())
+    cur.execute(
+        """INSERT INTO "user" (id, name, email, email_verified, created_at, updated_at)
+           VALUES (%s, 'benchmark', %s, false, NOW(), NOW())""",
+        (user_id, f"{user_id}@benchmark.invalid")
+    )
+    cur.execute(
+        "INSERT INTO project (id, user_id, project_name, created_at, updated_at) VALUES (%s, %s, 'benchmark', NOW(), NOW())",
+        (project_id, user_id)
+    )
+
+    rows = []
+    taken = datetime(2024, 5, 1, 9, 0, 0)
+    while len(rows) < count:
+        base = rng.getrandbits(64)
+        for _ in range(min(burst_size, count - len(rows))):
+            value = base
+            for bit in rng.sample(range(64), rng.randint(0, 6)):
+                value ^= 1 << bit
+            image_id = str(uuid.uuid4())
+            rows.append((image_id, user_id, project_id, f"images/{image_id}.jpg", taken, f"{value:016x}"))
+            taken += timedelta(seconds=rng.randint(1, 5))
+        taken += timedelta(minutes=rng.randint(1, 20))
+    execute_values(cur, """
+        INSERT INTO image (id, user_id, project_id, original_filename, storage_path, file_size_bytes, mime_type,
+                           capture_datetime, perceptual_hash, upload_datetime, created_at, updated_at)
+        VALUES %s
+    """, rows, template="(%s, %s, %s, 'benchmark.jpg', %s, 1, 'image/jpeg', %s, %s, NOW(), NOW(), NOW() - INTERVAL '1 hour')", page_size=1000)
+    return user_id, project_id, [row[0] for row in rows]
+
+def count_groups(cur, project_id: str) -> tuple[int, int]:
+    """Returns the number of 'similar' groups of a project and their total membership."""
+    cur.execute(
+        """
+        SELECT COUNT(DISTINCT ig.id), COUNT(igm.id)
+        FROM image_group ig LEFT JOIN image_group_membership igm ON igm.group_id = ig.id
+        WHERE ig.project_id = %s AND ig.group_type = 'similar'
+        """,
+        (project_id,)
+    )
+    return cur.fetchone()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=10000, help="Number of images in the project")
+    parser.add_argument("--sample", type=int, default=500, help="Number of images to run the per-image task on")
+    parser.add_argument("--burst-size", type=int, default=30, help="Near-duplicate images per burst")
+    args = parser.parse_args()
+    load_dotenv()
+
+    task = SimilarityGroupingTask()
+    conn = get_db_connection()
+    cur = conn.cursor()
+    user_id = None
+    try:
+        user_id, project_id, image_ids = create_project(cur, args.count, args.burst_size)
+        conn.commit()
+
+        sample = image_ids[:args.sample]
+        start = time.perf_counter()
+        for image_id in sample:
+            task._group_image(image_id, load_image=None)
+        per_image = (time.perf_counter() - start) / len(sample)
+        groups, members = count_groups(cur, project_id)
+        print(f"per-image task: {per_image * 1000:.2f} ms per image, "
+              f"{per_image * args.count:.1f} s estimated for {args.count} images "
+              f"({groups} groups / {members} memberships after {len(sample)} images)")
+
+        start = time.perf_counter()
+        task.run_project(project_id)
+        project_seconds = time.perf_counter() - start
+        groups, members = count_groups(cur, project_id)
+        print(f"project mode:   {project_seconds:.2f} s for {args.count} images "
+              f"({groups} groups / {members} memberships), {per_image * args.count / project_seconds:.0f}x faster")
+    finally:
+        conn.rollback()
+        if user_id:
+            cur.execute('DELETE FROM "user" WHERE id = %s', (user_id,))
+            conn.commit()
+        cur.close()
+        release_db_connection(conn)
+
+if __name__ == "__main__":
+    main()
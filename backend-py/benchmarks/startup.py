@@ -0,0 +1,97 @@
+"""Benchmarks how long the server and the worker take to import, and how much memory that takes.
+
+Every run imports a module in a fresh interpreter and reports the import time, the whole
+process time (interpreter startup included), the peak RSS, and which of the model
+libraries (torch, transformers, ultralytics, pyiqa, torchvision) ended up imported.
+The server imports the worker, so neither should load a model library until a task runs.
+
+With `--tasks`, each task module is also imported on its own, which is what the first
+message of a task pays for. The model libraries themselves are only imported when a
+task first runs its model.
+
+Usage:
+    uv run python -m benchmarks.startup [--modules server worker] [--runs 5] [--tasks] [--top 10]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.tasks import TASK_SPECS  # noqa: E402
+
+HEAVY_MODULES = ("torch", "torchvision", "transformers", "ultralytics", "pyiqa")
+
+CHILD = """
+import importlib, json, resource, sys, time
+started = time.perf_counter()
+importlib.import_module(sys.argv[1])
+elapsed = time.perf_counter() - started
+print(json.dumps({
+    "seconds": elapsed,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "heavy": [name for name in sys.argv[2:] if name in sys.modules],
+}))
+"""
+
+def measure(module: str, env: dict) -> dict:
+    """Imports a module in a fresh interpreter and returns the child's measurements."""
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD, module, *HEAVY_MODULES],
+        capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+    # The worker prints the tasks it registers; the measurements are the last line.
+    measurement = json.loads(result.stdout.strip().splitlines()[-1])
+    measurement["wall"] = wall
+    return measurement
+
+def slowest_imports(module: str, env: dict, top: int) -> list[tuple[int, str]]:
+    """Returns the `top` imports with the highest self time, in microseconds, from `-X importtime`."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        timings.append((int(self_us), name.strip()))
+    return sorted(timings, reverse=True)[:top]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=["server", "worker"], help="Modules to import.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per module; medians are reported.")
+    parser.add_argument("--tasks", action="store_true", help="Also import every task module on its own.")
+    parser.add_argument("--top", type=int, default=0, help="Show the N slowest imports of each module.")
+    args = parser.parse_args()
+
+    # Connections are made on first use, so importing needs no running broker or database.
+    env = {"CELERY_BROKER_URL": "memory://", **os.environ}
+    modules = list(args.modules)
+    if args.tasks:
+        modules += [f"src.tasks.{name}" for name in sorted(TASK_SPECS)]
+
+    print(f"{'module':<34} {'import s':>9} {'process s':>10} {'RSS MiB':>8}  model libraries")
+    for module in modules:
+        runs = [measure(module, env) for _ in range(args.runs)]
+        heavy = sorted({name for run in runs for name in run["heavy"]})
+        print(
+            f"{module:<34} {statistics.median(run['seconds'] for run in runs):>9.3f} "
+            f"{statistics.median(run['wall'] for run in runs):>10.3f} "
+            f"{max(run['max_rss_kb'] for run in runs) / 1024:>8.0f}  {', '.join(heavy) or '-'}"
+        )
+        if args.top:
+            for self_us, name in slowest_imports(module, env, args.top):
+                print(f"    {self_us / 1000:>8.1f} ms  {name}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""Exports the models of the model tasks to ONNX for the ONNX Runtime inference backend.
+
+- topiq_nr: the TOPIQ network behind pyiqa's metric, with dynamic batch and image size.
+- yolov10x: YOLOv10 through ultralytics' own exporter, with dynamic batch size. YOLOv10
+  is NMS-free, so the graph outputs the final detections.
+- florence2_vision_encoder: the Florence-2 vision encoder (DaViT and the projection into
+  the language model's embedding space), with dynamic batch size. The text
+  encoder-decoder stays in PyTorch, see `OnnxFlorence`.
+
+Every export is run on ONNX Runtime on an input of another batch size (and image size,
+for TOPIQ) than the one it was traced with, so that shapes frozen into the graph by
+tracing are caught. TOPIQ and the vision encoder are compared with PyTorch, and the
+script fails if an output differs by more than `--atol`.
+
+`--precision` also writes the INT8 variants of the models, quantized from the FP32 export
+with ONNX Runtime (an FP32 export that already exists is reused):
+
+- int8-dynamic: the weights of the linear layers (MatMul and Gemm) in INT8; activations
+  are quantized at run time.
+- int8-static: the weights and activations of all supported operators in INT8, in QDQ
+  format with per-channel weights. The activation ranges are calibrated on
+  `--calibration-count` images drawn at random from the `image` table (or from
+  `--calibration-dir`), preprocessed like the task does.
+
+Models are written to `ONNX_MODEL_DIR` (`models/onnx` by default), where the tasks read
+them from. Exporting downloads the PyTorch weights like the tasks do.
+
+Usage:
+    uv run python -m scripts.export_onnx [topiq_nr yolov10x florence2_vision_encoder] [--opset 17] [--atol 1e-3]
+        [--precision fp32 int8-dynamic int8-static] [--calibration-count 64] [--calibration-dir DIR]
+"""
+import argparse
+import functools
+import os
+import shutil
+import sys
+import tempfile
+import numpy as np
+import torch
+from PIL import Image, ImageOps
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.db import get_db_connection, release_db_connection  # noqa: E402
+from src.imaging import resolve_storage_path  # noqa: E402
+from src.inference import INFERENCE_PRECISIONS, ONNX_MODEL_DIR, create_onnx_session, onnx_model_path  # noqa: E402
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".tif", ".tiff")
+
+def export_module(module: torch.nn.Module, example: torch.Tensor, model_name: str, input_name: str, output_name: str,
+                  dynamic_dims: dict, opset: int) -> str:
+    """Traces a module with one input and one output and writes it to `ONNX_MODEL_DIR`.
+
+    Args:
+        module (torch.nn.Module): The module, in eval mode.
+        example (torch.Tensor): The input it is traced with.
+        model_name (str): The name of the model file, without extension.
+        input_name (str): The name of the graph input.
+        output_name (str): The name of the graph output.
+        dynamic_dims (dict): The dynamic dimensions of the input, e.g. {0: "batch"}. The
+            batch dimension of the output is dynamic as well.
+        opset (int): The ONNX opset version.
+
+    Returns:
+        str: The path of the model file.
+    """
+    path = onnx_model_path(model_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with torch.no_grad():
+        torch.onnx.export(
+            module, (example,), path,
+            input_names=[input_name], output_names=[output_name],
+            dynamic_axes={input_name: dynamic_dims, output_name: {0: "batch"}},
+            opset_version=opset,
+            # The TorchScript-based exporter handles the models' Python control flow on
+            # static shapes, which the torch.export-based one rejects.
+            dynamo=False,
+        )
+    return path
+
+def check_parity(module: torch.nn.Module, model_name: str, inputs: torch.Tensor, input_name: str, atol: float) -> float:
+    """Runs a module in PyTorch and its export on ONNX Runtime and compares their outputs.
+
+    Args:
+        module (torch.nn.Module): The module.
+        model_name (str): The name of the exported model.
+        inputs (torch.Tensor): The input to compare on.
+        input_name (str): The name of the graph input.
+        atol (float): The largest absolute difference allowed.
+
+    Returns:
+        float: The largest absolute difference between the outputs.
+
+    Raises:
+        AssertionError: If the outputs differ by more than `atol`.
+    """
+    with torch.no_grad():
+        expected = module(inputs).float().numpy()
+    actual = create_onnx_session(model_name).run(None, {input_name: inputs.numpy()})[0]
+    assert actual.shape == expected.shape, f"{model_name}: output shape {actual.shape} != {expected.shape} in PyTorch"
+    difference = float(np.abs(actual - expected).max())
+    print(f"{model_name}: max abs difference to PyTorch {difference:.2e} on input {tuple(inputs.shape)}")
+    assert difference <= atol, f"{model_name}: outputs differ by {difference:.2e} > {atol:.0e}"
+    return difference
+
+def export_topiq(opset: int, atol: float):
+    """Exports TOPIQ-NR, which scores images at their native resolution."""
+    import pyiqa
+
+    metric = pyiqa.create_metric("topiq_nr", device=torch.device("cpu"))
+    net = metric.net.eval()
+    path = export_module(net, torch.rand(2, 3, 384, 512), "topiq_nr", "pixel_values", "score", {0: "batch", 2: "height", 3: "width"}, opset)
+    print(f"Exported {path}")
+    check_parity(net, "topiq_nr", torch.rand(3, 3, 480, 640), "pixel_values", atol)
+
+def export_yolo(opset: int, atol: float):
+    """Exports YOLOv10 with ultralytics' exporter, which also stores the class names and input size."""
+    from ultralytics import YOLO
+
+    model = YOLO("yolov10x.pt")
+    exported = model.export(format="onnx", dynamic=True, simplify=True, opset=opset, imgsz=640)
+    path = onnx_model_path("yolov10x")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    shutil.move(exported, path)
+    print(f"Exported {path}")
+    # The graph ends in a top-k over the detections, which near-ties reorder, so its rows
+    # are not compared one by one here; benchmarks/onnx_inference.py matches the boxes.
+    outputs = create_onnx_session("yolov10x").run(None, {"images": torch.rand(3, 3, 640, 640).numpy()})[0]
+    assert outputs.shape[0] == 3 and outputs.shape[2] == 6, f"yolov10x: unexpected output shape {outputs.shape}"
+    print(f"yolov10x: output {outputs.shape} on input (3, 3, 640, 640)")
+
+class FlorenceVisionEncoder(torch.nn.Module):
+    """The image encoder of Florence-2, up to the features its language model reads."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model._encode_image(pixel_values)
+
+def export_florence(opset: int, atol: float):
+    """Exports the Florence-2 vision encoder at the processor's input resolution."""
+    from transformers import AutoModelForCausalLM, AutoProcessor
+
+    model = AutoModelForCausalLM.from_pretrained("microsoft/Florence-2-base-ft", trust_remote_code=True).eval()
+    processor = AutoProcessor.from_pretrained("microsoft/Florence-2-base-ft", trust_remote_code=True)
+    size = processor.image_processor.size
+    encoder = FlorenceVisionEncoder(model).eval()
+    path = export_module(
+        encoder, torch.rand(2, 3, size["height"], size["width"]), "florence2_vision_encoder",
+        "pixel_values", "image_features", {0: "batch"}, opset
+    )
+    print(f"Exported {path}")
+    check_parity(encoder, "florence2_vision_encoder", torch.rand(3, 3, size["height"], size["width"]), "pixel_values", atol)
+
+def topiq_calibration_input(image):
+    """Returns the TOPIQ input of an image, downscaled so that calibration fits in memory."""
+    image.thumbnail((1024, 1024))
+    return np.asarray(image, dtype=np.float32).transpose(2, 0, 1)[None] / 255.0
+
+@functools.cache
+def _onnx_yolo():
+    """Returns the FP32 ONNX YOLO backend, whose letterbox the calibration reuses."""
+    from src.tasks.object_detection import OnnxYolo
+
+    backend = OnnxYolo(precision="fp32")
+    backend.load()
+    return backend
+
+def yolo_calibration_input(image):
+    """Returns the letterboxed YOLO input of an image, as `OnnxYolo` makes it."""
+    return _onnx_yolo()._letterbox(image)[0][None]
+
+@functools.cache
+def _florence_processor():
+    """Returns the Florence-2 processor, whose image preprocessing the calibration reuses."""
+    from transformers import AutoProcessor
+
+    return AutoProcessor.from_pretrained("microsoft/Florence-2-base-ft", trust_remote_code=True)
+
+def florence_calibration_input(image):
+    """Returns the vision encoder input of an image, as the Florence-2 processor makes it."""
+    return _florence_processor().image_processor(images=[image], return_tensors="np")["pixel_values"].astype(np.float32)
+
+# model name -> (FP32 export, graph input name, calibration input of one RGB image)
+EXPORTS = {
+    "topiq_nr": (export_topiq, "pixel_values", topiq_calibration_input),
+    "yolov10x": (export_yolo, "images", yolo_calibration_input),
+    "florence2_vision_encoder": (export_florence, "pixel_values", florence_calibration_input),
+}
+
+def sample_image_paths(count: int, directory: str | None = None) -> list[str]:
+    """Draws images at random from the library, or from a directory.
+
+    Args:
+        count (int): The number of images.
+        directory (str | None): A directory to search recursively, or None to sample the
+            `image` table.
+
+    Returns:
+        list[str]: The paths of the images.
+    """
+    if directory:
+        paths = [
+            os.path.join(root, name)
+            for root, _, names in os.walk(directory)
+            for name in names if name.lower().endswith(IMAGE_EXTENSIONS)
+        ]
+        return [str(path) for path in np.random.default_rng(0).permutation(paths)[:count]] if paths else []
+
+    conn = None
+    cur = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT storage_path FROM image ORDER BY random() LIMIT %s", (count,))
+        return [resolve_storage_path(storage_path) for (storage_path,) in cur.fetchall()]
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            release_db_connection(conn)
+
+def quantize(model_name: str, precision: str, calibration_paths: list[str]) -> str:
+    """Quantizes the FP32 export of a model to an INT8 variant.
+
+    Args:
+        model_name (str): The name of the model.
+        precision (str): "int8-dynamic" or "int8-static".
+        calibration_paths (list[str]): The images to calibrate the activation ranges on,
+            for "int8-static".
+
+    Returns:
+        str: The path of the quantized model.
+    """
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    _, input_name, calibration_input = EXPORTS[model_name]
+    source = onnx_model_path(model_name)
+    target = onnx_model_path(model_name, precision)
+
+    class CalibrationImages(CalibrationDataReader):
+        """Feeds the calibration images to the model one at a time."""
+
+        def __init__(self):
+            self.paths = iter(calibration_paths)
+
+        def get_next(self):
+            for path in self.paths:
+                try:
+                    with Image.open(path) as img:
+                        image = ImageOps.exif_transpose(img).convert("RGB")
+                except Exception as e:
+                    print(f"Skipping calibration image {path}: {e}")
+                    continue
+                return {input_name: calibration_input(image)}
+            return None
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Shape inference and graph cleanup, which ONNX Runtime recommends before quantizing.
+        prepared = os.path.join(directory, f"{model_name}.onnx")
+        quant_pre_process(source, prepared)
+        if precision == "int8-dynamic":
+            quantize_dynamic(prepared, target, op_types_to_quantize=["MatMul", "Gemm"], weight_type=QuantType.QInt8)
+        else:
+            if not calibration_paths:
+                raise ValueError("Static quantization needs calibration images; none were found.")
+            quantize_static(
+                prepared, target, CalibrationImages(),
+                quant_format=QuantFormat.QDQ, per_channel=True,
+                activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+            )
+    print(f"Quantized {target} ({os.path.getsize(source) / 2**20:.0f} MiB -> {os.path.getsize(target) / 2**20:.0f} MiB)")
+    return target
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("models", nargs="*", default=list(EXPORTS), choices=list(EXPORTS), help="Models to export.")
+    parser.add_argument("--opset", type=int, default=17, help="ONNX opset version.")
+    parser.add_argument("--atol", type=float, default=1e-3, help="Largest absolute difference to PyTorch allowed.")
+    parser.add_argument("--precision", nargs="+", default=["fp32"], choices=INFERENCE_PRECISIONS, help="Variants to write.")
+    parser.add_argument("--calibration-count", type=int, default=64, help="Images to calibrate static quantization on.")
+    parser.add_argument("--calibration-dir", help="Draw calibration images from this directory instead of the database.")
+    args = parser.parse_args()
+
+    calibration_paths = []
+    if "int8-static" in args.precision:
+        calibration_paths = sample_image_paths(args.calibration_count, args.calibration_dir)
+        print(f"Calibrating on {len(calibration_paths)} images")
+
+    print(f"Writing to {ONNX_MODEL_DIR}")
+    for name in args.models:
+        export, _, _ = EXPORTS[name]
+        if "fp32" in args.precision or not os.path.exists(onnx_model_path(name)):
+            export(args.opset, args.atol)
+        for precision in args.precision:
+            if precision != "fp32":
+                quantize(name, precision, calibration_paths)
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,42 @@
 """This module defines the FastAPI server for enqueuing and monitoring Celery tasks."""
-from fastapi import FastAPI, BackgroundTasks
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, BackgroundTasks, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from celery.result import AsyncResult
-from worker import process_image
-from src.db import get_db_connection, release_db_connection
-from src.statistics import calculate_user_statistics
+from worker import app as celery_app, process_image, process_project, expand_batch
+from src.tasks import DEFAULT_QUEUE, task_queue
+from src.db import DB_POOL_TIMEOUT_S
+from src.async_db import acquire, init_async_pool, close_async_pool, PoolTimeoutError
+from src.events import EVENT_HUB
+from src.statistics import calculate_user_statistics_async
+import os
 import uuid
 
-app = FastAPI()
+# Seconds between keep-alive comments on idle event streams, so proxies keep them open.
+EVENTS_KEEPALIVE_S = float(os.getenv("EVENTS_KEEPALIVE_S", "15"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_async_pool()
+    EVENT_HUB.start()
+    yield
+    EVENT_HUB.stop()
+    await close_async_pool()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request: Request, exc: PoolTimeoutError):
+    """Answers requests that found every database connection busy with 503, so clients back off and retry."""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "The server is busy, please retry."},
+        headers={"Retry-After": str(max(1, int(DB_POOL_TIMEOUT_S)))}
+    )
 
 class TaskRequest(BaseModel):
     """Request model for enqueuing a new image processing task."""
@@ -23,6 +52,15 @@ class AnalyzeRequestItem(BaseModel):
 
 class BatchAnalyzeRequest(BaseModel):
     requests: list[AnalyzeRequestItem]
+    # Run all tasks of an image in one `analyze_image` message that decodes the original once.
+    pipeline: bool = False
+
+class ProjectAnalyzeRequest(BaseModel):
+    """Request model for running a task over a whole project."""
+    project_id: str
+    task_name: str
+    # Optional job items, as [image_id, job_item_id] pairs, to update with the outcome.
+    items: list[list[str]] = []
 
 class TaskStatus(BaseModel):
     """Response model for the status of a Celery task."""
@@ -34,7 +72,7 @@ class StatisticsRequest(BaseModel):
     user_id: str
 
 @app.post("/statistics/", status_code=202)
-def calculate_statistics(stats_request: StatisticsRequest, background_tasks: BackgroundTasks):
+async def calculate_statistics(stats_request: StatisticsRequest, background_tasks: BackgroundTasks):
     """Calculates user statistics in the background.
     
     Args:
@@ -44,28 +82,57 @@ def calculate_statistics(stats_request: StatisticsRequest, background_tasks: Bac
     Returns:
         dict: A message indicating the calculation has started.
     """
-    background_tasks.add_task(calculate_user_statistics, stats_request.user_id)
+    background_tasks.add_task(calculate_user_statistics_async, stats_request.user_id)
     return {"message": "Statistics calculation started"}
 
 @app.post("/batch-analyze")
-def batch_analyze(batch_request: BatchAnalyzeRequest):
-    """Enqueues a batch of image processing tasks.
+async def batch_analyze(batch_request: BatchAnalyzeRequest):
+    """Accepts a batch of image processing tasks and returns right away.
 
     This endpoint receives a list of tasks (already recorded in the DB by the main backend)
-    and enqueues them to the Celery worker.
+    and publishes them as a single `expand_batch` message, which the broker persists. A
+    worker then turns it into the messages that process the items: items that are already
+    processed are marked skipped up front, tasks that depend on other tasks of the request
+    are scheduled per project (see `src.scheduling`), and the remaining items are routed
+    to their tasks' queues (see `src.tasks.task_queue`), in batches for tasks that support
+    batching. The request costs one publish however many items it holds.
+    With `pipeline` set, the tasks of each image that share a queue are instead sent together
+    to `analyze_image`, which reads and decodes the original file only once for all of them.
 
     Args:
         batch_request (BatchAnalyzeRequest): The request body containing the list of tasks.
 
     Returns:
-        dict: A message indicating the number of tasks enqueued.
+        dict: A message indicating the number of tasks accepted.
     """
-    for item in batch_request.requests:
-        process_image.delay(item.task_name, item.image_id, item.job_item_id)
+    items = [[item.image_id, item.task_name, item.job_item_id] for item in batch_request.requests]
+    # IDs repeat across items and compress well, which keeps large requests small on the wire.
+    await run_in_threadpool(
+        expand_batch.apply_async, (items, batch_request.pipeline), queue=DEFAULT_QUEUE, compression="gzip"
+    )
     return {"message": "Batch analysis started", "count": len(batch_request.requests)}
 
+@app.post("/project-analyze", response_model=TaskStatus)
+def project_analyze(project_request: ProjectAnalyzeRequest):
+    """Enqueues a project-level run of a task.
+
+    The task processes all images of the project that it has not processed yet in bulk,
+    e.g. EXIF extraction with parallel header reads and multi-row upserts.
+
+    Args:
+        project_request (ProjectAnalyzeRequest): The request body containing the project ID and task name.
+
+    Returns:
+        TaskStatus: The initial status of the enqueued task.
+    """
+    task = process_project.apply_async(
+        (project_request.task_name, project_request.project_id, project_request.items),
+        queue=task_queue(project_request.task_name)
+    )
+    return TaskStatus(task_id=task.id, status="PENDING")
+
 @app.post("/tasks/", response_model=TaskStatus)
-def enqueue_task(task_request: TaskRequest):
+async def enqueue_task(task_request: TaskRequest):
     """Enqueues a new image processing task.
 
     This endpoint creates a new analysis job and a corresponding job item in the database,
@@ -77,39 +144,31 @@ def enqueue_task(task_request: TaskRequest):
     Returns:
         TaskStatus: The initial status of the enqueued task.
     """
-    conn = None
-    cur = None
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
+    job_id = str(uuid.uuid4())
+    job_item_id = str(uuid.uuid4())
+    async with acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                """
+                INSERT INTO analysis_job (id, project_id, user_id, job_type, job_status, created_at, updated_at)
+                VALUES ($1, $2, $3, $4, $5, NOW(), NOW())
+                """,
+                job_id, task_request.project_id, task_request.user_id, task_request.task_name, "pending"
+            )
+            await conn.execute(
+                """
+                INSERT INTO analysis_job_item (id, job_id, image_id, created_at)
+                VALUES ($1, $2, $3, NOW())
+                """,
+                job_item_id, job_id, task_request.image_id
+            )
 
-        job_id = str(uuid.uuid4())
-        cur.execute(
-            """
-            INSERT INTO analysis_job (id, project_id, user_id, job_type, job_status, created_at, updated_at)
-            VALUES (%s, %s, %s, %s, %s, NOW(), NOW())
-            """,
-            (job_id, task_request.project_id, task_request.user_id, task_request.task_name, "pending")
-        )
-
-        job_item_id = str(uuid.uuid4())
-        cur.execute(
-            """
-            INSERT INTO analysis_job_item (id, job_id, image_id, created_at)
-            VALUES (%s, %s, %s, NOW())
-            """,
-            (job_item_id, job_id, task_request.image_id)
-        )
-
-        conn.commit()
-
-        task = process_image.delay(task_request.task_name, task_request.image_id, job_item_id)
-        return TaskStatus(task_id=task.id, status="PENDING")
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            release_db_connection(conn)
+    task = await run_in_threadpool(
+        process_image.apply_async,
+        (task_request.task_name, task_request.image_id, job_item_id),
+        queue=task_queue(task_request.task_name)
+    )
+    return TaskStatus(task_id=task.id, status="PENDING")
 
 @app.get("/tasks/{task_id}", response_model=TaskStatus)
 def get_task_status(task_id: str):
@@ -124,3 +183,131 @@ def get_task_status(task_id: str):
     task_result = AsyncResult(task_id)
     result = task_result.result if task_result.ready() else None
     return TaskStatus(task_id=task_id, status=task_result.status, result=result)
+
+@app.get("/jobs/{job_id}/progress")
+async def get_job_progress(job_id: str):
+    """Retrieves the progress of an analysis job.
+
+    The item counters of `analysis_job` are kept up to date by a trigger on its items, and
+    the same trigger moves the job to 'processing' and 'completed'. Reading the progress
+    is therefore a single primary key lookup, however many items the job has.
+
+    Args:
+        job_id (str): The ID of the analysis job.
+
+    Returns:
+        dict: The job status, the item counts per status, the throughput in items per
+              second since the first item started, and the estimated seconds remaining.
+    """
+    async with acquire() as conn:
+        row = await conn.fetchrow(
+            """
+            SELECT job_status, total_items, pending_items, processing_items, completed_items,
+                   skipped_items, failed_items, started_at, completed_at, LOCALTIMESTAMP
+            FROM analysis_job
+            WHERE id = $1
+            """,
+            job_id
+        )
+    if not row:
+        raise HTTPException(status_code=404, detail=f"Analysis job '{job_id}' not found.")
+
+    status, total, pending, processing, completed, skipped, failed, started_at, completed_at, now = row
+    finished = completed + skipped + failed
+    elapsed = ((completed_at or now) - started_at).total_seconds() if started_at else 0.0
+    throughput = finished / elapsed if elapsed > 0 else 0.0
+    remaining = pending + processing
+    return {
+        "job_id": job_id,
+        "status": status,
+        "total": total,
+        "pending": pending,
+        "processing": processing,
+        "completed": completed,
+        "skipped": skipped,
+        "failed": failed,
+        "progress_percentage": finished / total * 100 if total else 0.0,
+        "items_per_second": throughput,
+        "eta_seconds": remaining / throughput if throughput > 0 else (0.0 if remaining == 0 else None),
+        "started_at": started_at,
+        "completed_at": completed_at,
+    }
+
+async def _event_stream(request: Request, kind: str, key: str, queue: asyncio.Queue, initial: dict | None = None):
+    """Streams the events of a subscription as Server-Sent Events until the client disconnects.
+
+    Args:
+        request (Request): The request of the stream, to detect disconnects.
+        kind (str): The kind of the subscription, "job" or "project".
+        key (str): The ID of the job or project.
+        queue (asyncio.Queue): The subscription's queue, from `EVENT_HUB.subscribe`.
+        initial (dict | None): An event to send first, e.g. the current progress.
+
+    Yields:
+        str: The SSE frames.
+    """
+    try:
+        if initial is not None:
+            yield f"event: {initial['type']}\ndata: {json.dumps(initial, default=str)}\n\n"
+        while not await request.is_disconnected():
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=EVENTS_KEEPALIVE_S)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: {event.get('type', 'message')}\ndata: {json.dumps(event, default=str)}\n\n"
+    finally:
+        EVENT_HUB.unsubscribe(kind, key, queue)
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, request: Request):
+    """Streams the progress of an analysis job as Server-Sent Events.
+
+    The stream starts with the current progress and then carries an `items` event for every
+    batch of finished items and a `job_progress` event whenever the counters change, as the
+    workers write them. One open stream replaces polling `/jobs/{job_id}/progress`.
+
+    Args:
+        job_id (str): The ID of the analysis job.
+        request (Request): The incoming request.
+
+    Returns:
+        StreamingResponse: The `text/event-stream` response.
+    """
+    # Subscribe before reading the snapshot so no event falls in between.
+    queue = EVENT_HUB.subscribe("job", job_id)
+    try:
+        progress = await get_job_progress(job_id)
+    except HTTPException:
+        EVENT_HUB.unsubscribe("job", job_id, queue)
+        raise
+    initial = {"type": "job_progress", **progress}
+    return StreamingResponse(_event_stream(request, "job", job_id, queue, initial), media_type="text/event-stream")
+
+@app.get("/projects/{project_id}/events")
+async def stream_project_events(project_id: str, request: Request):
+    """Streams the events of a project as Server-Sent Events.
+
+    Carries the job events of all of the project's jobs, plus `thumbnail`, `quality_score`,
+    `groups_replaced`, `group_members_added` and `groups_merged` events as the workers
+    produce thumbnails, scores and groups.
+
+    Args:
+        project_id (str): The ID of the project.
+        request (Request): The incoming request.
+
+    Returns:
+        StreamingResponse: The `text/event-stream` response.
+    """
+    queue = EVENT_HUB.subscribe("project", project_id)
+    return StreamingResponse(_event_stream(request, "project", project_id, queue), media_type="text/event-stream")
+
+@app.get("/worker-stats")
+def get_worker_stats():
+    """Collects batching, model residency, warm-up and generation statistics from all running workers.
+
+    Returns:
+        dict: The statistics keyed by worker hostname.
+    """
+    replies = celery_app.control.broadcast("worker_stats", reply=True, timeout=2.0)
+    return {hostname: stats for reply in replies for hostname, stats in reply.items()}
@@ -0,0 +1,114 @@
+"""This module provides the asyncio connection pool used by the FastAPI server."""
+import os
+import re
+import urllib.parse
+from contextlib import asynccontextmanager
+import asyncpg
+from psycopg2.extensions import parse_dsn
+from .db import DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT_S
+
+# Prepared statements cached per connection. asyncpg prepares every query it runs and
+# reuses the plan on the next call; set this to 0 behind a transaction-mode pgbouncer.
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+
+_pool = None
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection became available within `DB_POOL_TIMEOUT_S`."""
+
+# The libpq connection parameters that asyncpg reads from a DSN. `application_name` is a
+# server setting, which asyncpg passes on to the server like libpq does.
+_ASYNCPG_DSN_KEYS = {
+    "host", "port", "dbname", "user", "password", "passfile", "service", "application_name",
+    "sslmode", "sslcert", "sslkey", "sslrootcert", "sslcrl", "sslpassword", "sslnegotiation",
+    "ssl_min_protocol_version", "ssl_max_protocol_version", "target_session_attrs", "krbsrvname", "gsslib",
+}
+
+def _connect_kwargs(dsn: str | None) -> dict:
+    """Translates `DB_DSN` into asyncpg connection arguments.
+
+    asyncpg only understands URIs, while `DB_DSN` may also be a libpq "key=value" string.
+    Such strings are rewritten to the equivalent URI, with every parameter in its query
+    string, so that asyncpg sees the same connection settings as psycopg2.
+
+    Args:
+        dsn (str | None): The DSN.
+
+    Returns:
+        dict: The keyword arguments for `asyncpg.create_pool`.
+
+    Raises:
+        ValueError: If the DSN sets parameters that asyncpg does not support.
+    """
+    if not dsn or dsn.startswith(("postgres://", "postgresql://")):
+        return {"dsn": dsn}
+    params = parse_dsn(dsn)
+    unsupported = sorted(set(params) - _ASYNCPG_DSN_KEYS)
+    if unsupported:
+        raise ValueError(f"DB_DSN parameters not supported by the asyncio pool: {', '.join(unsupported)}")
+    return {"dsn": "postgresql://?" + urllib.parse.urlencode(params)}
+
+async def init_async_pool():
+    """Creates the pool. Called once when the server starts."""
+    global _pool
+    if _pool is None:
+        _pool = await asyncpg.create_pool(
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+            **_connect_kwargs(os.getenv("DB_DSN"))
+        )
+
+async def close_async_pool():
+    """Closes the pool, waiting for connections in use to be released."""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+@asynccontextmanager
+async def acquire():
+    """Borrows a connection from the pool for the duration of an `async with` block.
+
+    If all connections are in use, waits up to `DB_POOL_TIMEOUT_S` seconds for one to be
+    released without blocking the event loop.
+
+    Yields:
+        asyncpg.Connection: The connection.
+
+    Raises:
+        PoolTimeoutError: If no connection became available in time.
+    """
+    if _pool is None:
+        await init_async_pool()
+    try:
+        conn = await _pool.acquire(timeout=DB_POOL_TIMEOUT_S)
+    except TimeoutError as exc:
+        raise PoolTimeoutError(f"No database connection became available within {DB_POOL_TIMEOUT_S}s") from exc
+    try:
+        yield conn
+    finally:
+        await _pool.release(conn)
+
+def to_numbered(query: str, params: dict) -> tuple[str, list]:
+    """Converts a query with psycopg2 `%(name)s` placeholders to asyncpg `$n` placeholders.
+
+    Lets queries written with named placeholders, like the statements of `src.statistics`,
+    run on the asyncio pool.
+
+    Args:
+        query (str): The query.
+        params (dict): The values of the placeholders.
+
+    Returns:
+        tuple: The query with numbered placeholders and the list of their values.
+    """
+    names = []
+
+    def number(match):
+        if match.group(1) not in names:
+            names.append(match.group(1))
+        return f"${names.index(match.group(1)) + 1}"
+
+    query = re.sub(r"%\((\w+)\)s", number, query)
+    return query, [params[name] for name in names]
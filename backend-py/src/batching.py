@@ -0,0 +1,51 @@
+"""This module provides the batch size settings and per-batch-size throughput statistics."""
+import os
+import threading
+from collections import defaultdict
+
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+
+class BatchThroughputStats:
+    """Accumulates processing throughput per task and batch size."""
+
+    def __init__(self):
+        self._stats = defaultdict(lambda: {"batches": 0, "images": 0, "seconds": 0.0})
+        self._lock = threading.Lock()
+
+    def record(self, task_name: str, batch_size: int, seconds: float) -> float:
+        """Records one processed batch.
+
+        Args:
+            task_name (str): The name of the task that processed the batch.
+            batch_size (int): The number of images in the batch.
+            seconds (float): The wall-clock time spent processing the batch.
+
+        Returns:
+            float: The average throughput in images per second for this task and batch size so far.
+        """
+        with self._lock:
+            entry = self._stats[(task_name, batch_size)]
+            entry["batches"] += 1
+            entry["images"] += batch_size
+            entry["seconds"] += seconds
+            return entry["images"] / entry["seconds"] if entry["seconds"] > 0 else 0.0
+
+    def summary(self) -> list[dict]:
+        """Returns the accumulated statistics.
+
+        Returns:
+            list[dict]: One entry per (task name, batch size) with batch count, image count and throughput.
+        """
+        with self._lock:
+            return [
+                {
+                    "task_name": task_name,
+                    "batch_size": batch_size,
+                    "batches": entry["batches"],
+                    "images": entry["images"],
+                    "images_per_second": entry["images"] / entry["seconds"] if entry["seconds"] > 0 else 0.0,
+                }
+                for (task_name, batch_size), entry in sorted(self._stats.items())
+            ]
+
+BATCH_STATS = BatchThroughputStats()
@@ -0,0 +1,258 @@
+"""This module provides the vectorized distance computations and union-find used by project-wide grouping."""
+import numpy as np
+
+# Number of set bits of every 16-bit value, for popcounts without `np.bitwise_count` (NumPy 2 only).
+_POPCOUNT_16 = np.array([bin(value).count("1") for value in range(1 << 16)], dtype=np.uint8)
+
+# Upper bound on the number of pairwise distances computed at once, to bound memory.
+MAX_BLOCK_ELEMENTS = 1 << 20
+
+def hamming_distances(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Computes the pairwise Hamming distances between two arrays of 64-bit hashes.
+
+    Args:
+        a (numpy.ndarray): A uint64 array of m hashes.
+        b (numpy.ndarray): A uint64 array of n hashes.
+
+    Returns:
+        numpy.ndarray: An m x n uint8 array of distances.
+    """
+    xor = np.bitwise_xor(a[:, None], b[None, :])
+    counts = _POPCOUNT_16[xor.view(np.uint16)]
+    return counts[:, 0::4] + counts[:, 1::4] + counts[:, 2::4] + counts[:, 3::4]
+
+def windowed_hamming_pairs(values: np.ndarray, times: np.ndarray, window: int, max_distance: int) -> tuple[np.ndarray, np.ndarray]:
+    """Finds all pairs of hashes that are close both in time and in Hamming distance.
+
+    The hashes must be sorted by time. Rows are processed in blocks; each block is only
+    compared with the columns that fall inside the time window of its last row, and the
+    block height is chosen so that a block never exceeds `MAX_BLOCK_ELEMENTS` distances.
+
+    Args:
+        values (numpy.ndarray): A uint64 array of hashes, sorted by `times`.
+        times (numpy.ndarray): An int64 array of timestamps, in ascending order.
+        window (int): The maximum time difference of a pair, inclusive, in the unit of `times`.
+        max_distance (int): The maximum Hamming distance of a pair, inclusive.
+
+    Returns:
+        tuple: Two int64 arrays (i, j) with i < j for every matching pair.
+    """
+    count = len(values)
+    if count < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    # Exclusive end of the time window of every row. Non-decreasing, because times are sorted.
+    window_ends = np.searchsorted(times, times + window, side="right")
+    # A block of h rows spans at least h columns, so it never needs more than sqrt(budget) rows.
+    max_rows = int(np.sqrt(MAX_BLOCK_ELEMENTS)) + 1
+
+    pairs_i, pairs_j = [], []
+    start = 0
+    while start < count:
+        ends = window_ends[start:start + max_rows]
+        costs = np.arange(1, len(ends) + 1) * (ends - start)
+        stop = start + max(1, int(np.searchsorted(costs, MAX_BLOCK_ELEMENTS, side="right")))
+        column_end = int(window_ends[stop - 1])
+
+        distances = hamming_distances(values[start:stop], values[start:column_end])
+        rows = np.arange(start, stop)[:, None]
+        columns = np.arange(start, column_end)[None, :]
+        mask = (distances <= max_distance) & (columns > rows) & (columns < window_ends[start:stop, None])
+        block_i, block_j = np.nonzero(mask)
+        pairs_i.append(block_i + start)
+        pairs_j.append(block_j + start)
+        start = stop
+
+    return np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+class UnionFind:
+    """A disjoint-set forest over the integers 0..size-1.
+
+    The root of every set is its smallest element, so the components do not depend on
+    the order in which pairs are united.
+    """
+
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, x: int) -> int:
+        """Returns the root of the set containing `x`, halving the path on the way."""
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a: int, b: int):
+        """Merges the sets containing `a` and `b`."""
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return
+        if root_a < root_b:
+            self.parent[root_b] = root_a
+        else:
+            self.parent[root_a] = root_b
+
+    def union_pairs(self, pairs_i, pairs_j):
+        """Merges the sets of every pair (pairs_i[k], pairs_j[k])."""
+        find = self.find
+        parent = self.parent
+        for a, b in zip(np.asarray(pairs_i).tolist(), np.asarray(pairs_j).tolist()):
+            root_a, root_b = find(a), find(b)
+            if root_a < root_b:
+                parent[root_b] = root_a
+            elif root_b < root_a:
+                parent[root_a] = root_b
+
+    def components(self, min_size: int = 2) -> list[list[int]]:
+        """Returns the sets with at least `min_size` elements.
+
+        Args:
+            min_size (int): The minimum number of elements of a returned set.
+
+        Returns:
+            list[list[int]]: The sets, each in ascending order, ordered by their smallest element.
+        """
+        members = {}
+        for x in range(len(self.parent)):
+            members.setdefault(self.find(x), []).append(x)
+        return [component for root, component in sorted(members.items()) if len(component) >= min_size]
+
+EARTH_RADIUS_M = 6371000.0
+
+def haversine_distances(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Computes element-wise great-circle distances.
+
+    Args:
+        lat1 (numpy.ndarray): Latitudes of the first points, in degrees.
+        lon1 (numpy.ndarray): Longitudes of the first points, in degrees.
+        lat2 (numpy.ndarray): Latitudes of the second points, in degrees.
+        lon2 (numpy.ndarray): Longitudes of the second points, in degrees.
+
+    Returns:
+        numpy.ndarray: The distances in meters.
+    """
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    a = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+# Cell offsets to the neighbours that can hold points within the radius, one of each +/- pair.
+_HALF_NEIGHBOURHOOD = [
+    (dx, dy, dz)
+    for dx in range(-2, 3) for dy in range(-2, 3) for dz in range(-2, 3)
+    if (dx, dy, dz) > (0, 0, 0)
+]
+
+def radius_components(latitudes: np.ndarray, longitudes: np.ndarray, radius_m: float) -> np.ndarray:
+    """Labels the connected components of points linked by great-circle distances of at most `radius_m`.
+
+    Points are placed on a grid over their unit-sphere coordinates (scaled to meters) with
+    cells of half the radius. Every pair of points within the radius is then at most two
+    cells apart on each axis. A cell's diagonal is shorter than the radius, so the points
+    of a cell always form one component and union-find only runs over cells: two
+    neighbouring cells are united as soon as any of their point pairs is close enough.
+    Working on 3D coordinates avoids special cases at the poles and the antimeridian.
+
+    Args:
+        latitudes (numpy.ndarray): The latitudes of the points, in degrees.
+        longitudes (numpy.ndarray): The longitudes of the points, in degrees.
+        radius_m (float): The maximum distance between linked points, in meters.
+
+    Returns:
+        numpy.ndarray: A component label per point; points share a label if and only if they are connected.
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    count = len(latitudes)
+    if count == 0:
+        return np.empty(0, dtype=np.int64)
+
+    phi, lam = np.radians(latitudes), np.radians(longitudes)
+    xyz = EARTH_RADIUS_M * np.stack([np.cos(phi) * np.cos(lam), np.cos(phi) * np.sin(lam), np.sin(phi)], axis=1)
+    cells = np.floor(xyz / (radius_m / 2)).astype(np.int64)
+    # Pad by two cells on every side so neighbour offsets never wrap into another row of the key space.
+    cells -= cells.min(axis=0) - 2
+    dims = cells.max(axis=0) + 3
+    keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+
+    order = np.argsort(keys, kind="stable")
+    lat_sorted, lon_sorted = latitudes[order], longitudes[order]
+    cell_keys, cell_starts, cell_counts = np.unique(keys[order], return_index=True, return_counts=True)
+    candidates_a, candidates_b = [], []
+    for dx, dy, dz in _HALF_NEIGHBOURHOOD:
+        offset = (dx * dims[1] + dy) * dims[2] + dz
+        targets = np.searchsorted(cell_keys, cell_keys + offset)
+        found = targets < len(cell_keys)
+        found[found] = cell_keys[targets[found]] == cell_keys[found] + offset
+        candidates_a.append(np.nonzero(found)[0])
+        candidates_b.append(targets[found])
+    a_cells, b_cells = np.concatenate(candidates_a), np.concatenate(candidates_b)
+
+    # Check cheap cell pairs first: once they have connected two dense cells through other
+    # cells, the expensive direct check between those cells is skipped.
+    by_cost = np.argsort(cell_counts[a_cells] * cell_counts[b_cells], kind="stable")
+    union_find = UnionFind(len(cell_keys))
+    _unite_close_cells(union_find, a_cells[by_cost], b_cells[by_cost], cell_starts, cell_counts, lat_sorted, lon_sorted, radius_m)
+
+    cell_labels = np.array([union_find.find(cell) for cell in range(len(cell_keys))], dtype=np.int64)
+    labels = np.empty(count, dtype=np.int64)
+    labels[order] = np.repeat(cell_labels, cell_counts)
+    return labels
+
+def _unite_close_cells(union_find, a_cells, b_cells, cell_starts, cell_counts, latitudes, longitudes, radius_m):
+    """Unites the candidate cell pairs that hold at least one pair of points within the radius.
+
+    Candidates are taken in order and gathered into chunks of at most `MAX_BLOCK_ELEMENTS`
+    point pairs, whose distances are computed at once. Pairs of cells that are already
+    connected are skipped, and a cell pair larger than a chunk is checked row block by
+    row block until a close pair is found.
+
+    Args:
+        union_find (UnionFind): The union-find over the cells.
+        a_cells (numpy.ndarray): The first cell of every candidate pair.
+        b_cells (numpy.ndarray): The second cell of every candidate pair.
+        cell_starts (numpy.ndarray): The offset of every cell's points in the sorted point arrays.
+        cell_counts (numpy.ndarray): The number of points of every cell.
+        latitudes (numpy.ndarray): The point latitudes, sorted by cell.
+        longitudes (numpy.ndarray): The point longitudes, sorted by cell.
+        radius_m (float): The maximum distance, in meters.
+    """
+    def check(blocks):
+        # blocks: (a cell, b cell, a start, a count, b start, b count) tuples
+        a, b, a_starts, a_counts, b_starts, b_counts = (np.array(column, dtype=np.int64) for column in zip(*blocks))
+        totals = a_counts * b_counts
+        pair = np.repeat(np.arange(len(blocks)), totals)
+        local = np.arange(int(totals.sum())) - np.repeat(np.cumsum(totals) - totals, totals)
+        rows = a_starts[pair] + local // b_counts[pair]
+        columns = b_starts[pair] + local % b_counts[pair]
+        close = haversine_distances(latitudes[rows], longitudes[rows], latitudes[columns], longitudes[columns]) <= radius_m
+        for index in np.unique(pair[close]).tolist():
+            union_find.union(int(a[index]), int(b[index]))
+
+    blocks, pending = [], 0
+    for a, b in zip(a_cells.tolist(), b_cells.tolist()):
+        if union_find.find(a) == union_find.find(b):
+            continue
+        a_start, a_count = int(cell_starts[a]), int(cell_counts[a])
+        b_start, b_count = int(cell_starts[b]), int(cell_counts[b])
+        if a_count * b_count > MAX_BLOCK_ELEMENTS:
+            if blocks:
+                check(blocks)
+                blocks, pending = [], 0
+                if union_find.find(a) == union_find.find(b):
+                    continue
+            rows = max(1, MAX_BLOCK_ELEMENTS // b_count)
+            for start in range(0, a_count, rows):
+                check([(a, b, a_start + start, min(rows, a_count - start), b_start, b_count)])
+                if union_find.find(a) == union_find.find(b):
+                    break
+            continue
+        if pending + a_count * b_count > MAX_BLOCK_ELEMENTS:
+            check(blocks)
+            blocks, pending = [], 0
+            if union_find.find(a) == union_find.find(b):
+                continue
+        blocks.append((a, b, a_start, a_count, b_start, b_count))
+        pending += a_count * b_count
+    if blocks:
+        check(blocks)
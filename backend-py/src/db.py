@@ -1,12 +1,21 @@
 """This module provides a function to connect to the PostgreSQL database."""
 import os
+import threading
 import psycopg2
 from psycopg2 import pool
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Pool sizing, shared with the server's asyncio pool in `src.async_db`.
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "20"))
+# Seconds to wait for a free connection before giving up.
+DB_POOL_TIMEOUT_S = float(os.getenv("DB_POOL_TIMEOUT_S", "10"))
+
 _pool = None
+# Counts the free connections, so callers wait for one instead of failing when the pool is exhausted.
+_available = threading.Semaphore(DB_POOL_MAX_SIZE)
 
 def init_db_pool():
     global _pool
@@ -14,8 +23,8 @@ def init_db_pool():
         try:
             # Initialize the connection pool
             _pool = psycopg2.pool.ThreadedConnectionPool(
-                minconn=1,
-                maxconn=20,
+                minconn=DB_POOL_MIN_SIZE,
+                maxconn=DB_POOL_MAX_SIZE,
                 dsn=os.getenv("DB_DSN")
             )
         except (Exception, psycopg2.DatabaseError) as error:
@@ -25,14 +34,25 @@ def init_db_pool():
 def get_db_connection():
     """Gets a connection from the connection pool.
 
+    If all connections are in use, waits up to `DB_POOL_TIMEOUT_S` seconds for one to be released.
+
     Returns:
         psycopg2.extensions.connection: A connection object to the database.
+
+    Raises:
+        psycopg2.pool.PoolError: If no connection became available in time.
     """
     global _pool
     if _pool is None:
         init_db_pool()
-    
-    return _pool.getconn()
+
+    if not _available.acquire(timeout=DB_POOL_TIMEOUT_S):
+        raise psycopg2.pool.PoolError(f"No database connection became available within {DB_POOL_TIMEOUT_S}s")
+    try:
+        return _pool.getconn()
+    except Exception:
+        _available.release()
+        raise
 
 def release_db_connection(conn):
     """Releases the connection back to the pool.
@@ -46,6 +66,8 @@ def release_db_connection(conn):
             _pool.putconn(conn)
         except Exception as e:
             print(f"Error releasing connection: {e}")
+        finally:
+            _available.release()
 
 def close_pool():
     """Closes the connection pool."""
@@ -0,0 +1,181 @@
+"""This module publishes analysis events through Postgres NOTIFY and fans them out to server-side subscribers."""
+import asyncio
+import json
+import os
+import psycopg2
+
+EVENTS_CHANNEL = os.getenv("EVENTS_CHANNEL", "analysis_events")
+# Events buffered per subscriber before the oldest are dropped for a client that does not keep up.
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "1000"))
+
+def publish(cur, event: dict):
+    """Publishes an event with the transaction of `cur`.
+
+    Postgres delivers the notification when the transaction commits and drops it on a
+    rollback, so listeners only hear about data they can read. The payload must stay
+    under 8000 bytes.
+
+    Args:
+        cur (psycopg2.extensions.cursor): The database cursor.
+        event (dict): The event. It should carry a `type` and a `project_id` and/or `job_id`.
+    """
+    cur.execute("SELECT pg_notify(%s, %s)", (EVENTS_CHANNEL, json.dumps(event, default=str)))
+
+def publish_for_image(cur, event: dict, image_id: str):
+    """Publishes an event about an image, adding its `image_id` and `project_id`.
+
+    Args:
+        cur (psycopg2.extensions.cursor): The database cursor.
+        event (dict): The event.
+        image_id (str): The ID of the image.
+    """
+    cur.execute(
+        """
+        SELECT pg_notify(%s, (%s::jsonb || jsonb_build_object('image_id', id, 'project_id', project_id))::text)
+        FROM image WHERE id = %s
+        """,
+        (EVENTS_CHANNEL, json.dumps(event, default=str), image_id)
+    )
+
+def publish_for_group(cur, event: dict, group_id: str):
+    """Publishes an event about an image group, adding its `group_id`, `group_type` and `project_id`.
+
+    Args:
+        cur (psycopg2.extensions.cursor): The database cursor.
+        event (dict): The event.
+        group_id (str): The ID of the group.
+    """
+    cur.execute(
+        """
+        SELECT pg_notify(%s, (%s::jsonb || jsonb_build_object('group_id', id, 'group_type', group_type, 'project_id', project_id))::text)
+        FROM image_group WHERE id = %s
+        """,
+        (EVENTS_CHANNEL, json.dumps(event, default=str), group_id)
+    )
+
+class EventHub:
+    """Listens on the events channel and hands every event to the subscribers of its job and project.
+
+    A single dedicated connection LISTENs on behalf of all clients of the server. It is
+    read from the event loop through `add_reader`, so no thread is parked waiting for
+    notifications. Connecting blocks until the server answers, so it runs in the loop's
+    default executor, keeping requests responsive while Postgres is slow or down. If the
+    connection drops, it is re-established after a short delay.
+    """
+
+    def __init__(self, dsn: str | None = None):
+        """Initializes the hub.
+
+        Args:
+            dsn (str | None): The database DSN, or None to use `DB_DSN`.
+        """
+        self._dsn = dsn or os.getenv("DB_DSN")
+        self._conn = None
+        self._loop = None
+        self._stopped = True
+        self._reconnect = None  # The `call_later` handle of a scheduled connect.
+        self._connect_task = None
+        self._subscribers = {}  # ("job" | "project", ID) -> set of queues
+
+    def start(self):
+        """Starts connecting and listening in the background. Must be called from the running event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._stopped = False
+        self._schedule_connect(0)
+
+    def stop(self):
+        """Stops listening and closes the connection."""
+        self._stopped = True
+        # A connect in progress cannot be interrupted; it closes its connection once it sees `_stopped`.
+        if self._reconnect is not None:
+            self._reconnect.cancel()
+            self._reconnect = None
+        self._close()
+
+    def _close(self):
+        if self._conn is not None:
+            self._loop.remove_reader(self._conn.fileno())
+            self._conn.close()
+            self._conn = None
+
+    def _schedule_connect(self, delay: float):
+        def connect():
+            self._reconnect = None
+            # The loop keeps only weak references to tasks.
+            self._connect_task = self._loop.create_task(self._connect())
+        self._reconnect = self._loop.call_later(delay, connect)
+
+    def _open(self):
+        """Opens the listening connection. Blocks, so it runs in the executor."""
+        conn = psycopg2.connect(self._dsn)
+        try:
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(f'LISTEN "{EVENTS_CHANNEL}"')
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    async def _connect(self):
+        try:
+            conn = await self._loop.run_in_executor(None, self._open)
+        except psycopg2.Error as exc:
+            if not self._stopped:
+                print(f"Could not listen for events, retrying in 5s: {exc}")
+                self._schedule_connect(5)
+            return
+        if self._stopped:
+            conn.close()
+            return
+        self._conn = conn
+        self._loop.add_reader(conn.fileno(), self._on_readable)
+
+    def _on_readable(self):
+        try:
+            self._conn.poll()
+        except psycopg2.Error as exc:
+            print(f"Lost the events connection, reconnecting: {exc}")
+            self._close()
+            self._schedule_connect(1)
+            return
+        while self._conn.notifies:
+            notify = self._conn.notifies.pop(0)
+            try:
+                event = json.loads(notify.payload)
+            except ValueError:
+                continue
+            self._dispatch(event)
+
+    def _dispatch(self, event: dict):
+        """Puts an event on the queues of its job's and its project's subscribers."""
+        keys = [("job", event.get("job_id")), ("project", event.get("project_id"))]
+        for key in keys:
+            for queue in self._subscribers.get(key, ()):
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(event)
+
+    def subscribe(self, kind: str, key: str) -> asyncio.Queue:
+        """Subscribes to the events of a job or a project.
+
+        Args:
+            kind (str): "job" or "project".
+            key (str): The ID of the job or project.
+
+        Returns:
+            asyncio.Queue: The queue the events are put on. Pass it to `unsubscribe` when done.
+        """
+        queue = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+        self._subscribers.setdefault((kind, key), set()).add(queue)
+        return queue
+
+    def unsubscribe(self, kind: str, key: str, queue: asyncio.Queue):
+        """Removes a subscription made with `subscribe`."""
+        queues = self._subscribers.get((kind, key))
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[(kind, key)]
+
+EVENT_HUB = EventHub()
@@ -0,0 +1,92 @@
+"""This module runs task methods according to the execution policy their task declares."""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from .db import DB_POOL_MAX_SIZE
+from .tasks import get_task_class
+
+# How a task's work runs inside a worker:
+# - "inline": one at a time, however many Celery threads the worker has. For tasks that
+#   share a model and the accelerator, which must not run concurrently.
+# - "thread": on the Celery thread that received the message, concurrently with other
+#   messages. For tasks whose heavy lifting (file reads, decoding, encoding) releases the GIL.
+# - "process": in a separate process of a pool. For CPU-bound Python work that holds the GIL.
+EXECUTION_POLICIES = ("inline", "thread", "process")
+
+# The number of messages a worker handles concurrently when any of its tasks is not inline.
+# Every message holds up to one pooled database connection at a time, so by default the
+# worker keeps half of the pool for the job status recorder and the tasks' own writes.
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY") or max(1, min(os.cpu_count() or 1, DB_POOL_MAX_SIZE // 2)))
+# The number of processes of the pool that runs the tasks with the "process" policy.
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES") or os.cpu_count() or 1)
+
+_inline_lock = threading.Lock()
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    """Returns the process pool, starting it on first use.
+
+    The processes are spawned rather than forked, so they do not inherit the worker's
+    database connections, broker connection or loaded models.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=max(1, WORKER_PROCESSES),
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _process_pool
+
+def _run_in_process(task_name: str, method: str, args: tuple):
+    """Runs a task method in a pool process, importing the task's module on first use there."""
+    return getattr(get_task_class(task_name)(), method)(*args)
+
+def uses_concurrency(task_specs) -> bool:
+    """Returns whether any of the given tasks may run concurrently with others.
+
+    Args:
+        task_specs (iterable[TaskSpec]): The specs of the tasks a worker runs.
+
+    Returns:
+        bool: True if any of them has the "thread" or "process" policy.
+    """
+    return any(spec.execution != "inline" for spec in task_specs)
+
+def execute(task_name: str, task_instance, method: str, *args):
+    """Calls a method of a task according to the task's execution policy.
+
+    With the "process" policy, the arguments and the result are pickled. Methods that take
+    an in-memory `DecodedImage` (`run_decoded`) therefore run on the calling thread instead.
+
+    Args:
+        task_name (str): The name the task is registered with.
+        task_instance (ImageProcessingTask): The task.
+        method (str): The name of the method, e.g. "run" or "run_batch".
+        *args: The arguments of the method.
+
+    Returns:
+        The result of the method.
+
+    Raises:
+        ValueError: If the task declares an unknown execution policy.
+    """
+    policy = task_instance.execution
+    if policy not in EXECUTION_POLICIES:
+        raise ValueError(f"Task '{task_name}' has unknown execution policy '{policy}'.")
+    if policy == "process" and method != "run_decoded":
+        return _get_process_pool().submit(_run_in_process, task_name, method, args).result()
+    if policy == "inline":
+        with _inline_lock:
+            return getattr(task_instance, method)(*args)
+    return getattr(task_instance, method)(*args)
+
+def shutdown():
+    """Stops the process pool, if it was started."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(cancel_futures=True)
+            _process_pool = None
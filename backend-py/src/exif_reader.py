@@ -0,0 +1,287 @@
+"""This module provides a streaming header parser for image dimensions, EXIF and GPS data.
+
+Only the container headers are read: JPEG marker segments up to the first frame header
+(SOF) and PNG chunks up to the first image data chunk. Pixel data is never decoded and
+segments that are not needed are skipped with a seek, so a typical photo costs a few
+kilobytes of I/O instead of a full decode.
+"""
+import io
+import struct
+
+# Give up (and let the caller fall back to Pillow) if the headers run past this offset.
+HEADER_MAX_BYTES = 512 * 1024
+
+# Tag IDs to names, following `PIL.ExifTags`, for the fields the EXIF analysis stores.
+EXIF_TAGS = {
+    0x010F: "Make",
+    0x0110: "Model",
+    0x0112: "Orientation",
+    0x0132: "DateTime",
+    0x829A: "ExposureTime",
+    0x829D: "FNumber",
+    0x8822: "ExposureProgram",
+    0x8827: "ISOSpeedRatings",
+    0x9003: "DateTimeOriginal",
+    0x9004: "DateTimeDigitized",
+    0x9204: "ExposureBiasValue",
+    0x9209: "Flash",
+    0x920A: "FocalLength",
+    0xA403: "WhiteBalance",
+    0xA433: "LensMake",
+    0xA434: "LensModel",
+}
+
+GPS_TAGS = {
+    0x0000: "GPSVersionID",
+    0x0001: "GPSLatitudeRef",
+    0x0002: "GPSLatitude",
+    0x0003: "GPSLongitudeRef",
+    0x0004: "GPSLongitude",
+    0x0005: "GPSAltitudeRef",
+    0x0006: "GPSAltitude",
+}
+
+EXIF_IFD_POINTER = 0x8769
+GPS_IFD_POINTER = 0x8825
+
+# TIFF field type -> (struct format character, size in bytes)
+_TIFF_TYPES = {
+    1: ("B", 1),   # BYTE
+    2: ("s", 1),   # ASCII
+    3: ("H", 2),   # SHORT
+    4: ("L", 4),   # LONG
+    5: ("LL", 8),  # RATIONAL
+    6: ("b", 1),   # SBYTE
+    7: ("s", 1),   # UNDEFINED
+    8: ("h", 2),   # SSHORT
+    9: ("l", 4),   # SLONG
+    10: ("ll", 8), # SRATIONAL
+    11: ("f", 4),  # FLOAT
+    12: ("d", 8),  # DOUBLE
+}
+
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+
+def read_image_header(source):
+    """Reads the dimensions, EXIF and GPS data of a JPEG or PNG image from its headers.
+
+    Args:
+        source (str | bytes): The path of the image file, or its contents.
+
+    Returns:
+        tuple | None: A tuple of (width, height, exif_data, gps_info) in the same shape as
+                      `ExifAnalysisTask._get_exif_data_from_img` produces, where exif_data and
+                      gps_info are None if the image carries no EXIF. Returns None if the
+                      format is not supported or the headers could not be parsed, in which
+                      case the caller should fall back to Pillow.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return _read_header(io.BytesIO(source))
+    with open(source, "rb", buffering=64 * 1024) as f:
+        return _read_header(f)
+
+def _read_header(f):
+    """Dispatches on the file signature.
+
+    Args:
+        f (file): A binary file object positioned at the start of the image.
+
+    Returns:
+        tuple | None: See `read_image_header`.
+    """
+    signature = f.read(8)
+    try:
+        if signature[:2] == b"\xff\xd8":
+            f.seek(2)
+            return _read_jpeg(f)
+        if signature == b"\x89PNG\r\n\x1a\n":
+            return _read_png(f)
+    except (struct.error, ValueError, IndexError):
+        pass
+    return None
+
+def _read_jpeg(f):
+    """Walks the JPEG marker segments until the frame header.
+
+    Args:
+        f (file): A binary file object positioned right after the SOI marker.
+
+    Returns:
+        tuple | None: See `read_image_header`.
+    """
+    exif_data, gps_info = None, None
+    while f.tell() < HEADER_MAX_BYTES:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte != b"\xff":
+            continue
+        marker = f.read(1)
+        while marker == b"\xff":  # Fill bytes
+            marker = f.read(1)
+        if not marker:
+            return None
+        marker = marker[0]
+        if marker in _JPEG_STANDALONE_MARKERS:
+            continue
+        if marker in (0xD9, 0xDA):  # EOI or SOS before any frame header
+            return None
+        (length,) = struct.unpack(">H", f.read(2))
+        if length < 2:
+            return None
+        if marker in _JPEG_SOF_MARKERS:
+            _, height, width = struct.unpack(">BHH", f.read(5))
+            return width, height, exif_data, gps_info
+        if marker == 0xE1 and exif_data is None:
+            segment = f.read(length - 2)
+            if segment[:6] == b"Exif\x00\x00":
+                exif_data, gps_info = parse_tiff_exif(segment[6:])
+        else:
+            f.seek(length - 2, io.SEEK_CUR)
+    return None
+
+def _read_png(f):
+    """Walks the PNG chunks until the first image data chunk.
+
+    Args:
+        f (file): A binary file object positioned right after the PNG signature.
+
+    Returns:
+        tuple | None: See `read_image_header`.
+    """
+    width, height = None, None
+    exif_data, gps_info = None, None
+    while f.tell() < HEADER_MAX_BYTES:
+        chunk_header = f.read(8)
+        if len(chunk_header) < 8:
+            break
+        length, chunk_type = struct.unpack(">L4s", chunk_header)
+        if chunk_type == b"IHDR":
+            width, height = struct.unpack(">LL", f.read(8))
+            f.seek(length - 8 + 4, io.SEEK_CUR)
+        elif chunk_type == b"eXIf":
+            exif_data, gps_info = parse_tiff_exif(f.read(length))
+            f.seek(4, io.SEEK_CUR)
+        elif chunk_type in (b"IDAT", b"IEND"):
+            break
+        else:
+            f.seek(length + 4, io.SEEK_CUR)
+    if width is None:
+        return None
+    return width, height, exif_data, gps_info
+
+def parse_tiff_exif(data: bytes):
+    """Parses a TIFF-structured EXIF block (IFD0, the Exif IFD and the GPS IFD).
+
+    Rational values are converted to floats, like `ExifAnalysisTask` does for Pillow's
+    `IFDRational` (NaN for a zero denominator), single-element values are unwrapped and
+    ASCII values are decoded.
+
+    Args:
+        data (bytes): The EXIF payload, starting with the TIFF byte order mark.
+
+    Returns:
+        tuple: A tuple of (exif_data, gps_info) dictionaries keyed by tag name,
+               or (None, None) if the block is empty or malformed.
+    """
+    if data[:2] == b"II":
+        order = "<"
+    elif data[:2] == b"MM":
+        order = ">"
+    else:
+        return None, None
+
+    try:
+        magic, ifd0_offset = struct.unpack(order + "HL", data[2:8])
+        if magic != 42:
+            return None, None
+
+        exif_data = {}
+        ifd0 = _read_ifd(data, order, ifd0_offset, EXIF_TAGS, (EXIF_IFD_POINTER, GPS_IFD_POINTER))
+        pointers = ifd0.pop("_pointers")
+        exif_data.update(ifd0)
+
+        if EXIF_IFD_POINTER in pointers:
+            exif_ifd = _read_ifd(data, order, pointers[EXIF_IFD_POINTER], EXIF_TAGS, ())
+            exif_ifd.pop("_pointers")
+            exif_data.update(exif_ifd)
+
+        gps_info = {}
+        if GPS_IFD_POINTER in pointers:
+            gps_info = _read_ifd(data, order, pointers[GPS_IFD_POINTER], GPS_TAGS, ())
+            gps_info.pop("_pointers")
+    except (struct.error, ValueError, IndexError):
+        return None, None
+
+    if not exif_data and not gps_info:
+        return None, None
+    return exif_data, gps_info
+
+def _read_ifd(data: bytes, order: str, offset: int, tag_names: dict, pointer_tags: tuple) -> dict:
+    """Reads the wanted entries of one image file directory.
+
+    Args:
+        data (bytes): The TIFF block.
+        order (str): The struct byte order prefix.
+        offset (int): The offset of the IFD within the block.
+        tag_names (dict): The tags to decode, mapped to their names.
+        pointer_tags (tuple): Tags whose value is the offset of a sub-IFD.
+
+    Returns:
+        dict: The decoded values keyed by name, plus a "_pointers" dict of sub-IFD offsets.
+    """
+    values = {"_pointers": {}}
+    if offset <= 0 or offset + 2 > len(data):
+        return values
+    (count,) = struct.unpack_from(order + "H", data, offset)
+    for index in range(count):
+        entry = offset + 2 + index * 12
+        if entry + 12 > len(data):
+            break
+        tag, field_type, value_count = struct.unpack_from(order + "HHL", data, entry)
+        if tag in pointer_tags:
+            values["_pointers"][tag] = struct.unpack_from(order + "L", data, entry + 8)[0]
+            continue
+        if tag not in tag_names or field_type not in _TIFF_TYPES:
+            continue
+        value = _read_value(data, order, entry, field_type, value_count)
+        if value is not None:
+            values[tag_names[tag]] = value
+    return values
+
+def _read_value(data: bytes, order: str, entry: int, field_type: int, value_count: int):
+    """Decodes the value of an IFD entry.
+
+    Args:
+        data (bytes): The TIFF block.
+        order (str): The struct byte order prefix.
+        entry (int): The offset of the 12-byte IFD entry.
+        field_type (int): The TIFF field type.
+        value_count (int): The number of values in the field.
+
+    Returns:
+        The decoded value, or None if it points outside the block.
+    """
+    fmt, size = _TIFF_TYPES[field_type]
+    total = size * value_count
+    if total <= 4:
+        start = entry + 8
+    else:
+        (start,) = struct.unpack_from(order + "L", data, entry + 8)
+    if start + total > len(data):
+        return None
+    raw = data[start:start + total]
+
+    if field_type == 2:
+        return raw.split(b"\x00", 1)[0].decode("utf-8", errors="replace").strip()
+    if field_type == 7:
+        return raw
+
+    numbers = struct.unpack(order + fmt * value_count, raw)
+    if field_type in (5, 10):
+        numbers = tuple(
+            numerator / denominator if denominator else float("nan")
+            for numerator, denominator in zip(numbers[::2], numbers[1::2])
+        )
+    return numbers[0] if value_count == 1 else numbers
@@ -0,0 +1,113 @@
+"""This module provides bulk writes of image groups and their memberships."""
+import uuid
+from .events import publish, publish_for_group
+
+def replace_project_groups(cur, project_id: str, group_type: str, groups: list[list[tuple]]):
+    """Replaces all groups of one type in a project with set-based statements.
+
+    Group IDs are derived from the project, the group type and the group's first image,
+    so a group that survives a regrouping keeps its ID (and anything that references it).
+    The caller commits, which also delivers the `groups_replaced` event.
+
+    Args:
+        cur (psycopg2.extensions.cursor): The database cursor.
+        project_id (str): The ID of the project.
+        group_type (str): The `group_type` of the groups to replace, e.g. 'similar' or 'gps'.
+        groups (list[list[tuple]]): The new groups, each a time-ordered list of (image ID, reference time).
+    """
+    group_ids, starts, ends = [], [], []
+    member_group_ids, member_image_ids, member_orders = [], [], []
+    for members in groups:
+        group_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{project_id}/{group_type}/{members[0][0]}"))
+        group_ids.append(group_id)
+        starts.append(members[0][1])
+        ends.append(members[-1][1])
+        for sequence_order, (image_id, _) in enumerate(members):
+            member_group_ids.append(group_id)
+            member_image_ids.append(image_id)
+            member_orders.append(sequence_order)
+
+    cur.execute(
+        """
+        DELETE FROM image_group_membership
+        WHERE group_id IN (SELECT id FROM image_group WHERE project_id = %s AND group_type = %s)
+        """,
+        (project_id, group_type)
+    )
+    cur.execute(
+        "DELETE FROM image_group WHERE project_id = %s AND group_type = %s AND NOT (id = ANY(%s))",
+        (project_id, group_type, group_ids)
+    )
+    cur.execute(
+        """
+        INSERT INTO image_group (id, project_id, group_type, time_range_start, time_range_end, created_at, updated_at)
+        SELECT g.id, %s, %s, g.time_range_start, g.time_range_end, NOW(), NOW()
+        FROM unnest(%s::text[], %s::timestamp[], %s::timestamp[]) AS g(id, time_range_start, time_range_end)
+        ON CONFLICT (id) DO UPDATE SET
+            time_range_start = EXCLUDED.time_range_start,
+            time_range_end = EXCLUDED.time_range_end,
+            updated_at = NOW()
+        """,
+        (project_id, group_type, group_ids, starts, ends)
+    )
+    cur.execute(
+        """
+        INSERT INTO image_group_membership (id, group_id, image_id, sequence_order, added_at)
+        SELECT gen_random_uuid()::text, m.group_id, m.image_id, m.sequence_order, NOW()
+        FROM unnest(%s::text[], %s::text[], %s::integer[]) AS m(group_id, image_id, sequence_order)
+        """,
+        (member_group_ids, member_image_ids, member_orders)
+    )
+    publish(cur, {"type": "groups_replaced", "project_id": project_id, "group_type": group_type, "groups": len(group_ids)})
+
+def add_group_members(cur, group_id: str, image_ids: list[str]):
+    """Adds images to a group with a single statement, skipping those already in it.
+
+    Args:
+        cur (psycopg2.extensions.cursor): The database cursor.
+        group_id (str): The ID of the group.
+        image_ids (list[str]): The IDs of the images to add. Duplicates are allowed.
+    """
+    cur.execute(
+        """
+        INSERT INTO image_group_membership (id, group_id, image_id, added_at)
+        SELECT gen_random_uuid()::text, %s, m.image_id, NOW()
+        FROM (SELECT DISTINCT unnest(%s::text[]) AS image_id) AS m
+        ON CONFLICT (group_id, image_id) DO NOTHING
+        """,
+        (group_id, list(image_ids))
+    )
+    publish_for_group(cur, {"type": "group_members_added", "image_ids": sorted(set(image_ids))[:100]}, group_id)
+
+def merge_groups(cur, survivor_id: str, victim_ids: list[str]):
+    """Moves all members of the victim groups into the survivor and deletes the victims.
+
+    The statements are sent in one round trip regardless of the number of members:
+    memberships that would become duplicates are dropped, the rest are re-pointed to
+    the survivor with a single UPDATE, and the emptied groups are deleted.
+
+    Args:
+        cur (psycopg2.extensions.cursor): The database cursor.
+        survivor_id (str): The ID of the group that is kept.
+        victim_ids (list[str]): The IDs of the groups merged into the survivor.
+    """
+    victim_ids = [group_id for group_id in victim_ids if group_id != survivor_id]
+    if not victim_ids:
+        return
+    cur.execute(
+        """
+        DELETE FROM image_group_membership AS m
+        WHERE m.group_id = ANY(%(victims)s)
+          AND EXISTS (
+              SELECT 1 FROM image_group_membership AS other
+              WHERE other.image_id = m.image_id
+                AND (other.group_id = %(survivor)s
+                     OR (other.group_id = ANY(%(victims)s) AND other.id < m.id))
+          );
+        UPDATE image_group_membership SET group_id = %(survivor)s WHERE group_id = ANY(%(victims)s);
+        DELETE FROM image_group WHERE id = ANY(%(victims)s);
+        UPDATE image_group SET updated_at = NOW() WHERE id = %(survivor)s;
+        """,
+        {"survivor": survivor_id, "victims": victim_ids}
+    )
+    publish_for_group(cur, {"type": "groups_merged", "merged_group_ids": victim_ids[:100]}, survivor_id)
@@ -0,0 +1,132 @@
+"""This module provides an in-memory index over 64-bit perceptual hashes for Hamming radius queries."""
+from itertools import combinations
+
+HASH_BITS = 64
+
+def hash_to_int(hash_str: str) -> int | None:
+    """Converts the hex string of a 64-bit `imagehash` hash to an integer.
+
+    Args:
+        hash_str (str): The hex string, as stored in `image.perceptual_hash`.
+
+    Returns:
+        int | None: The hash as an integer, or None if it is not a 64-bit hex string.
+    """
+    if not hash_str or len(hash_str) != HASH_BITS // 4:
+        return None
+    try:
+        return int(hash_str, 16)
+    except ValueError:
+        return None
+
+class HammingIndex:
+    """A multi-index hash table over 64-bit hashes.
+
+    Each hash is split into `blocks` equal substrings and every substring is indexed in
+    its own table. By the pigeonhole principle, two hashes within Hamming distance r agree
+    to within r // blocks bits on at least one substring, so a query only probes the
+    substring values within that distance and verifies the few candidates it finds with
+    a popcount. Entries can be added, replaced and removed at any time.
+    """
+
+    def __init__(self, blocks: int = 4):
+        """Initializes an empty index.
+
+        Args:
+            blocks (int): The number of substrings. Must divide 64.
+        """
+        if HASH_BITS % blocks:
+            raise ValueError("blocks must divide 64")
+        self._blocks = blocks
+        self._block_bits = HASH_BITS // blocks
+        self._block_mask = (1 << self._block_bits) - 1
+        self._tables = [{} for _ in range(blocks)]
+        self._entries = {}
+        self._probe_masks = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+    def _substrings(self, value: int):
+        """Yields (block index, substring value) pairs of a hash."""
+        for block in range(self._blocks):
+            yield block, (value >> (block * self._block_bits)) & self._block_mask
+
+    def _masks(self, radius: int) -> list[int]:
+        """Returns all substring masks with at most `radius` bits set."""
+        if radius not in self._probe_masks:
+            masks = []
+            for bits in range(radius + 1):
+                for positions in combinations(range(self._block_bits), bits):
+                    mask = 0
+                    for position in positions:
+                        mask |= 1 << position
+                    masks.append(mask)
+            self._probe_masks[radius] = masks
+        return self._probe_masks[radius]
+
+    def add(self, key, value: int, payload=None):
+        """Adds or replaces an entry.
+
+        Args:
+            key: A unique key for the entry, e.g. the image ID.
+            value (int): The 64-bit hash.
+            payload: Arbitrary data returned with query results, e.g. the capture time.
+        """
+        if key in self._entries:
+            self.remove(key)
+        self._entries[key] = (value, payload)
+        for block, substring in self._substrings(value):
+            self._tables[block].setdefault(substring, set()).add(key)
+
+    def remove(self, key):
+        """Removes an entry if present.
+
+        Args:
+            key: The key of the entry.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for block, substring in self._substrings(entry[0]):
+            bucket = self._tables[block].get(substring)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._tables[block][substring]
+
+    def get(self, key):
+        """Returns the (value, payload) pair of an entry, or None."""
+        return self._entries.get(key)
+
+    def query(self, value: int, radius: int) -> list[tuple]:
+        """Finds all entries within a Hamming distance of a hash.
+
+        Args:
+            value (int): The 64-bit hash to search around.
+            radius (int): The maximum Hamming distance, inclusive.
+
+        Returns:
+            list[tuple]: (key, distance, payload) tuples for every match, in no particular order.
+        """
+        masks = self._masks(radius // self._blocks)
+        seen = set()
+        matches = []
+        for block, substring in self._substrings(value):
+            table = self._tables[block]
+            for mask in masks:
+                bucket = table.get(substring ^ mask)
+                if not bucket:
+                    continue
+                for key in bucket:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    other, payload = self._entries[key]
+                    distance = (value ^ other).bit_count()
+                    if distance <= radius:
+                        matches.append((key, distance, payload))
+        return matches
@@ -0,0 +1,205 @@
+"""This module provides helpers for locating original images and decoding them once for all tasks."""
+import io
+import os
+from PIL import Image, ImageOps
+
+# The EXIF tag holding the orientation of the image.
+ORIENTATION_TAG = 0x0112
+# The transposition that undoes `ImageOps.exif_transpose`, per EXIF orientation.
+_UNDO_ORIENTATION = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_90,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_270,
+}
+
+def storage_base_path() -> str:
+    """Returns the directory that relative storage paths are resolved against.
+
+    Every task reads originals and writes thumbnails relative to it, so the decode-once
+    pipeline and the per-task paths always resolve the same file.
+
+    Returns:
+        str: `STORAGE_BASE_PATH`, or "/storage" if it is unset. An empty value resolves
+             paths against the working directory.
+    """
+    return os.getenv("STORAGE_BASE_PATH", "/storage")
+
+def resolve_storage_path(storage_path: str) -> str:
+    """Resolves the `storage_path` column of an image to a path on disk.
+
+    Args:
+        storage_path (str): The storage path as recorded in the database.
+
+    Returns:
+        str: The absolute or `STORAGE_BASE_PATH`-relative path of the original file.
+    """
+    if os.path.isabs(storage_path):
+        return storage_path
+    return os.path.join(storage_base_path(), storage_path)
+
+def load_reduced(source, min_side: int, exif_transpose: bool = True) -> Image.Image:
+    """Decodes an image at the lowest resolution whose shortest side is still at least `min_side`.
+
+    For JPEG files libjpeg scales the DCT coefficients while decoding (`Image.draft`), which
+    decodes at 1/2, 1/4 or 1/8 of the original size and never materializes the full
+    resolution bitmap. Other formats are decoded in full and then box-reduced by an
+    integer factor, so that later resampling works on a small image.
+
+    The file is closed before returning; the result holds no file handle.
+
+    Args:
+        source (str | file): The path or file object of the image.
+        min_side (int): The minimum length of the shortest side of the result, in pixels.
+        exif_transpose (bool): Whether to apply the EXIF orientation, or keep the image
+            as stored.
+
+    Returns:
+        PIL.Image.Image: The loaded image.
+
+    Raises:
+        ValueError: If `min_side` is not positive.
+    """
+    if min_side <= 0:
+        raise ValueError(f"min_side must be positive, got {min_side}.")
+    with Image.open(source) as original:
+        img = original
+        if img.format == "JPEG":
+            # Ask for a square so the constraint holds whichever way EXIF rotates the image.
+            img.draft("RGB", (min_side, min_side))
+            img.load()
+        else:
+            img.load()
+            factor = min(img.size) // min_side
+            if factor > 1:
+                if img.mode not in ("RGB", "L"):
+                    img = img.convert("RGB")
+                img = img.reduce(factor)
+        if not exif_transpose:
+            # Detach the result from the file, which is closed on leaving the block.
+            return img.copy() if img is original else img
+        # Returns a new image, detached from the file that is closed on leaving the block.
+        return ImageOps.exif_transpose(img)
+
+class DecodedImage:
+    """An original image that is read from disk once and shared by every pipeline stage.
+
+    The raw bytes are kept so that metadata-only stages (EXIF) can parse headers without
+    touching the pixels. The pixels are decoded lazily on first access, with the EXIF
+    orientation applied, and downscaled variants are cached per size. When none of the
+    stages needs the full resolution, the pixels are decoded at reduced size (see `load_reduced`).
+    """
+
+    def __init__(self, data: bytes, min_side: int | None = None):
+        """Initializes the decoded image.
+
+        Args:
+            data (bytes): The contents of the original image file.
+            min_side (int | None): The shortest side the decoded image must keep,
+                or None to decode at full resolution.
+        """
+        self.data = data
+        self.min_side = min_side
+        self._image = None
+        self._array = None
+        self._variants = {}
+
+    @classmethod
+    def from_path(cls, path: str, min_side: int | None = None) -> "DecodedImage":
+        """Reads an original image file.
+
+        Args:
+            path (str): The path of the image file.
+            min_side (int | None): The shortest side the decoded image must keep,
+                or None to decode at full resolution.
+
+        Returns:
+            DecodedImage: The image, not yet decoded.
+        """
+        with open(path, "rb") as f:
+            return cls(f.read(), min_side)
+
+    def open(self) -> Image.Image:
+        """Opens a fresh, undecoded view of the original file.
+
+        Only the header is parsed, which makes this cheap for metadata access.
+
+        Returns:
+            PIL.Image.Image: The lazily loaded image, in its stored orientation.
+        """
+        return Image.open(io.BytesIO(self.data))
+
+    @property
+    def original_size(self) -> tuple[int, int]:
+        """The (width, height) of the original image with its EXIF orientation applied.
+
+        Read from the header, so it stays the full size when the pixels are decoded at
+        reduced resolution.
+        """
+        with self.open() as img:
+            width, height = img.size
+            # Orientations 5 to 8 rotate the image by 90 or 270 degrees.
+            if img.getexif().get(ORIENTATION_TAG, 1) in (5, 6, 7, 8):
+                width, height = height, width
+        return width, height
+
+    @property
+    def image(self) -> Image.Image:
+        """The decoded RGB image with its EXIF orientation applied."""
+        if self._image is None:
+            if self.min_side:
+                img = load_reduced(io.BytesIO(self.data), self.min_side)
+            else:
+                img = self.open()
+                img.load()
+                ImageOps.exif_transpose(img, in_place=True)
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            self._image = img
+        return self._image
+
+    @property
+    def stored_image(self) -> Image.Image:
+        """The decoded RGB image in the orientation it is stored in, without its EXIF orientation applied.
+
+        For tasks whose results were always computed on the image as stored. The pixels are
+        transposed back from `image` rather than decoded again.
+        """
+        with self.open() as img:
+            orientation = img.getexif().get(ORIENTATION_TAG, 1)
+        if orientation in _UNDO_ORIENTATION:
+            return self.image.transpose(_UNDO_ORIENTATION[orientation])
+        return self.image
+
+    def as_array(self):
+        """Returns the decoded image as an HxWx3 uint8 RGB array.
+
+        Returns:
+            numpy.ndarray: The pixel data, shared between callers and not to be modified.
+        """
+        if self._array is None:
+            import numpy as np
+            self._array = np.asarray(self.image)
+        return self._array
+
+    def variant(self, max_side: int) -> Image.Image:
+        """Returns a copy downscaled so that its longest side is at most `max_side` pixels.
+
+        Args:
+            max_side (int): The maximum width or height of the variant.
+
+        Returns:
+            PIL.Image.Image: The downscaled image, or the full image if it is already small enough.
+        """
+        if max_side not in self._variants:
+            img = self.image
+            scale = max_side / float(max(img.size))
+            if scale >= 1:
+                self._variants[max_side] = img
+            else:
+                size = (max(1, round(img.size[0] * scale)), max(1, round(img.size[1] * scale)))
+                self._variants[max_side] = img.resize(size, Image.Resampling.LANCZOS)
+        return self._variants[max_side]
@@ -0,0 +1,303 @@
+"""This module provides the inference backends the model tasks run their models on.
+
+A model task registers one backend class per implementation of its model, e.g. eager
+PyTorch and ONNX Runtime, and picks one through configuration:
+
+- `INFERENCE_BACKEND` sets the backend of every model task ("torch" by default).
+- `<TASK_NAME>_BACKEND`, e.g. `QUALITY_ASSESSMENT_BACKEND=onnx`, overrides it for one task.
+
+The ONNX backend is experimental: its parity with PyTorch has not been measured on real
+photos, which is why "torch" stays the default.
+
+On the ONNX backend, a task can run a quantized variant of its model instead of the FP32
+one, set the same way with `INFERENCE_PRECISION` and `<TASK_NAME>_PRECISION`:
+
+- "fp32": the exported model (the default).
+- "int8-dynamic": weights of the linear layers in INT8, activations quantized at run time.
+- "int8-static": weights and activations in INT8, with activation ranges calibrated on
+  our own images.
+
+The variant is part of the task's model version, so results of different variants are
+stored and skipped separately. The INT8 variants are experimental, and "fp32" stays the
+default until their accuracy is measured on our photos.
+
+ONNX models are read from `ONNX_MODEL_DIR`, where `scripts/export_onnx.py` writes them.
+"""
+import os
+import threading
+from collections import defaultdict
+from .lazy import lazy_import
+
+INFERENCE_BACKENDS = ("torch", "onnx")
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND") or "torch"
+INFERENCE_PRECISIONS = ("fp32", "int8-dynamic", "int8-static")
+INFERENCE_PRECISION = os.getenv("INFERENCE_PRECISION") or "fp32"
+
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models", "onnx"
+)
+# Threads one operator may use. 0 lets ONNX Runtime use one per physical core.
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS") or 0)
+# Threads that run independent operators in parallel. Above 1, the graph runs in parallel mode.
+ONNX_INTER_OP_THREADS = int(os.getenv("ONNX_INTER_OP_THREADS") or 0)
+# The graph optimizations ONNX Runtime applies when it loads a model: "disabled", "basic",
+# "extended" or "all".
+ONNX_GRAPH_OPTIMIZATION = os.getenv("ONNX_GRAPH_OPTIMIZATION") or "all"
+
+ort = lazy_import("onnxruntime")
+
+_backend_classes = {}  # (task name, backend name) -> class
+_backends = {}  # task name -> loaded backend
+_backends_lock = threading.Lock()
+
+def task_backend(task_name: str) -> str:
+    """Returns the name of the backend a task runs its model on.
+
+    Args:
+        task_name (str): The name of the task.
+
+    Returns:
+        str: "torch" or "onnx".
+
+    Raises:
+        ValueError: If the configured backend is unknown.
+    """
+    backend = (os.getenv(f"{task_name.upper()}_BACKEND") or INFERENCE_BACKEND).lower()
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend}' for task '{task_name}'. Available: {', '.join(INFERENCE_BACKENDS)}")
+    return backend
+
+def task_precision(task_name: str) -> str:
+    """Returns the variant of its model a task runs.
+
+    Args:
+        task_name (str): The name of the task.
+
+    Returns:
+        str: One of `INFERENCE_PRECISIONS`.
+
+    Raises:
+        ValueError: If the configured variant is unknown, or quantized on the torch backend.
+    """
+    precision = (os.getenv(f"{task_name.upper()}_PRECISION") or INFERENCE_PRECISION).lower()
+    if precision not in INFERENCE_PRECISIONS:
+        raise ValueError(f"Unknown inference precision '{precision}' for task '{task_name}'. Available: {', '.join(INFERENCE_PRECISIONS)}")
+    if precision != "fp32" and task_backend(task_name) != "onnx":
+        raise ValueError(f"Task '{task_name}' runs '{precision}' models on the onnx backend only; set {task_name.upper()}_BACKEND=onnx.")
+    return precision
+
+def model_version(task_name: str, version: str) -> str:
+    """Returns the model version a task records, with the variant it runs.
+
+    Args:
+        task_name (str): The name of the task.
+        version (str): The version of the FP32 model.
+
+    Returns:
+        str: `version` for FP32, or e.g. "yolov10x-int8-static" for a quantized variant.
+    """
+    precision = task_precision(task_name)
+    return version if precision == "fp32" else f"{version}-{precision}"
+
+def register_backend(task_name: str, backend: str):
+    """A decorator to register a backend class of a task's model.
+
+    Args:
+        task_name (str): The name of the task.
+        backend (str): The name of the backend, one of `INFERENCE_BACKENDS`.
+
+    Returns:
+        function: The decorator function.
+    """
+    def decorator(cls):
+        _backend_classes[(task_name, backend)] = cls
+        cls.name = backend
+        cls.task_name = task_name
+        return cls
+    return decorator
+
+def backend_class(task_name: str, backend: str | None = None):
+    """Returns a registered backend class.
+
+    Args:
+        task_name (str): The name of the task.
+        backend (str | None): The name of the backend, or None for the configured one.
+
+    Returns:
+        type: The backend class.
+
+    Raises:
+        ValueError: If the task has no such backend.
+    """
+    backend = backend or task_backend(task_name)
+    cls = _backend_classes.get((task_name, backend))
+    if cls is None:
+        raise ValueError(f"Task '{task_name}' has no '{backend}' inference backend.")
+    return cls
+
+def get_backend(task_name: str):
+    """Returns the configured backend of a task, loading its model on first use.
+
+    The backend is shared by all instances of the task in the process.
+
+    Args:
+        task_name (str): The name of the task.
+
+    Returns:
+        InferenceBackend: The loaded backend.
+    """
+    with _backends_lock:
+        if task_name not in _backends:
+            backend = backend_class(task_name)()
+            backend.load()
+            print(f"Loaded {task_name} model on the {backend.name} backend ({task_precision(task_name)})")
+            _backends[task_name] = backend
+        return _backends[task_name]
+
+def onnx_model_path(model_name: str, precision: str = "fp32") -> str:
+    """Returns the path of an exported ONNX model, e.g. `yolov10x-int8-static.onnx` for a variant."""
+    if precision != "fp32":
+        model_name = f"{model_name}-{precision}"
+    return os.path.join(ONNX_MODEL_DIR, f"{model_name}.onnx")
+
+def create_onnx_session(model_name: str, precision: str = "fp32", intra_op_threads: int | None = None,
+                        inter_op_threads: int | None = None, graph_optimization: str | None = None):
+    """Creates an ONNX Runtime session for an exported model.
+
+    The session runs on CUDA if `USE_GPU` is set and the installed ONNX Runtime supports
+    it, and on the CPU otherwise. Settings that are not given come from the environment.
+
+    Args:
+        model_name (str): The name of the model in `ONNX_MODEL_DIR`.
+        precision (str): The variant of the model, one of `INFERENCE_PRECISIONS`.
+        intra_op_threads (int | None): Threads per operator; 0 means one per physical core.
+        inter_op_threads (int | None): Threads running independent operators in parallel.
+        graph_optimization (str | None): "disabled", "basic", "extended" or "all".
+
+    Returns:
+        onnxruntime.InferenceSession: The session.
+
+    Raises:
+        FileNotFoundError: If the model has not been exported.
+    """
+    path = onnx_model_path(model_name, precision)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"ONNX model {path} not found. Export it with `python -m scripts.export_onnx --precision {precision}`.")
+
+    levels = {
+        "disabled": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+    graph_optimization = graph_optimization or ONNX_GRAPH_OPTIMIZATION
+    if graph_optimization not in levels:
+        raise ValueError(f"Unknown ONNX graph optimization level '{graph_optimization}'. Available: {', '.join(levels)}")
+    inter_op_threads = ONNX_INTER_OP_THREADS if inter_op_threads is None else inter_op_threads
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = levels[graph_optimization]
+    options.intra_op_num_threads = ONNX_INTRA_OP_THREADS if intra_op_threads is None else intra_op_threads
+    options.inter_op_num_threads = inter_op_threads
+    if inter_op_threads > 1:
+        options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+
+    providers = ["CPUExecutionProvider"]
+    use_gpu = os.getenv("USE_GPU", "true").lower() == "true"
+    if use_gpu and "CUDAExecutionProvider" in ort.get_available_providers():
+        providers.insert(0, "CUDAExecutionProvider")
+    return ort.InferenceSession(path, sess_options=options, providers=providers)
+
+class InferenceBackend:
+    """A model of a task, loaded and run by one implementation.
+
+    Subclasses add the methods their task calls to run the model.
+    """
+
+    # The names of the backend and of its task, set by `register_backend`.
+    name = None
+    task_name = None
+
+    def load(self):
+        """Loads the model. Called once, by `get_backend`."""
+        raise NotImplementedError
+
+    def acquire(self):
+        """Makes sure the model is on the device it runs on. Called before every use."""
+        pass
+
+class OnnxBackend(InferenceBackend):
+    """A model exported to ONNX and run on ONNX Runtime."""
+
+    def __init__(self, precision: str | None = None, **session_options):
+        """Initializes the backend.
+
+        Args:
+            precision (str | None): The variant of the model, or None for the task's configured one.
+            **session_options: Overrides of the session settings, see `create_onnx_session`.
+        """
+        self.precision = precision or task_precision(self.task_name)
+        self.session_options = session_options
+
+    def create_session(self, model_name: str):
+        """Creates a session for the variant of an exported model with this backend's settings."""
+        return create_onnx_session(model_name, self.precision, **self.session_options)
+
+class GenerationStats:
+    """Accumulates the latency, token throughput and output length of generative models per task and profile."""
+
+    def __init__(self):
+        self._stats = defaultdict(lambda: {
+            "batches": 0, "images": 0, "seconds": 0.0, "tokens": 0,
+            "words": 0, "characters": 0, "min_words": None, "max_words": 0,
+        })
+        self._lock = threading.Lock()
+
+    def record(self, task_name: str, profile: str, seconds: float, tokens: int, outputs: list[str]):
+        """Records one generated batch.
+
+        Args:
+            task_name (str): The name of the task that generated the batch.
+            profile (str): The generation profile the batch was generated with.
+            seconds (float): The wall-clock time spent generating.
+            tokens (int): The number of tokens generated for the batch.
+            outputs (list[str]): The text stored for each image of the batch.
+        """
+        words = [len(output.split()) for output in outputs]
+        with self._lock:
+            entry = self._stats[(task_name, profile)]
+            entry["batches"] += 1
+            entry["images"] += len(outputs)
+            entry["seconds"] += seconds
+            entry["tokens"] += tokens
+            entry["words"] += sum(words)
+            entry["characters"] += sum(len(output) for output in outputs)
+            if words:
+                entry["min_words"] = min(words) if entry["min_words"] is None else min(entry["min_words"], *words)
+                entry["max_words"] = max(entry["max_words"], *words)
+
+    def summary(self) -> list[dict]:
+        """Returns the accumulated statistics.
+
+        Returns:
+            list[dict]: One entry per (task name, profile) with batch and image counts, the mean
+                        latency per image, the generated tokens per second and the output lengths.
+        """
+        with self._lock:
+            return [
+                {
+                    "task_name": task_name,
+                    "profile": profile,
+                    "batches": entry["batches"],
+                    "images": entry["images"],
+                    "ms_per_image": entry["seconds"] * 1000 / entry["images"] if entry["images"] else 0.0,
+                    "tokens_per_second": entry["tokens"] / entry["seconds"] if entry["seconds"] > 0 else 0.0,
+                    "mean_words": entry["words"] / entry["images"] if entry["images"] else 0.0,
+                    "min_words": entry["min_words"] or 0,
+                    "max_words": entry["max_words"],
+                    "mean_characters": entry["characters"] / entry["images"] if entry["images"] else 0.0,
+                }
+                for (task_name, profile), entry in sorted(self._stats.items())
+            ]
+
+GENERATION_STATS = GenerationStats()
@@ -0,0 +1,218 @@
+"""This module buffers analysis job item status transitions and writes them to the database in bulk."""
+import os
+import threading
+import time
+from psycopg2.extras import execute_values
+from .db import get_db_connection, release_db_connection
+from .events import publish
+
+# Finished items listed per event, to stay well below the 8000 byte NOTIFY payload limit.
+EVENT_ITEMS_PER_MESSAGE = 100
+
+JOB_STATUS_FLUSH_MS = int(os.getenv("JOB_STATUS_FLUSH_MS", "500"))
+JOB_STATUS_MAX_PENDING = int(os.getenv("JOB_STATUS_MAX_PENDING", "1000"))
+
+class JobStatusRecorder:
+    """Collects job item status transitions in memory and flushes them with one UPDATE.
+
+    Transitions of the same item are merged, so an item that goes from 'processing' to
+    'completed' between two flushes costs a single row of the UPDATE. Pending transitions
+    are flushed once the oldest has waited `flush_ms` milliseconds, as soon as
+    `max_pending` items have pending transitions, and when `flush` is called, which the
+    worker does on shutdown.
+
+    Timestamps are kept as monotonic times and written relative to the database clock,
+    so they are consistent with the `NOW()` timestamps written elsewhere. The time
+    between an item's 'processing' and final transition is stored in `processing_time_ms`.
+    Every flush publishes the finished items and the new progress of each affected job
+    (see `src.events`).
+    """
+
+    def __init__(self, flush_ms: int = JOB_STATUS_FLUSH_MS, max_pending: int = JOB_STATUS_MAX_PENDING):
+        """Initializes the recorder.
+
+        Args:
+            flush_ms (int): The maximum time a transition waits before it is written.
+            max_pending (int): The number of items with pending transitions that triggers a flush.
+        """
+        self._flush_wait = flush_ms / 1000.0
+        self._max_pending = max(1, max_pending)
+        self._pending = {}  # job item ID -> fields to write
+        self._started = {}  # job item ID -> monotonic time it started processing
+        self._timer = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def processing(self, job_item_ids: list[str], retry: bool = False):
+        """Records that items started processing.
+
+        Args:
+            job_item_ids (list[str]): The IDs of the job items.
+            retry (bool): Whether this is a retry of an earlier, failed attempt.
+        """
+        now = time.monotonic()
+        self._record(job_item_ids, {"item_status": "processing", "started": now, "retries": 1 if retry else 0})
+        with self._lock:
+            for job_item_id in job_item_ids:
+                self._started[job_item_id] = now
+
+    def completed(self, job_item_ids: list[str]):
+        """Records that items were processed successfully."""
+        self._finish(job_item_ids, "completed")
+
+    def skipped(self, job_item_ids: list[str]):
+        """Records that items were skipped because they were already processed."""
+        self._finish(job_item_ids, "skipped")
+
+    def failed(self, job_item_ids: list[str], error_message: str | None = None):
+        """Records that items failed for good.
+
+        Args:
+            job_item_ids (list[str]): The IDs of the job items.
+            error_message (str | None): The error, or None to keep the last recorded one.
+        """
+        self._finish(job_item_ids, "failed", error_message)
+
+    def error(self, job_item_ids: list[str], error_message: str):
+        """Records the error of a failed attempt without changing the item status.
+
+        Args:
+            job_item_ids (list[str]): The IDs of the job items.
+            error_message (str): The error.
+        """
+        self._record(job_item_ids, {"error_message": error_message})
+
+    def _finish(self, job_item_ids: list[str], item_status: str, error_message: str | None = None):
+        """Records a final transition, with the processing time of items that were seen starting."""
+        now = time.monotonic()
+        for job_item_id in job_item_ids:
+            with self._lock:
+                started = self._started.pop(job_item_id, None)
+            fields = {"item_status": item_status}
+            if item_status != "failed":
+                fields["completed"] = now
+            if error_message is not None:
+                fields["error_message"] = error_message
+            if started is not None:
+                fields["processing_time_ms"] = int((now - started) * 1000)
+            self._record([job_item_id], fields)
+
+    def _record(self, job_item_ids: list[str], fields: dict):
+        """Merges transition fields into the pending entries of the given items."""
+        with self._lock:
+            for job_item_id in job_item_ids:
+                self._merge(self._pending.setdefault(job_item_id, {}), fields)
+            flush_now = len(self._pending) >= self._max_pending
+            if not flush_now and self._pending and self._timer is None:
+                self._timer = threading.Timer(self._flush_wait, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if flush_now:
+            self.flush()
+
+    @staticmethod
+    def _merge(entry: dict, fields: dict):
+        """Applies newer fields to a pending entry; retries add up, everything else is replaced."""
+        for key, value in fields.items():
+            entry[key] = entry.get(key, 0) + value if key == "retries" else value
+
+    def flush(self):
+        """Writes all pending transitions with a single multi-row UPDATE.
+
+        If the write fails, the transitions are put back and retried with the next flush.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if not pending:
+                return
+
+            now = time.monotonic()
+            rows = [
+                (
+                    job_item_id,
+                    entry.get("item_status"),
+                    (now - entry["started"]) * 1000 if "started" in entry else None,
+                    (now - entry["completed"]) * 1000 if "completed" in entry else None,
+                    entry.get("error_message"),
+                    entry.get("processing_time_ms"),
+                    entry.get("retries", 0),
+                )
+                for job_item_id, entry in pending.items()
+            ]
+            conn = None
+            cur = None
+            try:
+                conn = get_db_connection()
+                cur = conn.cursor()
+                updated = execute_values(cur, """
+                    UPDATE analysis_job_item AS j SET
+                        item_status = COALESCE(v.item_status, j.item_status),
+                        started_at = COALESCE(NOW() - v.started_ago * INTERVAL '1 millisecond', j.started_at),
+                        completed_at = COALESCE(NOW() - v.completed_ago * INTERVAL '1 millisecond', j.completed_at),
+                        error_message = COALESCE(v.error_message, j.error_message),
+                        processing_time_ms = COALESCE(v.processing_time_ms, j.processing_time_ms),
+                        retry_count = j.retry_count + v.retries
+                    FROM (VALUES %s) AS v(id, item_status, started_ago, completed_ago, error_message, processing_time_ms, retries)
+                    WHERE j.id = v.id
+                    RETURNING j.job_id, j.image_id, j.item_status
+                """, rows, template="(%s, %s::item_status, %s::double precision, %s::double precision, %s, %s::integer, %s::integer)",
+                    page_size=len(rows), fetch=True)
+                self._publish(cur, updated)
+                conn.commit()
+            except Exception as exc:
+                if conn:
+                    conn.rollback()
+                print(f"Failed to write {len(rows)} job item status update(s), retrying with the next flush: {exc}")
+                with self._lock:
+                    for job_item_id, entry in pending.items():
+                        newer = self._pending.get(job_item_id, {})
+                        self._merge(entry, newer)
+                        self._pending[job_item_id] = entry
+                    if self._timer is None:
+                        self._timer = threading.Timer(self._flush_wait, self.flush)
+                        self._timer.daemon = True
+                        self._timer.start()
+            finally:
+                if cur:
+                    cur.close()
+                if conn:
+                    release_db_connection(conn)
+
+    def _publish(self, cur, updated: list[tuple]):
+        """Publishes the finished items and the progress of every job touched by a flush.
+
+        Args:
+            cur (psycopg2.extensions.cursor): The cursor of the flush transaction.
+            updated (list[tuple]): The (job_id, image_id, item_status) rows of the updated items.
+        """
+        finished = {}
+        for job_id, image_id, item_status in updated:
+            items = finished.setdefault(job_id, [])
+            if item_status in ("completed", "skipped", "failed"):
+                items.append([image_id, item_status])
+        cur.execute(
+            """
+            SELECT id, project_id, job_status, total_items, pending_items, processing_items,
+                   completed_items, skipped_items, failed_items
+            FROM analysis_job WHERE id = ANY(%s)
+            """,
+            (list(finished),)
+        )
+        for job_id, project_id, job_status, total, pending, processing, completed, skipped, failed in cur.fetchall():
+            items = finished[job_id]
+            for start in range(0, len(items), EVENT_ITEMS_PER_MESSAGE):
+                publish(cur, {
+                    "type": "items", "job_id": job_id, "project_id": project_id,
+                    "items": items[start:start + EVENT_ITEMS_PER_MESSAGE],
+                })
+            publish(cur, {
+                "type": "job_progress", "job_id": job_id, "project_id": project_id, "status": job_status,
+                "total": total, "pending": pending, "processing": processing,
+                "completed": completed, "skipped": skipped, "failed": failed,
+            })
+
+JOB_STATUS = JobStatusRecorder()
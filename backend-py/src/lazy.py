@@ -0,0 +1,40 @@
+"""This module defers importing heavy libraries until they are first used."""
+import importlib
+
+class LazyModule:
+    """A stand-in for a module that imports the module on first attribute access.
+
+    Task modules use it for the model libraries (torch, transformers, ultralytics, pyiqa),
+    so that importing a task, e.g. to ask which images it has already processed, costs
+    nothing until the task actually runs its model.
+    """
+
+    def __init__(self, name: str):
+        """Initializes the stand-in.
+
+        Args:
+            name (str): The absolute name of the module, e.g. "torch".
+        """
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute: str):
+        if self._module is None:
+            # The import system's locks make concurrent first uses safe.
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+    def __repr__(self) -> str:
+        state = "imported" if self._module is not None else "not imported"
+        return f"<lazy module '{self._name}' ({state})>"
+
+def lazy_import(name: str) -> LazyModule:
+    """Returns a stand-in for a module that is imported on first use.
+
+    Args:
+        name (str): The absolute name of the module.
+
+    Returns:
+        LazyModule: The stand-in.
+    """
+    return LazyModule(name)
@@ -0,0 +1,124 @@
+"""This module loads upcoming images in background threads while the model works on the current ones."""
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# The number of images loaded ahead of the model. 0 turns the prefetching worker mode off.
+PREFETCH_DEPTH = int(os.getenv("PREFETCH_DEPTH", "16"))
+PREFETCH_THREADS = int(os.getenv("PREFETCH_THREADS", "4"))
+# The memory, in MiB, that loaded but unconsumed images may take up. Loads stay fewer than
+# `PREFETCH_DEPTH` when the images are large, e.g. full resolution tensors.
+PREFETCH_MAX_MB = float(os.getenv("PREFETCH_MAX_MB") or 1024)
+# The number of model batches one batch message carries when prefetching, so that the
+# worker has upcoming images to load while a batch runs.
+PREFETCH_MESSAGE_BATCHES = int(os.getenv("PREFETCH_MESSAGE_BATCHES", "8"))
+
+_executor = None
+_END = object()
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Returns the thread pool shared by all prefetchers of the process, creating it on first use."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max(1, PREFETCH_THREADS), thread_name_prefix="prefetch")
+    return _executor
+
+def _estimate_bytes(value) -> int:
+    """Estimates the memory taken by a loaded value: an image, an array, a tensor or a tuple of them."""
+    if isinstance(value, (tuple, list)):
+        return sum(_estimate_bytes(part) for part in value)
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if hasattr(value, "element_size") and hasattr(value, "numel"):
+        return value.element_size() * value.numel()
+    if hasattr(value, "getbands"):
+        return value.width * value.height * len(value.getbands())
+    return 0
+
+class Prefetcher:
+    """Iterates over items while their loads run ahead in a thread pool.
+
+    At most `depth` loads are queued or finished but not yet consumed, so a slow consumer
+    holds back the loads instead of piling up decoded images in memory. The number of loads
+    ahead is further limited so that, at the size of the largest value loaded so far, they
+    fit in `max_bytes`. Reading files and decoding them in Pillow release the GIL, as does
+    inference in torch, so the loads overlap with the consumer's work.
+    """
+
+    def __init__(self, load_fn, items: list, depth: int = PREFETCH_DEPTH, max_bytes: int = int(PREFETCH_MAX_MB * 2**20)):
+        """Initializes the prefetcher.
+
+        Args:
+            load_fn (callable): Called with an item on a pool thread; returns the loaded value.
+            items (list): The items, in the order they are consumed.
+            depth (int): The maximum number of loads ahead of the consumer.
+            max_bytes (int): The memory the loads ahead of the consumer may take up.
+        """
+        self._load_fn = load_fn
+        self._items = list(items)
+        self._depth = max(1, depth)
+        self._max_bytes = max_bytes
+        # The size of the largest value loaded so far, or None before the first one.
+        self._largest_bytes = None
+        # Seconds the consumer spent waiting for a load that had not finished yet.
+        self.wait_seconds = 0.0
+
+    def _window(self) -> int:
+        """Returns the number of loads that may be ahead of the consumer."""
+        if self._largest_bytes is None:
+            # Nothing is known about the sizes yet: keep the pool busy, but no more.
+            return min(self._depth, max(1, PREFETCH_THREADS))
+        return max(1, min(self._depth, self._max_bytes // max(1, self._largest_bytes)))
+
+    def __iter__(self):
+        """Yields (item, value, error) triples in the order of the items.
+
+        `error` is the exception raised by the load, in which case `value` is None.
+        """
+        executor = _get_executor()
+        upcoming = iter(self._items)
+        in_flight = deque()
+
+        def fill():
+            while len(in_flight) < self._window():
+                item = next(upcoming, _END)
+                if item is _END:
+                    return
+                in_flight.append((item, executor.submit(self._load_fn, item)))
+
+        fill()
+        try:
+            while in_flight:
+                item, future = in_flight.popleft()
+                started = time.perf_counter()
+                try:
+                    value, error = future.result(), None
+                except Exception as exc:
+                    value, error = None, exc
+                self.wait_seconds += time.perf_counter() - started
+                if error is None:
+                    self._largest_bytes = max(self._largest_bytes or 0, _estimate_bytes(value))
+                fill()
+                yield item, value, error
+        finally:
+            # The consumer stopped early: drop the loads nobody will read.
+            for _, future in in_flight:
+                future.cancel()
+
+    def batches(self, size: int):
+        """Yields lists of up to `size` consecutive (item, value, error) triples.
+
+        The loads of the next batch keep running while the caller works on the current one.
+
+        Args:
+            size (int): The maximum number of triples per batch.
+        """
+        batch = []
+        for entry in self:
+            batch.append(entry)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
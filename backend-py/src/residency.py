@@ -0,0 +1,169 @@
+"""This module keeps task models resident on the accelerator within a memory budget."""
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict
+from .lazy import lazy_import
+
+# Imported when the first model is acquired, not when a worker that runs no model starts.
+torch = lazy_import("torch")
+
+def _default_budget_bytes() -> int:
+    """Returns the device memory budget from `MODEL_MEMORY_BUDGET_MB`.
+
+    Without the variable, 80% of the first CUDA device's memory is used, leaving room for
+    activations. A budget of 0 disables offloading altogether.
+
+    Returns:
+        int: The budget in bytes.
+    """
+    budget_mb = os.getenv("MODEL_MEMORY_BUDGET_MB")
+    if budget_mb:
+        return int(float(budget_mb) * 1024 * 1024)
+    if torch.cuda.is_available():
+        return int(torch.cuda.get_device_properties(0).total_memory * 0.8)
+    return 0
+
+def _model_bytes(model) -> int:
+    """Returns the memory taken by the parameters and buffers of a model."""
+    if not isinstance(model, torch.nn.Module):
+        return 0
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+def _model_device(model) -> "torch.device | None":
+    """Returns the device of the first parameter of a model, or None if it has none."""
+    if isinstance(model, torch.nn.Module):
+        for tensor in model.parameters():
+            return tensor.device
+    return None
+
+class ModelResidencyManager:
+    """Moves task models between the CPU and the accelerator on demand.
+
+    A model is moved to the accelerator when its task needs it and stays there until the
+    device memory budget would be exceeded by another model; only then are the least
+    recently used models moved back to the CPU. Hits, misses, evictions and transfer
+    times are recorded per model.
+    """
+
+    def __init__(self, budget_bytes: int | None = None):
+        """Initializes the manager.
+
+        Args:
+            budget_bytes (int | None): The memory the resident models may take on the device,
+                or None to read it from the environment (see `_default_budget_bytes`) when
+                the first model is acquired.
+        """
+        self._budget = budget_bytes
+        self._resident = OrderedDict()  # name -> bytes on the device, least recently used first
+        self._models = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, name: str, model, device):
+        """Makes sure a model is on the given device, evicting other models if needed.
+
+        Models that are not `torch.nn.Module`s are left alone.
+
+        Args:
+            name (str): The name of the task that owns the model.
+            model (torch.nn.Module): The model.
+            device (torch.device | str): The device the task is about to run the model on.
+        """
+        device = torch.device(device)
+        with self._lock:
+            if self._budget is None:
+                self._budget = _default_budget_bytes()
+            stats = self._stats.setdefault(name, {"hits": 0, "misses": 0, "evictions": 0, "transfer_seconds": 0.0})
+            self._models[name] = model
+            current = _model_device(model)
+            if current is None:
+                return
+            if device.type == "cpu":
+                self._resident.pop(name, None)
+                if current.type != "cpu":
+                    self._move(name, model, device)
+                return
+
+            if current == device or (current.type == device.type and device.index is None):
+                stats["hits"] += 1
+                if name not in self._resident:
+                    # Loaded straight onto the device: account for it and keep the others within budget.
+                    self._resident[name] = _model_bytes(model)
+                    self._make_room(0, keep=name)
+                self._resident.move_to_end(name)
+                return
+
+            stats["misses"] += 1
+            needed = _model_bytes(model)
+            evicted = self._make_room(needed, keep=name)
+            seconds = self._move(name, model, device)
+            self._resident[name] = needed
+            print(
+                f"Model {name} moved to {device} in {seconds:.2f}s ({needed / 2**20:.0f} MiB"
+                + (f", evicted {', '.join(evicted)}" if evicted else "")
+                + f"); resident {self.resident_bytes() / 2**20:.0f}/{self._budget / 2**20:.0f} MiB"
+            )
+
+    def _make_room(self, needed: int, keep: str) -> list[str]:
+        """Moves least recently used models to the CPU until `needed` more bytes fit the budget.
+
+        Args:
+            needed (int): The size of the model about to be moved to the device.
+            keep (str): The name of that model, which is never evicted.
+
+        Returns:
+            list[str]: The names of the evicted models.
+        """
+        if self._budget <= 0:
+            return []
+        evicted = []
+        for name in list(self._resident):
+            if self.resident_bytes() + needed <= self._budget:
+                break
+            if name == keep:
+                continue
+            del self._resident[name]
+            self._stats[name]["evictions"] += 1
+            self._move(name, self._models[name], torch.device("cpu"))
+            evicted.append(name)
+        if evicted:
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        return evicted
+
+    def _move(self, name: str, model, device: "torch.device") -> float:
+        """Moves a model and records the transfer time.
+
+        Returns:
+            float: The transfer time in seconds.
+        """
+        started = time.perf_counter()
+        model.to(device)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        seconds = time.perf_counter() - started
+        self._stats[name]["transfer_seconds"] += seconds
+        return seconds
+
+    def resident_bytes(self) -> int:
+        """Returns the memory taken by the models currently on the device."""
+        return sum(self._resident.values())
+
+    def stats(self) -> list[dict]:
+        """Returns the residency statistics.
+
+        Returns:
+            list[dict]: One entry per model with hit, miss and eviction counts, the total
+                        transfer time and whether the model is currently resident.
+        """
+        with self._lock:
+            return [
+                {"model": name, "resident": name in self._resident, **entry}
+                for name, entry in sorted(self._stats.items())
+            ]
+
+MODEL_RESIDENCY = ModelResidencyManager()
@@ -0,0 +1,114 @@
+"""This module plans the order in which the tasks of an analysis request run, based on their declared dependencies."""
+from .batching import BATCH_MAX_SIZE
+from .tasks import TASK_SPECS
+
+def dependency_levels(task_names) -> dict[str, int]:
+    """Orders a set of tasks by their dependencies.
+
+    Only dependencies on tasks of the set count: a dependency that is not part of the
+    request is assumed to be satisfied already.
+
+    Args:
+        task_names (iterable[str]): The names of the tasks.
+
+    Returns:
+        dict[str, int]: The level of every task: 0 for tasks without dependencies in the
+                        set, otherwise one more than the highest level of its dependencies.
+
+    Raises:
+        ValueError: If the dependencies form a cycle.
+    """
+    task_names = set(task_names)
+    levels = {}
+    visiting = set()
+
+    def level(name):
+        if name in levels:
+            return levels[name]
+        if name in visiting:
+            raise ValueError(f"Task dependencies form a cycle through '{name}'.")
+        visiting.add(name)
+        spec = TASK_SPECS.get(name)
+        dependencies = [dep for dep in (spec.depends_on if spec else ()) if dep in task_names and dep != name]
+        levels[name] = 1 + max((level(dep) for dep in dependencies), default=-1)
+        visiting.discard(name)
+        return levels[name]
+
+    for name in sorted(task_names):
+        level(name)
+    return levels
+
+def plan_request(items: list, lookup_projects) -> tuple[list, dict]:
+    """Splits an analysis request into work that can start right away and per-project schedules.
+
+    Tasks that take part in a dependency relation within the request, and project-level
+    tasks, are scheduled per project as an ordered list of steps:
+
+    - `("batch", task_name, pairs)`: a batch of a task that other tasks depend on; the
+      next step only starts once it is done.
+    - `("project", task_name, pairs)`: one run of a project-level task over the whole project.
+    - `("fan_out", items)`: per-image work whose dependencies are done; it is enqueued as
+      usual and nothing waits for it.
+
+    Everything else can start right away.
+
+    Args:
+        items (list): (image_id, task_name, job_item_id) tuples.
+        lookup_projects (callable): Called with the IDs of the images that need scheduling,
+            only if there are any, and returns a dict of their project IDs. Items of images
+            without a project are left to start right away, where they fail as usual.
+
+    Returns:
+        tuple: The (image_id, task_name, job_item_id) items to enqueue right away, and the
+               list of steps of every project ID.
+    """
+    levels = dependency_levels({task_name for _, task_name, _ in items})
+    depended_on = {
+        dep for name in levels
+        for dep in (TASK_SPECS[name].depends_on if name in TASK_SPECS else ())
+        if dep in levels and dep != name
+    }
+
+    def project_level(name):
+        return name in TASK_SPECS and TASK_SPECS[name].project_level
+
+    def needs_schedule(name):
+        return name in depended_on or levels[name] > 0 or project_level(name)
+
+    to_schedule = [item for item in items if needs_schedule(item[1])]
+    image_projects = lookup_projects(sorted({image_id for image_id, _, _ in to_schedule})) if to_schedule else {}
+
+    immediate = []
+    scheduled = {}  # project ID -> level -> task name -> items
+    for item in items:
+        image_id, task_name, _ = item
+        project_id = image_projects.get(image_id)
+        if project_id is None or not needs_schedule(task_name):
+            immediate.append(item)
+            continue
+        scheduled.setdefault(project_id, {}).setdefault(levels[task_name], {}).setdefault(task_name, []).append(item)
+
+    plans = {}
+    for project_id, by_level in scheduled.items():
+        steps = []
+        for level in sorted(by_level):
+            fan_out = []
+            chained = []
+            for task_name, task_items in sorted(by_level[level].items()):
+                pairs = [[image_id, job_item_id] for image_id, _, job_item_id in task_items]
+                if project_level(task_name):
+                    chained.append(("project", task_name, pairs))
+                elif task_name in depended_on:
+                    batch_size = TASK_SPECS[task_name].max_batch_size if task_name in TASK_SPECS else None
+                    batch_size = batch_size or BATCH_MAX_SIZE
+                    chained.extend(
+                        ("batch", task_name, pairs[start:start + batch_size])
+                        for start in range(0, len(pairs), batch_size)
+                    )
+                else:
+                    fan_out.extend(task_items)
+            if fan_out:
+                steps.append(("fan_out", fan_out))
+            steps.extend(chained)
+        plans[project_id] = steps
+    return immediate, plans
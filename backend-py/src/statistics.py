@@ -1,150 +1,149 @@
 import uuid
 from collections import Counter
-from .db import get_db_connection, release_db_connection
+from .async_db import acquire, to_numbered
 
-def calculate_user_statistics(user_id: str):
+# The queries use named placeholders, which `src.async_db.to_numbered` converts for asyncpg.
+_SELECT_EXIF = """
+    SELECT
+        e.camera_make,
+        e.camera_model,
+        e.lens_model,
+        e.focal_length_mm,
+        e.aperture_f,
+        e.iso
+    FROM image i
+    JOIN image_exif e ON i.id = e.image_id
+    WHERE i.user_id = %(user_id)s
+"""
+
+_SELECT_EXISTING = "SELECT id FROM shooting_pattern WHERE user_id = %(user_id)s"
+
+_RESET_EXISTING = """
+    UPDATE shooting_pattern SET
+        total_photos_analyzed = 0,
+        last_analyzed_at = NOW()
+    WHERE id = %(id)s
+"""
+
+_INSERT_EMPTY = """
+    INSERT INTO shooting_pattern (id, user_id, total_photos_analyzed, last_analyzed_at, created_at)
+    VALUES (%(id)s, %(user_id)s, 0, NOW(), NOW())
+"""
+
+_UPDATE_EXISTING = """
+    UPDATE shooting_pattern SET
+        most_used_camera_id = %(most_used_camera)s,
+        most_used_lens_id = %(most_used_lens)s,
+        avg_iso = %(avg_iso)s,
+        most_common_aperture = %(most_common_aperture)s,
+        most_common_focal_length = %(most_common_focal_length)s,
+        total_photos_analyzed = %(total_photos)s,
+        last_analyzed_at = NOW()
+    WHERE id = %(id)s
+"""
+
+_INSERT_NEW = """
+    INSERT INTO shooting_pattern (
+        id, user_id, most_used_camera_id, most_used_lens_id,
+        avg_iso, most_common_aperture, most_common_focal_length,
+        total_photos_analyzed, last_analyzed_at, created_at
+    )
+    VALUES (
+        %(id)s, %(user_id)s, %(most_used_camera)s, %(most_used_lens)s,
+        %(avg_iso)s, %(most_common_aperture)s, %(most_common_focal_length)s,
+        %(total_photos)s, NOW(), NOW()
+    )
+"""
+
+def _summarize(rows: list) -> dict:
+    """Computes the shooting statistics from a user's EXIF rows.
+
+    Args:
+        rows (list): (camera_make, camera_model, lens_model, focal_length, aperture, iso) rows.
+
+    Returns:
+        dict: The statistics, keyed by the placeholders of `_UPDATE_EXISTING` and `_INSERT_NEW`.
+    """
+    camera_counts = Counter()
+    lens_counts = Counter()
+    focal_length_counts = Counter()
+    aperture_counts = Counter()
+    iso_sum = 0
+    iso_count = 0
+
+    for row in rows:
+        camera_make, camera_model, lens_model, focal_length, aperture, iso = row
+
+        # Camera
+        if camera_make and camera_model:
+            camera_counts[f"{camera_make} {camera_model}"] += 1
+        elif camera_model:
+            camera_counts[camera_model] += 1
+
+        # Lens
+        if lens_model:
+            lens_counts[lens_model] += 1
+
+        # Focal Length
+        if focal_length is not None:
+             focal_length_counts[float(focal_length)] += 1
+
+        # Aperture
+        if aperture is not None:
+            aperture_counts[float(aperture)] += 1
+
+        # ISO
+        if iso is not None:
+            iso_sum += iso
+            iso_count += 1
+
+    return {
+        "most_used_camera": camera_counts.most_common(1)[0][0] if camera_counts else None,
+        "most_used_lens": lens_counts.most_common(1)[0][0] if lens_counts else None,
+        "most_common_focal_length": focal_length_counts.most_common(1)[0][0] if focal_length_counts else None,
+        "most_common_aperture": aperture_counts.most_common(1)[0][0] if aperture_counts else None,
+        "avg_iso": (iso_sum / iso_count) if iso_count > 0 else None,
+        "total_photos": len(rows),
+    }
+
+def _write_statements(user_id: str, rows: list, existing_id: str | None) -> tuple[str, dict]:
+    """Returns the statement and parameters that store a user's statistics.
+
+    Args:
+        user_id (str): The ID of the user.
+        rows (list): The user's EXIF rows.
+        existing_id (str | None): The ID of the user's existing statistics row, if any.
+
+    Returns:
+        tuple: The query and its named parameters.
+    """
+    if not rows:
+        # No photos or no EXIF data
+        if existing_id:
+            return _RESET_EXISTING, {"id": existing_id}
+        return _INSERT_EMPTY, {"id": str(uuid.uuid4()), "user_id": user_id}
+    stats = _summarize(rows)
+    if existing_id:
+        return _UPDATE_EXISTING, {"id": existing_id, **stats}
+    return _INSERT_NEW, {"id": str(uuid.uuid4()), "user_id": user_id, **stats}
+
+async def calculate_user_statistics_async(user_id: str):
     """Calculates shooting statistics for a user and updates the database.
 
+    Runs on the server's asyncio pool, so it waits for the database without holding a thread.
+
     Args:
         user_id (str): The ID of the user.
     """
-    conn = None
-    cur = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        # 1. Fetch all EXIF data for the user's images
-        cur.execute(
-            """
-            SELECT 
-                e.camera_make,
-                e.camera_model,
-                e.lens_model,
-                e.focal_length_mm,
-                e.aperture_f,
-                e.iso
-            FROM image i
-            JOIN image_exif e ON i.id = e.image_id
-            WHERE i.user_id = %s
-            """,
-            (user_id,)
-        )
-        rows = cur.fetchall()
-
-        # Check if stats exist
-        cur.execute("SELECT id FROM shooting_pattern WHERE user_id = %s", (user_id,))
-        existing_row = cur.fetchone()
-        existing_id = existing_row[0] if existing_row else None
-
-        if not rows:
-            # No photos or no EXIF data
-            if existing_id:
-                cur.execute(
-                    """
-                    UPDATE shooting_pattern SET
-                        total_photos_analyzed = 0,
-                        last_analyzed_at = NOW()
-                    WHERE id = %s
-                    """,
-                    (existing_id,)
-                )
-            else:
-                cur.execute(
-                    """
-                    INSERT INTO shooting_pattern (id, user_id, total_photos_analyzed, last_analyzed_at, created_at)
-                    VALUES (%s, %s, 0, NOW(), NOW())
-                    """,
-                    (str(uuid.uuid4()), user_id)
-                )
-            conn.commit()
-            return
-
-        total_photos = len(rows)
-        
-        camera_counts = Counter()
-        lens_counts = Counter()
-        focal_length_counts = Counter()
-        aperture_counts = Counter()
-        iso_sum = 0
-        iso_count = 0
-
-        for row in rows:
-            camera_make, camera_model, lens_model, focal_length, aperture, iso = row
-            
-            # Camera
-            if camera_make and camera_model:
-                camera_counts[f"{camera_make} {camera_model}"] += 1
-            elif camera_model:
-                camera_counts[camera_model] += 1
-            
-            # Lens
-            if lens_model:
-                lens_counts[lens_model] += 1
-            
-            # Focal Length
-            if focal_length is not None:
-                 focal_length_counts[float(focal_length)] += 1
-
-            # Aperture
-            if aperture is not None:
-                aperture_counts[float(aperture)] += 1
-            
-            # ISO
-            if iso is not None:
-                iso_sum += iso
-                iso_count += 1
-
-        most_used_camera = camera_counts.most_common(1)[0][0] if camera_counts else None
-        most_used_lens = lens_counts.most_common(1)[0][0] if lens_counts else None
-        most_common_focal_length = focal_length_counts.most_common(1)[0][0] if focal_length_counts else None
-        most_common_aperture = aperture_counts.most_common(1)[0][0] if aperture_counts else None
-        avg_iso = (iso_sum / iso_count) if iso_count > 0 else None
-
-        # Update database
-        if existing_id:
-            cur.execute(
-                """
-                UPDATE shooting_pattern SET
-                    most_used_camera_id = %s,
-                    most_used_lens_id = %s,
-                    avg_iso = %s,
-                    most_common_aperture = %s,
-                    most_common_focal_length = %s,
-                    total_photos_analyzed = %s,
-                    last_analyzed_at = NOW()
-                WHERE id = %s
-                """,
-                (
-                    most_used_camera, most_used_lens,
-                    avg_iso, most_common_aperture, most_common_focal_length,
-                    total_photos, existing_id
-                )
-            )
-        else:
-            cur.execute(
-                """
-                INSERT INTO shooting_pattern (
-                    id, user_id, most_used_camera_id, most_used_lens_id, 
-                    avg_iso, most_common_aperture, most_common_focal_length, 
-                    total_photos_analyzed, last_analyzed_at, created_at
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
-                """,
-                (
-                    str(uuid.uuid4()), user_id, most_used_camera, most_used_lens,
-                    avg_iso, most_common_aperture, most_common_focal_length,
-                    total_photos
-                )
-            )
-        conn.commit()
+        async with acquire() as conn:
+            async with conn.transaction():
+                query, args = to_numbered(_SELECT_EXIF, {"user_id": user_id})
+                rows = await conn.fetch(query, *args)
+                query, args = to_numbered(_SELECT_EXISTING, {"user_id": user_id})
+                existing_id = await conn.fetchval(query, *args)
 
+                query, args = to_numbered(*_write_statements(user_id, [tuple(row) for row in rows], existing_id))
+                await conn.execute(query, *args)
     except Exception as e:
         print(f"Error calculating statistics for user {user_id}: {e}")
-        if conn:
-            conn.rollback()
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            release_db_connection(conn)
@@ -1,19 +1,78 @@
-"""This module initializes the task registry and provides a decorator for registering tasks."""
-import gc
-import torch
+"""This module initializes the task registry and provides a decorator for registering tasks.
+
+Tasks are known by name and metadata in `TASK_SPECS`, which is all the worker needs to
+route, batch and schedule them. A task's module, and the model libraries it uses, are
+only imported when the task is first executed (see `get_task_class`).
+"""
+import importlib
 import os
+from typing import NamedTuple
 
 TASK_REGISTRY = {}
 
+# The Celery queue of tasks that do not declare their own: cheap, CPU-only work.
+DEFAULT_QUEUE = "cpu-light"
+
+# Images written per transaction by the bulk EXIF path, and per EXIF batch message.
+EXIF_BULK_CHUNK_SIZE = int(os.getenv("EXIF_BULK_CHUNK_SIZE", "500"))
+
+class TaskSpec(NamedTuple):
+    """The metadata of a task. See `ImageProcessingTask` for the meaning of each field."""
+    queue: str = DEFAULT_QUEUE
+    execution: str = "inline"
+    supports_batching: bool = False
+    max_batch_size: int | None = None
+    supports_prefetch: bool = False
+    decode_min_side: int | None = 0
+    depends_on: tuple = ()
+    project_level: bool = False
+
+# Every task, by name. Task modules are named after their task.
+TASK_SPECS = {
+    # Header reads and parsing are mostly file I/O, which releases the GIL.
+    "exif_analysis": TaskSpec(execution="thread", supports_batching=True, max_batch_size=EXIF_BULK_CHUNK_SIZE),
+    # Groups are built from the coordinates that EXIF extraction stores, over the whole project.
+    "gps_grouping": TaskSpec(depends_on=("exif_analysis",), project_level=True),
+    # Florence-2 resizes every image to 768x768, so it never sees finer detail than this.
+    "image_captioning": TaskSpec(
+        queue="model-captioning", supports_batching=True, supports_prefetch=True, decode_min_side=768
+    ),
+    # YOLO letterboxes every image to 640 pixels; boxes are scaled back to the original's size.
+    "object_detection": TaskSpec(
+        queue="model-detection", supports_batching=True, supports_prefetch=True, decode_min_side=640
+    ),
+    "quality_assessment": TaskSpec(
+        queue="model-quality", supports_batching=True, supports_prefetch=True, decode_min_side=None
+    ),
+    # Grouping runs mostly Python code around the hashes, which holds the GIL. Groups are built
+    # from the capture times that EXIF extraction stores, and the perceptual hash is computed
+    # on a 32x32 image, so a 1/8 scale decode is plenty.
+    "similarity_grouping": TaskSpec(
+        execution="process", depends_on=("exif_analysis",), project_level=True, decode_min_side=256
+    ),
+    # Decoding, resizing and encoding in Pillow release the GIL. Decode at twice the
+    # thumbnail width so LANCZOS still has detail to filter from.
+    "thumbnail_generation": TaskSpec(execution="thread", decode_min_side=512),
+}
+
 def register_task(name):
     """A decorator to register a task class in the TASK_REGISTRY.
 
+    The class gets the metadata of its entry in `TASK_SPECS` as class attributes.
+
     Args:
         name (str): The name to register the task with.
 
     Returns:
         function: The decorator function.
+
+    Raises:
+        ValueError: If the task has no entry in `TASK_SPECS`.
     """
+    spec = TASK_SPECS.get(name)
+    if spec is None:
+        raise ValueError(f"Task '{name}' has no entry in TASK_SPECS.")
+
     def decorator(cls):
         """The actual decorator that registers the class.
 
@@ -23,29 +82,33 @@ def register_task(name):
         Returns:
             class: The registered class.
         """
+        for field, value in spec._asdict().items():
+            setattr(cls, field, value)
         TASK_REGISTRY[name] = cls
         return cls
     return decorator
 
-def unload_other_models(current_task_class):
-    """Offloads models from all other registered tasks to CPU to free up GPU memory.
+def get_task_class(task_name: str):
+    """Returns the class of a task, importing the task's module on first use.
 
     Args:
-        current_task_class (class): The class of the task currently attempting to run.
+        task_name (str): The name of the task.
+
+    Returns:
+        type | None: The task class, or None if there is no such task.
+    """
+    if task_name not in TASK_REGISTRY and task_name in TASK_SPECS:
+        importlib.import_module(f"{__name__}.{task_name}")
+    return TASK_REGISTRY.get(task_name)
+
+def task_queue(task_name: str) -> str:
+    """Returns the Celery queue that messages of a task are routed to.
+
+    Args:
+        task_name (str): The name of the task.
+
+    Returns:
+        str: The task's queue, or `DEFAULT_QUEUE` for an unknown task.
     """
-    for name, task_cls in TASK_REGISTRY.items():
-        if task_cls != current_task_class:
-            if hasattr(task_cls, 'model') and task_cls.model is not None:
-                print(f"Offloading model for task: {name} to CPU")
-                if hasattr(task_cls.model, 'cpu'):
-                    task_cls.model.cpu()
-                elif hasattr(task_cls.model, 'to'):
-                    task_cls.model.to('cpu')
-                # For Ultralytics YOLO, checking internal model
-                elif hasattr(task_cls.model, 'model') and hasattr(task_cls.model.model, 'cpu'):
-                    task_cls.model.model.cpu()
-
-    gc.collect()
-    use_gpu = os.getenv("USE_GPU", "true").lower() == "true"
-    if use_gpu and torch.cuda.is_available():
-        torch.cuda.empty_cache()
+    spec = TASK_SPECS.get(task_name)
+    return spec.queue if spec else DEFAULT_QUEUE
@@ -1,5 +1,7 @@
 """This module defines the abstract base class for all image processing tasks."""
 from abc import ABC, abstractmethod
+from ..db import get_db_connection, release_db_connection
+from . import DEFAULT_QUEUE
 
 class ImageProcessingTask(ABC):
     """Abstract base class for image processing tasks.
@@ -8,6 +10,42 @@ class ImageProcessingTask(ABC):
     and implement the `run` method.
     """
 
+    # The attributes down to `project_level` are set from the task's entry in `TASK_SPECS`
+    # (see `register_task`), so that the worker can route, batch and schedule a task
+    # without importing its module.
+
+    # Whether the worker may group several pending items of this task into a
+    # single `run_batch` call. Enabled for tasks that run a batched forward pass.
+    supports_batching = False
+    # The maximum number of items per batch, or None to use `BATCH_MAX_SIZE`.
+    max_batch_size = None
+    # Whether the task implements `prepare` and `run_prepared_batch`, which lets the worker
+    # load and preprocess upcoming images while the model runs (see `src.prefetch`).
+    supports_prefetch = False
+
+    # The shortest side, in pixels, this task needs of a decoded image. 0 means the task
+    # does not look at pixels and None means it needs the full resolution.
+    decode_min_side = 0
+
+    # How the worker runs this task: "inline", "thread" or "process" (see `src.execution`).
+    # Tasks that run a model stay inline, so they never use the model concurrently.
+    execution = "inline"
+
+    # The Celery queue this task's messages are routed to. Tasks backed by a model get a
+    # queue of their own, so a worker subscribed to it keeps that one model loaded.
+    queue = DEFAULT_QUEUE
+
+    # The names of the tasks whose results this task reads. Within one analysis request,
+    # this task only starts once those tasks are done for the images of the project.
+    depends_on = ()
+    # Whether the task works on a whole project at once. Requests run it once per project,
+    # through `run_project`, instead of once per image.
+    project_level = False
+
+    # A query returning the images among `%(image_ids)s` that the task has already processed
+    # at version `%(version)s`, used by `filter_already_processed`.
+    processed_query = None
+
     @property
     def version(self):
         """Returns the version of the task/model."""
@@ -25,6 +63,45 @@ class ImageProcessingTask(ABC):
         """
         return False
 
+    def filter_already_processed(self, cur, image_ids: list[str]) -> set[str]:
+        """Returns the images among `image_ids` that the task has already processed at its version.
+
+        Tasks that set `processed_query` answer with that single set-based query. Otherwise
+        `check_already_processed` is called for each image in turn.
+
+        Args:
+            cur (psycopg2.extensions.cursor): The database cursor.
+            image_ids (list[str]): The IDs of the images.
+
+        Returns:
+            set[str]: The IDs of the images that are already processed.
+        """
+        if self.processed_query:
+            cur.execute(self.processed_query, {"image_ids": list(image_ids), "version": self.version})
+            return {row[0] for row in cur.fetchall()}
+        return {image_id for image_id in image_ids if self.check_already_processed(cur, image_id)}
+
+    def load_model(self):
+        """Loads the task's model, if it has one, and moves it to the device it runs on.
+
+        Model tasks call this before every inference; it only loads the model once. The
+        default implementation does nothing.
+        """
+        pass
+
+    def warm_up(self, batch_size: int, side: int):
+        """Runs the task's model once on a batch of blank images, without storing anything.
+
+        Called by `src.warmup` after `load_model` when the worker starts, so that the first
+        real batch does not pay for lazy initialization and kernel selection. The default
+        implementation does nothing.
+
+        Args:
+            batch_size (int): The number of images in the batch.
+            side (int): The side of the blank square images, in pixels.
+        """
+        pass
+
     @abstractmethod
     def run(self, image_id: str):
         """The main execution method for the task.
@@ -33,3 +110,94 @@ class ImageProcessingTask(ABC):
             image_id (str): The ID of the image to be processed.
         """
         pass
+
+
+    def run_decoded(self, image_id: str, decoded):
+        """Processes an image that the analyze pipeline has already read and decoded.
+
+        Tasks that work on pixels or file headers override this to use the shared
+        image instead of opening the original file again. The default implementation
+        ignores the decoded image and calls `run`.
+
+        Args:
+            image_id (str): The ID of the image to be processed.
+            decoded (src.imaging.DecodedImage): The shared, decoded original image.
+        """
+        self.run(image_id)
+
+    def run_batch(self, image_ids: list[str]) -> dict:
+        """Processes several images in a single call.
+
+        Tasks backed by a neural network override this to run one batched forward pass.
+        The default implementation calls `run` for each image in turn.
+
+        Args:
+            image_ids (list[str]): The IDs of the images to be processed.
+
+        Returns:
+            dict: A mapping of image ID to the exception raised while processing that image.
+                  Images that are not in the mapping were processed successfully.
+        """
+        errors = {}
+        for image_id in image_ids:
+            try:
+                self.run(image_id)
+            except Exception as exc:
+                errors[image_id] = exc
+        return errors
+
+    def prepare(self, decoded):
+        """Turns a decoded image into the input of `run_prepared_batch`.
+
+        Runs on a prefetch thread while the model works on earlier images, so it should do
+        all CPU-side preprocessing that does not need the model.
+
+        Args:
+            decoded (src.imaging.DecodedImage): The original image, read and ready to decode.
+
+        Returns:
+            The prepared input. The default implementation returns the decoded RGB image.
+        """
+        return decoded.image
+
+    def run_prepared_batch(self, items: list) -> dict:
+        """Processes a batch of images prepared by `prepare` and stores the results.
+
+        Only called for tasks that set `supports_prefetch`.
+
+        Args:
+            items (list): (image_id, prepared) pairs.
+
+        Returns:
+            dict: A mapping of image ID to the exception raised while processing that image.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support prefetching.")
+
+    def run_project(self, project_id: str) -> dict:
+        """Processes every image of a project that this task has not processed yet.
+
+        Tasks override this with a set-based implementation where one exists. The default
+        implementation selects the images of the project and hands the unprocessed ones
+        to `run_batch`.
+
+        Args:
+            project_id (str): The ID of the project.
+
+        Returns:
+            dict: A mapping of image ID to the exception raised while processing that image.
+        """
+        conn = None
+        cur = None
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor()
+            cur.execute("SELECT id FROM image WHERE project_id = %s", (project_id,))
+            image_ids = [row[0] for row in cur.fetchall()]
+            done = self.filter_already_processed(cur, image_ids)
+            image_ids = [image_id for image_id in image_ids if image_id not in done]
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                release_db_connection(conn)
+        return self.run_batch(image_ids)
@@ -3,13 +3,23 @@ from PIL import Image
 from PIL.ExifTags import TAGS, GPSTAGS
 import os
 import uuid
+import io
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from psycopg2.extras import execute_values
 from ..db import get_db_connection, release_db_connection
-from . import register_task
+from ..exif_reader import read_image_header
+from ..imaging import resolve_storage_path
+from . import EXIF_BULK_CHUNK_SIZE, register_task
 from .base import ImageProcessingTask
 
+# Header reads are I/O-bound, so use many more threads than cores.
+EXIF_READ_THREADS = int(os.getenv("EXIF_READ_THREADS", "16"))
+
 @register_task("exif_analysis")
 class ExifAnalysisTask(ImageProcessingTask):
+    processed_query = "SELECT image_id FROM image_exif WHERE image_id = ANY(%(image_ids)s)"
+
     @property
     def version(self):
         return "1.0.0"
@@ -57,6 +67,30 @@ class ExifAnalysisTask(ImageProcessingTask):
         except Exception:
             return None, None
 
+    def _read_metadata(self, source):
+        """Reads the dimensions, EXIF and GPS data of an image.
+
+        JPEG and PNG headers are parsed directly by `read_image_header`, without going
+        through Pillow's decoder machinery. Other formats (HEIC, WebP, TIFF, ...) and
+        files the header parser cannot handle fall back to Pillow.
+
+        Args:
+            source (str | bytes): The path of the image file, or its contents.
+
+        Returns:
+            tuple: A tuple of (width, height, exif_data, gps_info).
+        """
+        header = read_image_header(source)
+        if header is not None:
+            return header
+
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        with Image.open(source) as img:
+            width, height = img.size
+            exif_data, gps_info = self._get_exif_data_from_img(img)
+        return width, height, exif_data, gps_info
+
     def _convert_dms_to_dd(self, dms, ref):
         """Converts GPS coordinates from DMS (Degrees, Minutes, Seconds) to DD (Decimal Degrees).
 
@@ -94,6 +128,143 @@ class ExifAnalysisTask(ImageProcessingTask):
         except (ValueError, TypeError):
             return None
 
+    def _metadata_rows(self, image_id: str, width: int, height: int, exif_data, gps_info):
+        """Converts the metadata of an image into rows for the `image`, `image_exif` and `image_gps` tables.
+
+        Args:
+            image_id (str): The ID of the image.
+            width (int): The stored width of the image in pixels.
+            height (int): The stored height of the image in pixels.
+            exif_data (dict | None): The decoded EXIF data.
+            gps_info (dict | None): The decoded GPS data.
+
+        Returns:
+            tuple: A tuple of (image_row, exif_row, gps_row), where exif_row and gps_row
+                   are None if the image has no EXIF or GPS data.
+        """
+        capture_time = None
+        exif_row = None
+        gps_row = None
+
+        if exif_data:
+            # Try different tags for date time
+            for tag in ['DateTimeOriginal', 'DateTimeDigitized', 'DateTime']:
+                if tag in exif_data:
+                    capture_time = self._parse_exif_date(exif_data[tag])
+                    if capture_time:
+                        break
+
+            # Map Flash to boolean
+            flash_val = exif_data.get('Flash')
+            flash_fired = bool(flash_val & 1) if isinstance(flash_val, int) else None
+
+            # Map ExposureProgram to string (Shooting Mode)
+            exposure_program_map = {
+                0: 'Not Defined',
+                1: 'Manual',
+                2: 'Normal Program',
+                3: 'Aperture Priority',
+                4: 'Shutter Priority',
+                5: 'Creative Program',
+                6: 'Action Program',
+                7: 'Portrait Mode',
+                8: 'Landscape Mode'
+            }
+            exposure_program = exif_data.get('ExposureProgram')
+            shooting_mode = exposure_program_map.get(exposure_program, str(exposure_program)) if exposure_program is not None else None
+
+            exif_row = (
+                str(uuid.uuid4()), image_id,
+                exif_data.get('Make'), exif_data.get('Model'), exif_data.get('LensMake'), exif_data.get('LensModel'),
+                exif_data.get('FocalLength'), exif_data.get('FNumber'),
+                str(exif_data.get('ExposureTime')),
+                str(int(float(exif_data.get('ISOSpeedRatings')))) if exif_data.get('ISOSpeedRatings') else None,
+                exif_data.get('ExposureBiasValue'),
+                flash_fired,
+                str(exif_data.get('WhiteBalance')) if exif_data.get('WhiteBalance') is not None else None,
+                shooting_mode,
+                exif_data.get('Orientation')
+            )
+
+        if gps_info and 'GPSLatitude' in gps_info and 'GPSLongitude' in gps_info:
+            lat = self._convert_dms_to_dd(gps_info['GPSLatitude'], gps_info.get('GPSLatitudeRef'))
+            lon = self._convert_dms_to_dd(gps_info['GPSLongitude'], gps_info.get('GPSLongitudeRef'))
+            alt = gps_info.get('GPSAltitude')
+            gps_row = (str(uuid.uuid4()), image_id, lat, lon, alt)
+
+        return (image_id, width, height, capture_time), exif_row, gps_row
+
+    def _write_metadata_rows(self, cur, image_rows: list, exif_rows: list, gps_rows: list):
+        """Writes metadata rows with one multi-row statement per table.
+
+        Args:
+            cur (psycopg2.extensions.cursor): The database cursor.
+            image_rows (list): (image_id, width, height, capture_time) tuples.
+            exif_rows (list): Rows for `image_exif`, at most one per image.
+            gps_rows (list): Rows for `image_gps`, at most one per image.
+        """
+        if image_rows:
+            # Keep an existing capture time if the EXIF has none
+            execute_values(cur, """
+                UPDATE image SET
+                    width_px = v.width_px,
+                    height_px = v.height_px,
+                    capture_datetime = COALESCE(v.capture_datetime, image.capture_datetime),
+                    updated_at = NOW()
+                FROM (VALUES %s) AS v(id, width_px, height_px, capture_datetime)
+                WHERE image.id = v.id
+            """, image_rows, template="(%s, %s::integer, %s::integer, %s::timestamp)", page_size=len(image_rows))
+
+        if exif_rows:
+            # Using INSERT ... ON CONFLICT to handle existing records
+            execute_values(cur, """
+                INSERT INTO image_exif (
+                    id, image_id, camera_make, camera_model, lens_make, lens_model, 
+                    focal_length_mm, aperture_f, shutter_speed, iso, 
+                    exposure_compensation, flash_fired, white_balance, shooting_mode, orientation,
+                    created_at
+                )
+                VALUES %s
+                ON CONFLICT (image_id) DO UPDATE SET
+                    camera_make = EXCLUDED.camera_make,
+                    camera_model = EXCLUDED.camera_model,
+                    lens_make = EXCLUDED.lens_make,
+                    lens_model = EXCLUDED.lens_model,
+                    focal_length_mm = EXCLUDED.focal_length_mm,
+                    aperture_f = EXCLUDED.aperture_f,
+                    shutter_speed = EXCLUDED.shutter_speed,
+                    iso = EXCLUDED.iso,
+                    exposure_compensation = EXCLUDED.exposure_compensation,
+                    flash_fired = EXCLUDED.flash_fired,
+                    white_balance = EXCLUDED.white_balance,
+                    shooting_mode = EXCLUDED.shooting_mode,
+                    orientation = EXCLUDED.orientation;
+            """, exif_rows, template="(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())", page_size=len(exif_rows))
+
+        if gps_rows:
+            execute_values(cur, """
+                INSERT INTO image_gps (id, image_id, latitude, longitude, altitude_m, created_at)
+                VALUES %s
+                ON CONFLICT (image_id) DO UPDATE SET
+                    latitude = EXCLUDED.latitude,
+                    longitude = EXCLUDED.longitude,
+                    altitude_m = EXCLUDED.altitude_m;
+            """, gps_rows, template="(%s, %s, %s, %s, %s, NOW())", page_size=len(gps_rows))
+
+    def _store_metadata(self, cur, image_id: str, width: int, height: int, exif_data, gps_info):
+        """Stores the dimensions, EXIF and GPS data of an image.
+
+        Args:
+            cur (psycopg2.extensions.cursor): The database cursor.
+            image_id (str): The ID of the image.
+            width (int): The stored width of the image in pixels.
+            height (int): The stored height of the image in pixels.
+            exif_data (dict | None): The decoded EXIF data.
+            gps_info (dict | None): The decoded GPS data.
+        """
+        image_row, exif_row, gps_row = self._metadata_rows(image_id, width, height, exif_data, gps_info)
+        self._write_metadata_rows(cur, [image_row], [exif_row] if exif_row else [], [gps_row] if gps_row else [])
+
     def run(self, image_id: str):
         """The main execution method for the task.
 
@@ -115,111 +286,134 @@ class ExifAnalysisTask(ImageProcessingTask):
                 return
 
             image_path = image_path_tuple[0]
-            storage_base_path = os.getenv("STORAGE_BASE_PATH", "/storage")
-            full_image_path = os.path.join(storage_base_path, image_path)
+            full_image_path = resolve_storage_path(image_path)
 
             try:
-                with Image.open(full_image_path) as img:
-                    width, height = img.size
-                    exif_data, gps_info = self._get_exif_data_from_img(img)
+                width, height, exif_data, gps_info = self._read_metadata(full_image_path)
             except Exception as e:
                 print(f"Error opening image {image_id}: {e}")
                 return
 
-            # Update image dimensions
-            cur.execute(
-                "UPDATE image SET width_px = %s, height_px = %s WHERE id = %s",
-                (width, height, image_id)
-            )
+            self._store_metadata(cur, image_id, width, height, exif_data, gps_info)
+            conn.commit()
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                release_db_connection(conn)
+
+    def run_decoded(self, image_id: str, decoded):
+        """Extracts EXIF and GPS data from the header of an image read by the analyze pipeline.
 
-            if exif_data:
-                # Extract capture time
-                capture_time = None
-                # Try different tags for date time
-                for tag in ['DateTimeOriginal', 'DateTimeDigitized', 'DateTime']:
-                    if tag in exif_data:
-                        capture_time = self._parse_exif_date(exif_data[tag])
-                        if capture_time:
-                            break
-                
-                if capture_time:
-                    cur.execute(
-                        "UPDATE image SET capture_datetime = %s WHERE id = %s",
-                        (capture_time, image_id)
-                    )
-
-                # Map Flash to boolean
-                flash_val = exif_data.get('Flash')
-                flash_fired = bool(flash_val & 1) if isinstance(flash_val, int) else None
-
-                # Map ExposureProgram to string (Shooting Mode)
-                exposure_program_map = {
-                    0: 'Not Defined',
-                    1: 'Manual',
-                    2: 'Normal Program',
-                    3: 'Aperture Priority',
-                    4: 'Shutter Priority',
-                    5: 'Creative Program',
-                    6: 'Action Program',
-                    7: 'Portrait Mode',
-                    8: 'Landscape Mode'
-                }
-                exposure_program = exif_data.get('ExposureProgram')
-                shooting_mode = exposure_program_map.get(exposure_program, str(exposure_program)) if exposure_program is not None else None
-
-                # Using INSERT ... ON CONFLICT to handle existing records
-                cur.execute("""
-                    INSERT INTO image_exif (
-                        id, image_id, camera_make, camera_model, lens_make, lens_model, 
-                        focal_length_mm, aperture_f, shutter_speed, iso, 
-                        exposure_compensation, flash_fired, white_balance, shooting_mode, orientation,
-                        created_at
-                    )
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
-                    ON CONFLICT (image_id) DO UPDATE SET
-                        camera_make = EXCLUDED.camera_make,
-                        camera_model = EXCLUDED.camera_model,
-                        lens_make = EXCLUDED.lens_make,
-                        lens_model = EXCLUDED.lens_model,
-                        focal_length_mm = EXCLUDED.focal_length_mm,
-                        aperture_f = EXCLUDED.aperture_f,
-                        shutter_speed = EXCLUDED.shutter_speed,
-                        iso = EXCLUDED.iso,
-                        exposure_compensation = EXCLUDED.exposure_compensation,
-                        flash_fired = EXCLUDED.flash_fired,
-                        white_balance = EXCLUDED.white_balance,
-                        shooting_mode = EXCLUDED.shooting_mode,
-                        orientation = EXCLUDED.orientation;
-                """, (
-                    str(uuid.uuid4()), image_id,
-                    exif_data.get('Make'), exif_data.get('Model'), exif_data.get('LensMake'), exif_data.get('LensModel'),
-                    exif_data.get('FocalLength'), exif_data.get('FNumber'),
-                    str(exif_data.get('ExposureTime')),
-                    str(int(float(exif_data.get('ISOSpeedRatings')))) if exif_data.get('ISOSpeedRatings') else None,
-                    exif_data.get('ExposureBiasValue'),
-                    flash_fired,
-                    str(exif_data.get('WhiteBalance')) if exif_data.get('WhiteBalance') is not None else None,
-                    shooting_mode,
-                    exif_data.get('Orientation')
-                ))
-
-            if gps_info and 'GPSLatitude' in gps_info and 'GPSLongitude' in gps_info:
-                lat = self._convert_dms_to_dd(gps_info['GPSLatitude'], gps_info.get('GPSLatitudeRef'))
-                lon = self._convert_dms_to_dd(gps_info['GPSLongitude'], gps_info.get('GPSLongitudeRef'))
-                alt = gps_info.get('GPSAltitude')
-
-                cur.execute("""
-                    INSERT INTO image_gps (id, image_id, latitude, longitude, altitude_m, created_at)
-                    VALUES (%s, %s, %s, %s, %s, NOW())
-                    ON CONFLICT (image_id) DO UPDATE SET
-                        latitude = EXCLUDED.latitude,
-                        longitude = EXCLUDED.longitude,
-                        altitude_m = EXCLUDED.altitude_m;
-                """, (str(uuid.uuid4()), image_id, lat, lon, alt))
+        Args:
+            image_id (str): The ID of the image to be processed.
+            decoded (src.imaging.DecodedImage): The shared original image.
+        """
+        try:
+            width, height, exif_data, gps_info = self._read_metadata(decoded.data)
+        except Exception as e:
+            print(f"Error opening image {image_id}: {e}")
+            return
 
+        conn = None
+        cur = None
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor()
+            self._store_metadata(cur, image_id, width, height, exif_data, gps_info)
             conn.commit()
         finally:
             if cur:
                 cur.close()
             if conn:
                 release_db_connection(conn)
+
+    def run_batch(self, image_ids: list[str]) -> dict:
+        """Extracts metadata for many images, reading headers in parallel and writing in bulk.
+
+        Headers are read by a thread pool. The results are written with multi-row
+        statements, one transaction per chunk of `EXIF_BULK_CHUNK_SIZE` images, so the
+        database cost is a handful of round trips per chunk instead of several per image.
+
+        Args:
+            image_ids (list[str]): The IDs of the images to be processed.
+
+        Returns:
+            dict: A mapping of image ID to the exception raised while reading that image.
+        """
+        errors = {}
+        conn = None
+        cur = None
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor()
+
+            cur.execute("SELECT id, storage_path FROM image WHERE id = ANY(%s)", (list(image_ids),))
+            image_paths = dict(cur.fetchall())
+
+            def read(image_id):
+                try:
+                    return image_id, self._read_metadata(resolve_storage_path(image_paths[image_id])), None
+                except Exception as e:
+                    return image_id, None, e
+
+            # Deduplicate so a multi-row upsert never touches the same row twice
+            pending = list(dict.fromkeys(image_id for image_id in image_ids if image_id in image_paths))
+            with ThreadPoolExecutor(max_workers=EXIF_READ_THREADS) as executor:
+                for start in range(0, len(pending), EXIF_BULK_CHUNK_SIZE):
+                    image_rows, exif_rows, gps_rows = [], [], []
+                    for image_id, metadata, error in executor.map(read, pending[start:start + EXIF_BULK_CHUNK_SIZE]):
+                        if error is not None:
+                            print(f"Error opening image {image_id}: {error}")
+                            errors[image_id] = error
+                            continue
+                        try:
+                            image_row, exif_row, gps_row = self._metadata_rows(image_id, *metadata)
+                        except Exception as e:
+                            errors[image_id] = e
+                            continue
+                        image_rows.append(image_row)
+                        if exif_row:
+                            exif_rows.append(exif_row)
+                        if gps_row:
+                            gps_rows.append(gps_row)
+
+                    self._write_metadata_rows(cur, image_rows, exif_rows, gps_rows)
+                    conn.commit()
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                release_db_connection(conn)
+        return errors
+
+    def run_project(self, project_id: str) -> dict:
+        """Extracts metadata in bulk for every image of a project that has no EXIF record yet.
+
+        Args:
+            project_id (str): The ID of the project.
+
+        Returns:
+            dict: A mapping of image ID to the exception raised while reading that image.
+        """
+        conn = None
+        cur = None
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor()
+            cur.execute(
+                """
+                SELECT i.id
+                FROM image i
+                LEFT JOIN image_exif e ON e.image_id = i.id
+                WHERE i.project_id = %s AND e.image_id IS NULL
+                """,
+                (project_id,)
+            )
+            image_ids = [row[0] for row in cur.fetchall()]
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                release_db_connection(conn)
+        return self.run_batch(image_ids)
@@ -1,12 +1,25 @@
 """This module defines the Celery task for grouping images based on GPS location."""
 import math
 import uuid
+import numpy as np
+from ..clustering import radius_components
 from ..db import get_db_connection, release_db_connection
+from ..group_writer import add_group_members, merge_groups, replace_project_groups
 from . import register_task
 from .base import ImageProcessingTask
 
 @register_task("gps_grouping")
 class GpsGroupingTask(ImageProcessingTask):
+    # Images taken within this distance of each other end up in the same group.
+    max_distance_m = 100.0
+
+    processed_query = """
+        SELECT DISTINCT igm.image_id
+        FROM image_group_membership igm
+        JOIN image_group ig ON igm.group_id = ig.id
+        WHERE igm.image_id = ANY(%(image_ids)s) AND ig.group_type = 'gps'
+    """
+
     @property
     def version(self):
         return "1.0.0"
@@ -48,6 +61,59 @@ class GpsGroupingTask(ImageProcessingTask):
 
         return R * c
 
+    def run_project(self, project_id: str) -> dict:
+        """Regroups all images of a project with GPS data at once.
+
+        All coordinates are loaded with one query and clustered by `radius_components`,
+        which links images within `max_distance_m` of each other through a grid index over
+        unit-sphere coordinates and vectorized haversine distances. The connected components
+        replace the project's 'gps' groups in a single transaction. Unlike running the
+        per-image task over the project, the result does not depend on processing order.
+
+        Args:
+            project_id (str): The ID of the project.
+
+        Returns:
+            dict: Always empty; there are no per-image failures in project mode.
+        """
+        conn = None
+        cur = None
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor()
+
+            cur.execute(
+                """
+                SELECT i.id, g.latitude, g.longitude, COALESCE(i.capture_datetime, i.upload_datetime)
+                FROM image i
+                JOIN image_gps g ON i.id = g.image_id
+                WHERE i.project_id = %s
+                ORDER BY 4, 1
+                """,
+                (project_id,)
+            )
+            rows = cur.fetchall()
+
+            labels = radius_components(
+                np.array([float(row[1]) for row in rows], dtype=np.float64),
+                np.array([float(row[2]) for row in rows], dtype=np.float64),
+                self.max_distance_m,
+            )
+            components = {}
+            for (image_id, _, _, reference_time), label in zip(rows, labels.tolist()):
+                components.setdefault(label, []).append((image_id, reference_time))
+            groups = [members for members in components.values() if len(members) > 1]
+
+            replace_project_groups(cur, project_id, 'gps', groups)
+            conn.commit()
+            print(f"Grouped {len(rows)} images of project {project_id} into {len(groups)} GPS groups")
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                release_db_connection(conn)
+        return {}
+
     def run(self, image_id: str):
         """The main execution method for the task.
 
@@ -122,7 +188,7 @@ class GpsGroupingTask(ImageProcessingTask):
             candidates = cur.fetchall()
 
             matching_image_ids = []
-            max_distance = 100.0  # meters
+            max_distance = self.max_distance_m
 
             for cand_id, lat2, lon2 in candidates:
                 dist = self._haversine_distance(lat1, lon1, float(lat2), float(lon2))
@@ -154,8 +220,6 @@ class GpsGroupingTask(ImageProcessingTask):
             existing_group_rows = cur.fetchall()
             existing_group_ids = [row[0] for row in existing_group_rows]
 
-            target_group_id = None
-
             if not existing_group_ids:
                 # Create a completely new group
                 target_group_id = str(uuid.uuid4())
@@ -167,51 +231,12 @@ class GpsGroupingTask(ImageProcessingTask):
                     (target_group_id, project_id)
                 )
             else:
-                # Use the first group as the "survivor"
+                # Use the first group as the "survivor" and merge any others into it
                 target_group_id = existing_group_ids[0]
+                merge_groups(cur, target_group_id, existing_group_ids[1:])
 
-                # If there are multiple groups, merge them
-                if len(existing_group_ids) > 1:
-                    victim_group_ids = existing_group_ids[1:]
-                    victim_placeholders = ','.join(['%s'] * len(victim_group_ids))
-
-                    # 1. Get all images from victim groups
-                    cur.execute(f"""
-                        SELECT image_id FROM image_group_membership WHERE group_id IN ({victim_placeholders})
-                    """, tuple(victim_group_ids))
-                    victim_members = [r[0] for r in cur.fetchall()]
-
-                    # 2. Delete memberships of victim groups
-                    cur.execute(f"""
-                        DELETE FROM image_group_membership WHERE group_id IN ({victim_placeholders})
-                    """, tuple(victim_group_ids))
-
-                    # 3. Delete victim groups
-                    cur.execute(f"""
-                        DELETE FROM image_group WHERE id IN ({victim_placeholders})
-                    """, tuple(victim_group_ids))
-
-                    # 4. Add victim members to the list of IDs to be inserted/verified in target
-                    all_involved_ids.extend(victim_members)
-
-            # Insert/Ensure membership for all involved images
-            # Use set to remove duplicates
-            final_members = set(all_involved_ids)
-
-            for member_id in final_members:
-                # Check if membership already exists
-                cur.execute(
-                    "SELECT 1 FROM image_group_membership WHERE group_id = %s AND image_id = %s",
-                    (target_group_id, member_id)
-                )
-                if not cur.fetchone():
-                    cur.execute(
-                        """
-                        INSERT INTO image_group_membership (id, group_id, image_id, added_at)
-                        VALUES (%s, %s, %s, NOW())
-                        """,
-                        (str(uuid.uuid4()), target_group_id, member_id)
-                    )
+            # Ensure membership for all involved images
+            add_group_members(cur, target_group_id, all_involved_ids)
 
             conn.commit()
 
@@ -1,23 +1,208 @@
 """This module defines the Celery task for generating image captions."""
-from transformers import AutoProcessor, AutoModelForCausalLM
 from PIL import Image
+import logging
 import os
+import time
 import uuid
+from typing import NamedTuple
+import numpy as np
 from ..db import get_db_connection, release_db_connection
-from . import register_task, unload_other_models
+from ..imaging import resolve_storage_path
+from ..inference import GENERATION_STATS, InferenceBackend, OnnxBackend, get_backend, model_version, register_backend
+from ..lazy import lazy_import
+from ..residency import MODEL_RESIDENCY
+from . import register_task
 from .base import ImageProcessingTask
-import torch
+
+logger = logging.getLogger(__name__)
+
+# Imported on first use, so importing the task to look up processed images stays cheap.
+torch = lazy_import("torch")
+transformers = lazy_import("transformers")
+
+class CaptionProfile(NamedTuple):
+    """How captions are generated: the Florence-2 prompts to run and how to decode them."""
+    prompts: tuple
+    max_new_tokens: int
+    num_beams: int
+
+CAPTION_PROFILES = {
+    # A paragraph per image, with beam search. The default, and what captions were before profiles.
+    "detailed": CaptionProfile(("<MORE_DETAILED_CAPTION>",), max_new_tokens=1024, num_beams=3),
+    # One sentence per image, decoded greedily.
+    "fast": CaptionProfile(("<CAPTION>",), max_new_tokens=40, num_beams=1),
+    # One sentence and the labels of the detected objects, for tag-level search. Both prompts
+    # reuse the same encoded image.
+    "tags": CaptionProfile(("<CAPTION>", "<OD>"), max_new_tokens=128, num_beams=1),
+}
+CAPTION_PROFILE = os.getenv("CAPTION_PROFILE") or "detailed"
+
+def caption_profile() -> str:
+    """Returns the name of the configured caption profile.
+
+    Raises:
+        ValueError: If the profile is unknown.
+    """
+    if CAPTION_PROFILE not in CAPTION_PROFILES:
+        raise ValueError(f"Unknown caption profile '{CAPTION_PROFILE}'. Available: {', '.join(CAPTION_PROFILES)}")
+    return CAPTION_PROFILE
+
+@register_backend("image_captioning", "torch")
+class TorchFlorence(InferenceBackend):
+    """Florence-2 through transformers, in PyTorch."""
+
+    def load(self):
+        # Force CPU for now due to potential issues with Florence on some GPU setups or fallbacks
+        # Or stick to dynamic device but be careful with inputs.
+        # The error '_supports_sdpa' often relates to transformer version or model config mismatch.
+        # Disabling sdpa via loading option if possible or just catch.
+        # For Florence-2-base-ft, trust_remote_code=True is needed.
+
+        # Attempt to fix AttributeError: 'Florence2ForConditionalGeneration' object has no attribute '_supports_sdpa'
+        # This is often an issue with transformers version > 4.36 interacting with this model code.
+        # We are using transformers>=4.43.3.
+        # Explicitly setting it to False on the class or instance can help.
+
+        # Load on the CPU; the residency manager moves it once there is room on the device.
+        self.model = transformers.AutoModelForCausalLM.from_pretrained(
+            "microsoft/Florence-2-base-ft",
+            trust_remote_code=True
+        )
+
+        # Monkey patch on the instance
+        if not hasattr(self.model, '_supports_sdpa'):
+             object.__setattr__(self.model, '_supports_sdpa', False)
+
+        self.processor = transformers.AutoProcessor.from_pretrained("microsoft/Florence-2-base-ft", trust_remote_code=True)
+
+    def acquire(self):
+        use_gpu = os.getenv("USE_GPU", "true").lower() == "true"
+        device = "cuda" if use_gpu and torch.cuda.is_available() else "cpu"
+        MODEL_RESIDENCY.acquire("image_captioning", self.model, device)
+
+    def encode_images(self, images: list):
+        """Runs the vision encoder on a batch of images.
+
+        Args:
+            images (list[PIL.Image.Image]): The images to encode.
+
+        Returns:
+            torch.Tensor: The image features the language model reads, one row per image.
+        """
+        parameter = next(self.model.parameters())
+        pixel_values = self.processor.image_processor(images, return_tensors="pt")["pixel_values"]
+        with torch.no_grad():
+            return self.model._encode_image(pixel_values.to(device=parameter.device, dtype=parameter.dtype))
+
+    def generate(self, images: list, prompts: tuple, max_new_tokens: int, num_beams: int) -> tuple[dict, int]:
+        """Runs the captioning model on a batch of images, for one or more prompts.
+
+        The images are encoded once, and every prompt reuses their features. The processor
+        resizes every image to the same resolution and all images of a call share each
+        prompt, so a batch needs no padding on its input side.
+
+        Args:
+            images (list[PIL.Image.Image]): The images to caption.
+            prompts (tuple[str]): The Florence-2 task prompts.
+            max_new_tokens (int): The most tokens to generate per image and prompt.
+            num_beams (int): The beam width; 1 decodes greedily.
+
+        Returns:
+            tuple[dict, int]: The decoded model output of each image per prompt, special
+                              tokens included, and the number of tokens generated.
+        """
+        image_features = self.encode_images(images)
+        device = next(self.model.parameters()).device
+        image_features = image_features.to(device)
+
+        generated_texts = {}
+        generated_tokens = 0
+        for prompt in prompts:
+            input_ids = self.processor.tokenizer(self.processor._construct_prompts([prompt]), return_tensors="pt")["input_ids"]
+            with torch.no_grad():
+                prompt_embeds = self.model.get_input_embeddings()(input_ids.to(device)).expand(len(images), -1, -1)
+                inputs_embeds, _ = self.model._merge_input_ids_with_image_features(
+                    image_features.to(prompt_embeds.dtype), prompt_embeds
+                )
+
+            generated_ids = self.model.generate(
+                input_ids=None,
+                inputs_embeds=inputs_embeds,
+                max_new_tokens=max_new_tokens,
+                num_beams=num_beams,
+                do_sample=False,
+                # Each step attends to the cached keys and values of the tokens before it.
+                use_cache=True
+            )
+
+            generated_texts[prompt] = self.processor.batch_decode(generated_ids, skip_special_tokens=False)
+            generated_tokens += int((generated_ids != self.processor.tokenizer.pad_token_id).sum())
+        return generated_texts, generated_tokens
+
+@register_backend("image_captioning", "onnx")
+class OnnxFlorence(OnnxBackend, TorchFlorence):
+    """Florence-2 with its vision encoder exported to ONNX, on ONNX Runtime.
+
+    The vision encoder (DaViT and the projection into the language model's embedding
+    space) runs on ONNX Runtime. The text encoder-decoder and its beam search stay in
+    transformers, which decodes from the ONNX image features (see `TorchFlorence.generate`).
+
+    For the INT8 variants, the vision encoder runs the quantized export, and the linear
+    layers of the text encoder-decoder are quantized dynamically by PyTorch. The decoder
+    runs once per generated token, so static calibration does not fit it. Quantized
+    PyTorch layers only run on the CPU.
+
+    The checkpoint is loaded whole, as for PyTorch, since transformers has no way to load
+    the text encoder-decoder alone. The DaViT vision tower, a large share of the weights,
+    is dropped right after loading, so only its ONNX copy stays in memory.
+    """
+
+    def load(self):
+        super().load()
+        # The ONNX session replaces `_encode_image`, the only user of the vision tower.
+        self.model.vision_tower = None
+        self.vision_session = self.create_session("florence2_vision_encoder")
+        if self.precision != "fp32":
+            self.model.language_model = torch.ao.quantization.quantize_dynamic(
+                self.model.language_model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+
+    def acquire(self):
+        if self.precision == "fp32":
+            super().acquire()
+        else:
+            MODEL_RESIDENCY.acquire("image_captioning", self.model, "cpu")
+
+    def encode_images(self, images: list):
+        """Runs the exported vision encoder on a batch of images.
+
+        Args:
+            images (list[PIL.Image.Image]): The images to encode.
+
+        Returns:
+            torch.Tensor: The image features the language model reads, one row per image.
+        """
+        pixel_values = self.processor.image_processor(images, return_tensors="np")["pixel_values"]
+        image_features = self.vision_session.run(None, {"pixel_values": pixel_values.astype(np.float32)})[0]
+        return torch.from_numpy(image_features)
 
 @register_task("image_captioning")
 class ImageCaptioningTask(ImageProcessingTask):
-    """A Celery task to generate a detailed caption for an image using a pre-trained model.
+    """A Celery task to generate a caption for an image using a pre-trained model.
+
+    The model runs on the inference backend configured for the task (see `src.inference`),
+    and captions are generated with the configured `CAPTION_PROFILE`.
     """
-    model = None
-    processor = None
+    backend = None
+
+    processed_query = "SELECT image_id FROM image_caption WHERE image_id = ANY(%(image_ids)s) AND model_version = %(version)s"
 
     @property
     def version(self):
-        return "Florence-2-base-ft-02"
+        version = model_version("image_captioning", "Florence-2-base-ft-02")
+        # Other profiles produce other captions, so they are recorded and skipped separately.
+        profile = caption_profile()
+        return version if profile == "detailed" else f"{version}-{profile}"
 
     def check_already_processed(self, cur, image_id: str) -> bool:
         cur.execute(
@@ -26,35 +211,76 @@ class ImageCaptioningTask(ImageProcessingTask):
         )
         return cur.fetchone() is not None
 
-    def _load_model(self):
+    def load_model(self):
         """Lazily loads the pre-trained image captioning model and processor."""
-        unload_other_models(ImageCaptioningTask)
-        use_gpu = os.getenv("USE_GPU", "true").lower() == "true"
-        device = "cuda" if use_gpu and torch.cuda.is_available() else "cpu"
-        if ImageCaptioningTask.model is None:
-            # Force CPU for now due to potential issues with Florence on some GPU setups or fallbacks
-            # Or stick to dynamic device but be careful with inputs.
-            # The error '_supports_sdpa' often relates to transformer version or model config mismatch.
-            # Disabling sdpa via loading option if possible or just catch.
-            # For Florence-2-base-ft, trust_remote_code=True is needed.
-            
-            # Attempt to fix AttributeError: 'Florence2ForConditionalGeneration' object has no attribute '_supports_sdpa'
-            # This is often an issue with transformers version > 4.36 interacting with this model code.
-            # We are using transformers>=4.43.3.
-            # Explicitly setting it to False on the class or instance can help.
-            
-            ImageCaptioningTask.model = AutoModelForCausalLM.from_pretrained(
-                "microsoft/Florence-2-base-ft", 
-                trust_remote_code=True
-            ).to(device)
-            
-            # Monkey patch on the instance
-            if not hasattr(ImageCaptioningTask.model, '_supports_sdpa'):
-                 object.__setattr__(ImageCaptioningTask.model, '_supports_sdpa', False) 
-
-            ImageCaptioningTask.processor = AutoProcessor.from_pretrained("microsoft/Florence-2-base-ft", trust_remote_code=True)
-        else:
-            ImageCaptioningTask.model.to(device)
+        self.backend = get_backend("image_captioning")
+        self.backend.acquire()
+
+    def warm_up(self, batch_size: int, side: int):
+        """Runs Florence-2 once on a batch of blank images, with the configured profile."""
+        self.load_model()
+        profile = CAPTION_PROFILES[caption_profile()]
+        self.backend.generate([Image.new("RGB", (side, side)) for _ in range(batch_size)], *profile)
+
+    def _parse_caption(self, image, prompt: str, generated_text: str) -> str:
+        """Parses the generated text of one image and prompt into caption text.
+
+        Args:
+            image (PIL.Image): The captioned image.
+            prompt (str): The task prompt the text was generated with.
+            generated_text (str): The decoded output of the model.
+
+        Returns:
+            str: The caption, or the distinct labels of the detected objects for `<OD>`.
+        """
+        # Use post_process_generation for robust parsing
+        try:
+            parsed_result = self.backend.processor.post_process_generation(
+                generated_text, 
+                task=prompt, 
+                image_size=(image.width, image.height)
+            )
+            # parsed_result is a dictionary like {'<MORE_DETAILED_CAPTION>': 'caption text'},
+            # or {'<OD>': {'bboxes': [...], 'labels': [...]}} for object detection.
+            caption = parsed_result.get(prompt, "")
+            if isinstance(caption, dict):
+                caption = ", ".join(dict.fromkeys(caption.get("labels", [])))
+        except Exception:
+            # Fallback to manual parsing if post_process_generation is not available or fails
+            caption = generated_text.split("</s>")[0].split(prompt)[-1]
+        return caption.strip()
+
+    def _caption_batch(self, cur, items: list) -> list[str]:
+        """Captions a batch of images with the configured profile and stores the captions.
+
+        Args:
+            cur (psycopg2.extensions.cursor): The database cursor.
+            items (list): (image_id, image) pairs.
+
+        Returns:
+            list[str]: The stored caption of each image.
+        """
+        profile_name = caption_profile()
+        profile = CAPTION_PROFILES[profile_name]
+        started = time.perf_counter()
+        generated_texts, generated_tokens = self.backend.generate([image for _, image in items], *profile)
+        seconds = time.perf_counter() - started
+
+        captions = []
+        for index, (image_id, image) in enumerate(items):
+            parts = [self._parse_caption(image, prompt, generated_texts[prompt][index]) for prompt in profile.prompts]
+            caption = " ".join(part for part in parts if part)
+            logger.debug("Caption of %s: %s", image_id, caption)
+            cur.execute(
+                """
+                INSERT INTO image_caption (id, image_id, caption, model_version, created_at, updated_at)
+                VALUES (%s, %s, %s, %s, NOW(), NOW())
+                """,
+                (str(uuid.uuid4()), image_id, caption, self.version)
+            )
+            captions.append(caption)
+        GENERATION_STATS.record("image_captioning", profile_name, seconds, generated_tokens, captions)
+        return captions
 
     def run(self, image_id: str):
         """The main execution method for the task.
@@ -65,7 +291,7 @@ class ImageCaptioningTask(ImageProcessingTask):
         Args:
             image_id (str): The ID of the image to be processed.
         """
-        self._load_model()
+        self.load_model()
 
         conn = None
         cur = None
@@ -80,56 +306,115 @@ class ImageCaptioningTask(ImageProcessingTask):
 
             image_path = image_path_tuple[0]
 
-            storage_base_path = os.getenv("STORAGE_BASE_PATH", "/storage")
-            full_image_path = os.path.join(storage_base_path, image_path)
+            full_image_path = resolve_storage_path(image_path)
 
-            image = Image.open(full_image_path)
-            
-            use_gpu = os.getenv("USE_GPU", "true").lower() == "true"
-            device = "cuda" if use_gpu and torch.cuda.is_available() else "cpu"
-            prompt = "<MORE_DETAILED_CAPTION>"
-            inputs = self.processor(text=prompt, images=image, return_tensors="pt").to(device)
+            with Image.open(full_image_path) as img:
+                image = img.convert("RGB")
 
-            generated_ids = self.model.generate(
-                input_ids=inputs["input_ids"],
-                pixel_values=inputs["pixel_values"],
-                max_new_tokens=1024,
-                num_beams=3
-            )
+            self._caption_batch(cur, [(image_id, image)])
 
-            generated_text = self.processor.batch_decode(generated_ids, skip_special_tokens=False)[0]
+            conn.commit()
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                release_db_connection(conn)
 
-            # Use post_process_generation for robust parsing
-            try:
-                parsed_result = self.processor.post_process_generation(
-                    generated_text, 
-                    task=prompt, 
-                    image_size=(image.width, image.height)
-                )
-                # parsed_result is a dictionary like {'<MORE_DETAILED_CAPTION>': 'caption text'}
-                caption = parsed_result.get(prompt, "")
-            except Exception:
-                # Fallback to manual parsing if post_process_generation is not available or fails
-                caption = generated_text.split("</s>")[0].split(prompt)[-1]
+    def run_decoded(self, image_id: str, decoded):
+        """Generates a caption for an image already decoded by the analyze pipeline.
 
-            print(f"Caption: {caption.strip()}")
-            cur.execute(
-                """
-                INSERT INTO image_caption (id, image_id, caption, model_version, created_at, updated_at)
-                VALUES (%s, %s, %s, %s, NOW(), NOW())
-                """,
-                (str(uuid.uuid4()), image_id, caption.strip(), self.version)
-            )
+        Args:
+            image_id (str): The ID of the image to be processed.
+            decoded (src.imaging.DecodedImage): The shared, decoded original image.
+        """
+        self.load_model()
+
+        conn = None
+        cur = None
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor()
+
+            self._caption_batch(cur, [(image_id, decoded.image)])
+
+            conn.commit()
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                release_db_connection(conn)
+
+    def run_batch(self, image_ids: list[str]) -> dict:
+        """Generates captions for several images with a single batched `generate` call per prompt.
+
+        The processor resizes every image to the same input resolution, so images of any
+        size can share one batch.
+
+        Args:
+            image_ids (list[str]): The IDs of the images to be processed.
+
+        Returns:
+            dict: A mapping of image ID to the exception raised while loading that image.
+        """
+        self.load_model()
+
+        errors = {}
+        conn = None
+        cur = None
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor()
+
+            cur.execute("SELECT id, storage_path FROM image WHERE id = ANY(%s)", (list(image_ids),))
+            image_paths = dict(cur.fetchall())
+
+            batch = []
+            for image_id in image_ids:
+                if image_id not in image_paths:
+                    continue
+                try:
+                    with Image.open(resolve_storage_path(image_paths[image_id])) as img:
+                        batch.append((image_id, img.convert("RGB")))
+                except Exception as e:
+                    errors[image_id] = e
+
+            if batch:
+                self._caption_batch(cur, batch)
+
+            conn.commit()
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                release_db_connection(conn)
+        return errors
+
+    def run_prepared_batch(self, items: list) -> dict:
+        """Generates captions for prepared images with a single batched `generate` call per prompt.
+
+        Args:
+            items (list): (image_id, image) pairs, see `prepare`.
+
+        Returns:
+            dict: Always empty; an error fails the whole batch.
+        """
+        self.load_model()
+
+        conn = None
+        cur = None
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor()
+
+            self._caption_batch(cur, items)
 
             conn.commit()
-        except Exception as e:
-            print(f"Error generating caption for {image_id}: {e}")
-            return
         finally:
             if cur:
                 cur.close()
             if conn:
                 release_db_connection(conn)
+        return {}
 
 if __name__ == "__main__":
     import sys
@@ -1,22 +1,142 @@
 """This module defines the Celery task for detecting objects in images."""
-import torch
-from ultralytics import YOLO
-from PIL import Image
+from PIL import Image, ImageOps
+import ast
 import os
+import numpy as np
 from ..db import get_db_connection, release_db_connection
-from . import register_task, unload_other_models
+from ..imaging import resolve_storage_path
+from ..inference import InferenceBackend, OnnxBackend, get_backend, model_version, register_backend
+from ..lazy import lazy_import
+from ..residency import MODEL_RESIDENCY
+from . import register_task
 from .base import ImageProcessingTask
 import uuid
 
+# Imported on first use, so importing the task to look up processed images stays cheap.
+cv2 = lazy_import("cv2")
+torch = lazy_import("torch")
+ultralytics = lazy_import("ultralytics")
+
+@register_backend("object_detection", "torch")
+class TorchYolo(InferenceBackend):
+    """YOLOv10 through ultralytics, in PyTorch."""
+
+    def load(self):
+        # Using yolov10x as yolov12x is not a recognized model.
+        self.model = ultralytics.YOLO("yolov10x.pt")
+
+    def acquire(self):
+        use_gpu = os.getenv("USE_GPU", "true").lower() == "true"
+        device = "cuda" if use_gpu and torch.cuda.is_available() else "cpu"
+        MODEL_RESIDENCY.acquire("object_detection", self.model, device)
+
+    def detect(self, images: list) -> list[list[tuple]]:
+        """Detects objects in a batch of images.
+
+        Args:
+            images (list): Image paths or RGB `PIL.Image`s.
+
+        Returns:
+            list[list[tuple]]: For each image, (tag_name, confidence, x1, y1, x2, y2) tuples
+                               in the pixel coordinates of the image.
+        """
+        use_gpu = os.getenv("USE_GPU", "true").lower() == "true"
+        device = 0 if use_gpu and torch.cuda.is_available() else 'cpu'
+        results = self.model(list(images), device=device, batch=len(images))
+        return [
+            [
+                (self.model.names[int(box.cls)], float(box.conf), *(float(value) for value in box.xyxy[0]))
+                for box in result.boxes
+            ]
+            for result in results
+        ]
+
+@register_backend("object_detection", "onnx")
+class OnnxYolo(OnnxBackend):
+    """YOLOv10 exported to ONNX by ultralytics, on ONNX Runtime.
+
+    YOLOv10 is NMS-free: the graph outputs its final detections, so only the letterbox
+    preprocessing and the mapping of the boxes back to the image are done here, the same
+    way ultralytics does them.
+    """
+
+    # Detections below ultralytics' default confidence threshold are dropped, as in PyTorch.
+    confidence_threshold = 0.25
+
+    def load(self):
+        self.session = self.create_session("yolov10x")
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata["names"])
+        self.input_height, self.input_width = ast.literal_eval(metadata["imgsz"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def _letterbox(self, image) -> tuple:
+        """Resizes an image to fit the model input, keeping its aspect ratio, and pads the rest.
+
+        Returns:
+            tuple: The CHW float32 input and the (scale, left, top) to map boxes back.
+        """
+        pixels = np.asarray(image)
+        height, width = pixels.shape[:2]
+        scale = min(self.input_height / height, self.input_width / width)
+        resized_width, resized_height = round(width * scale), round(height * scale)
+        if (resized_width, resized_height) != (width, height):
+            pixels = cv2.resize(pixels, (resized_width, resized_height), interpolation=cv2.INTER_LINEAR)
+        pad_x = (self.input_width - resized_width) / 2
+        pad_y = (self.input_height - resized_height) / 2
+        top, bottom = round(pad_y - 0.1), round(pad_y + 0.1)
+        left, right = round(pad_x - 0.1), round(pad_x + 0.1)
+        pixels = cv2.copyMakeBorder(pixels, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+        return pixels.transpose(2, 0, 1).astype(np.float32) / 255.0, (scale, left, top)
+
+    def detect(self, images: list) -> list[list[tuple]]:
+        """Detects objects in a batch of images.
+
+        Args:
+            images (list): Image paths or RGB `PIL.Image`s.
+
+        Returns:
+            list[list[tuple]]: For each image, (tag_name, confidence, x1, y1, x2, y2) tuples
+                               in the pixel coordinates of the image.
+        """
+        sizes, inputs, transforms = [], [], []
+        for image in images:
+            if isinstance(image, str):
+                # Like OpenCV's imread in ultralytics, apply the EXIF orientation.
+                with Image.open(image) as img:
+                    image = ImageOps.exif_transpose(img).convert("RGB")
+            sizes.append(image.size)
+            pixels, transform = self._letterbox(image)
+            inputs.append(pixels)
+            transforms.append(transform)
+
+        # (batch, max detections, [x1, y1, x2, y2, confidence, class])
+        outputs = self.session.run(None, {self.input_name: np.stack(inputs)})[0]
+        detections = []
+        for output, (width, height), (scale, left, top) in zip(outputs, sizes, transforms):
+            output = output[output[:, 4] > self.confidence_threshold]
+            boxes = (output[:, :4] - [left, top, left, top]) / scale
+            boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, width)
+            boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, height)
+            detections.append([
+                (self.names[int(row[5])], float(row[4]), *(float(value) for value in box))
+                for row, box in zip(output, boxes)
+            ])
+        return detections
+
 @register_task("object_detection")
 class ObjectDetectionTask(ImageProcessingTask):
     """A Celery task to detect objects in an image using a YOLO model.
+
+    The model runs on the inference backend configured for the task (see `src.inference`).
     """
-    model = None
+    backend = None
+
+    processed_query = "SELECT DISTINCT image_id FROM object_tag WHERE image_id = ANY(%(image_ids)s) AND model_version = %(version)s"
 
     @property
     def version(self):
-        return "yolov10x"
+        return model_version("object_detection", "yolov10x")
 
     def check_already_processed(self, cur, image_id: str) -> bool:
         cur.execute(
@@ -25,12 +145,64 @@ class ObjectDetectionTask(ImageProcessingTask):
         )
         return cur.fetchone() is not None
 
-    def _load_model(self):
+    def load_model(self):
         """Lazily loads the YOLO object detection model."""
-        unload_other_models(ObjectDetectionTask)
-        if ObjectDetectionTask.model is None:
-            # Using yolov10x as yolov12x is not a recognized model.
-            ObjectDetectionTask.model = YOLO("yolov10x.pt")
+        self.backend = get_backend("object_detection")
+        self.backend.acquire()
+
+    def warm_up(self, batch_size: int, side: int):
+        """Runs YOLO once on a batch of blank images."""
+        self.load_model()
+        self.backend.detect([Image.new("RGB", (side, side)) for _ in range(batch_size)])
+
+    @staticmethod
+    def _scale_detections(detections: list, image_size: tuple, original_size: tuple) -> list:
+        """Maps detections on an image decoded at reduced resolution to the original's pixel coordinates.
+
+        Args:
+            detections (list): (tag_name, confidence, x1, y1, x2, y2) tuples on the decoded image.
+            image_size (tuple): The (width, height) of the decoded image.
+            original_size (tuple): The (width, height) of the original image.
+
+        Returns:
+            list: The detections with their boxes in the coordinates of the original.
+        """
+        if image_size == original_size:
+            return detections
+        scale_x = original_size[0] / image_size[0]
+        scale_y = original_size[1] / image_size[1]
+        return [
+            (tag_name, confidence, x1 * scale_x, y1 * scale_y, x2 * scale_x, y2 * scale_y)
+            for tag_name, confidence, x1, y1, x2, y2 in detections
+        ]
+
+    def _store_detections(self, cur, image_id: str, detections: list):
+        """Stores the detected object tags of one image.
+
+        Args:
+            cur (psycopg2.extensions.cursor): The database cursor.
+            image_id (str): The ID of the image the detections belong to.
+            detections (list): (tag_name, confidence, x1, y1, x2, y2) tuples, see `TorchYolo.detect`.
+        """
+        for tag_name, confidence, x1, y1, x2, y2 in detections:
+            bounding_box_x = int(x1)
+            bounding_box_y = int(y1)
+            bounding_box_width = int(x2 - x1)
+            bounding_box_height = int(y2 - y1)
+
+            cur.execute(
+                """
+                INSERT INTO object_tag (id, image_id, tag_name, confidence,
+                                        bounding_box_x, bounding_box_y,
+                                        bounding_box_width, bounding_box_height,
+                                        model_version, created_at, updated_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+                """,
+                (str(uuid.uuid4()), image_id, tag_name, confidence,
+                 bounding_box_x, bounding_box_y,
+                 bounding_box_width, bounding_box_height,
+                 self.version)
+            )
 
     def run(self, image_id: str):
         """The main execution method for the task.
@@ -41,7 +213,7 @@ class ObjectDetectionTask(ImageProcessingTask):
         Args:
             image_id (str): The ID of the image to be processed.
         """
-        self._load_model()
+        self.load_model()
 
         conn = None
         cur = None
@@ -57,36 +229,111 @@ class ObjectDetectionTask(ImageProcessingTask):
 
             image_path = image_path_tuple[0]
 
-            storage_base_path = os.getenv("STORAGE_BASE_PATH", "/storage")
-            full_image_path = os.path.join(storage_base_path, image_path)
-            
-            use_gpu = os.getenv("USE_GPU", "true").lower() == "true"
-            device = 0 if use_gpu and torch.cuda.is_available() else 'cpu'
-            results = self.model(full_image_path, device=device)
-
-            for result in results:
-                for box in result.boxes:
-                    tag_name = self.model.names[int(box.cls)]
-                    confidence = float(box.conf)
-                    x1, y1, x2, y2 = box.xyxy[0]
-                    bounding_box_x = int(x1)
-                    bounding_box_y = int(y1)
-                    bounding_box_width = int(x2 - x1)
-                    bounding_box_height = int(y2 - y1)
-
-                    cur.execute(
-                        """
-                        INSERT INTO object_tag (id, image_id, tag_name, confidence,
-                                                bounding_box_x, bounding_box_y,
-                                                bounding_box_width, bounding_box_height,
-                                                model_version, created_at, updated_at)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
-                        """,
-                        (str(uuid.uuid4()), image_id, tag_name, confidence,
-                         bounding_box_x, bounding_box_y,
-                         bounding_box_width, bounding_box_height,
-                         "yolov10x")
-                    )
+            full_image_path = resolve_storage_path(image_path)
+
+            self._store_detections(cur, image_id, self.backend.detect([full_image_path])[0])
+
+            conn.commit()
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                release_db_connection(conn)
+
+    def run_decoded(self, image_id: str, decoded):
+        """Detects objects in an image already decoded by the analyze pipeline.
+
+        Args:
+            image_id (str): The ID of the image to be processed.
+            decoded (src.imaging.DecodedImage): The shared, decoded original image.
+        """
+        self.load_model()
+
+        conn = None
+        cur = None
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor()
+
+            image = decoded.image
+            detections = self.backend.detect([image])[0]
+            self._store_detections(cur, image_id, self._scale_detections(detections, image.size, decoded.original_size))
+
+            conn.commit()
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                release_db_connection(conn)
+
+    def run_batch(self, image_ids: list[str]) -> dict:
+        """Detects objects in several images with a single batched YOLO call.
+
+        Args:
+            image_ids (list[str]): The IDs of the images to be processed.
+
+        Returns:
+            dict: A mapping of image ID to the exception raised while processing that image.
+        """
+        self.load_model()
+
+        errors = {}
+        conn = None
+        cur = None
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor()
+
+            cur.execute("SELECT id, storage_path FROM image WHERE id = ANY(%s)", (list(image_ids),))
+            image_paths = dict(cur.fetchall())
+
+            batch = []
+            for image_id in image_ids:
+                if image_id not in image_paths:
+                    continue
+                full_image_path = resolve_storage_path(image_paths[image_id])
+                if not os.path.exists(full_image_path):
+                    errors[image_id] = FileNotFoundError(full_image_path)
+                    continue
+                batch.append((image_id, full_image_path))
+
+            if batch:
+                detections = self.backend.detect([path for _, path in batch])
+                for (image_id, _), image_detections in zip(batch, detections):
+                    self._store_detections(cur, image_id, image_detections)
+
+            conn.commit()
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                release_db_connection(conn)
+        return errors
+
+    def prepare(self, decoded):
+        """Returns the decoded image along with the size of the original, to map boxes back to."""
+        return decoded.image, decoded.original_size
+
+    def run_prepared_batch(self, items: list) -> dict:
+        """Detects objects in prepared images with a single batched YOLO call.
+
+        Args:
+            items (list): (image_id, (image, original_size)) pairs, see `prepare`.
+
+        Returns:
+            dict: Always empty; an error fails the whole batch.
+        """
+        self.load_model()
+
+        conn = None
+        cur = None
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor()
+
+            detections = self.backend.detect([image for _, (image, _) in items])
+            for (image_id, (image, original_size)), image_detections in zip(items, detections):
+                self._store_detections(cur, image_id, self._scale_detections(image_detections, image.size, original_size))
 
             conn.commit()
         finally:
@@ -94,3 +341,4 @@ class ObjectDetectionTask(ImageProcessingTask):
                 cur.close()
             if conn:
                 release_db_connection(conn)
+        return {}
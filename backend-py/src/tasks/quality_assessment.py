@@ -1,22 +1,105 @@
 """This module defines the Celery task for assessing image quality."""
-import pyiqa
-import torch
 from PIL import Image
 import os
 import uuid
+import numpy as np
 from ..db import get_db_connection, release_db_connection
-from . import register_task, unload_other_models
+from ..events import publish_for_image
+from ..imaging import resolve_storage_path
+from ..inference import InferenceBackend, OnnxBackend, get_backend, model_version, register_backend
+from ..lazy import lazy_import
+from ..residency import MODEL_RESIDENCY
+from . import register_task
 from .base import ImageProcessingTask
 
+# Imported on first use, so importing the task to look up processed images stays cheap.
+pyiqa = lazy_import("pyiqa")
+torch = lazy_import("torch")
+F = lazy_import("torchvision.transforms.functional")
+
+# The most pixels scored in one TOPIQ forward pass. TOPIQ runs at native resolution, so
+# activations grow with the pixel count: images of the same dimensions are only stacked
+# while they fit, and an image larger than this is scored on its own.
+QUALITY_BATCH_MAX_PIXELS = int(float(os.getenv("QUALITY_BATCH_MAX_PIXELS") or 24e6))
+
+def pixel_batches(items: list, width: int, height: int) -> list[list]:
+    """Splits images of the same dimensions into forward passes of at most `QUALITY_BATCH_MAX_PIXELS` pixels.
+
+    Args:
+        items (list): The images, or anything standing for them.
+        width (int): The width of every image.
+        height (int): The height of every image.
+
+    Returns:
+        list[list]: The items of each forward pass, at least one per pass.
+    """
+    size = max(1, QUALITY_BATCH_MAX_PIXELS // max(1, width * height))
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+@register_backend("quality_assessment", "torch")
+class TorchTopiq(InferenceBackend):
+    """TOPIQ through pyiqa, in PyTorch."""
+
+    def load(self):
+        # Load on the CPU; the residency manager moves it once there is room on the device.
+        self.model = pyiqa.create_metric('topiq_nr', device=torch.device('cpu'))
+
+    def acquire(self):
+        use_gpu = os.getenv("USE_GPU", "true").lower() == "true"
+        device = torch.device('cuda' if use_gpu and torch.cuda.is_available() else 'cpu')
+        MODEL_RESIDENCY.acquire("quality_assessment", self.model, device)
+
+    def to_input(self, image):
+        """Converts an RGB image to the CHW float tensor in [0, 1] TOPIQ takes."""
+        return F.to_tensor(image)
+
+    def score(self, inputs: list) -> list[float]:
+        """Scores images of the same dimensions in one forward pass.
+
+        Args:
+            inputs (list): Images converted by `to_input`.
+
+        Returns:
+            list[float]: The score of each image.
+        """
+        device = next(self.model.parameters()).device
+        return self.model(torch.stack(inputs).to(device)).flatten().tolist()
+
+@register_backend("quality_assessment", "onnx")
+class OnnxTopiq(OnnxBackend):
+    """TOPIQ exported to ONNX with dynamic batch and image dimensions, on ONNX Runtime."""
+
+    def load(self):
+        self.session = self.create_session("topiq_nr")
+
+    def to_input(self, image):
+        """Converts an RGB image to a CHW float32 array in [0, 1], like `torchvision`'s `to_tensor`."""
+        return np.asarray(image, dtype=np.float32).transpose(2, 0, 1) / 255.0
+
+    def score(self, inputs: list) -> list[float]:
+        """Scores images of the same dimensions in one run of the graph.
+
+        Args:
+            inputs (list): Images converted by `to_input`.
+
+        Returns:
+            list[float]: The score of each image.
+        """
+        return self.session.run(None, {"pixel_values": np.stack(inputs)})[0].reshape(-1).tolist()
+
 @register_task("quality_assessment")
 class QualityAssessmentTask(ImageProcessingTask):
     """A Celery task to assess the quality of an image using the TOPIQ model.
+
+    The model runs on the inference backend configured for the task (see `src.inference`).
     """
-    model = None
+    backend = None
+
+    processed_query = "SELECT image_id FROM quality_score WHERE image_id = ANY(%(image_ids)s) AND model_version = %(version)s"
 
     @property
     def version(self):
-        return "topiq_nr"
+        return model_version("quality_assessment", "topiq_nr")
 
     def check_already_processed(self, cur, image_id: str) -> bool:
         cur.execute(
@@ -25,15 +108,78 @@ class QualityAssessmentTask(ImageProcessingTask):
         )
         return cur.fetchone() is not None
 
-    def _load_model(self):
+    def load_model(self):
         """Lazily loads the TOPIQ image quality assessment model."""
-        unload_other_models(QualityAssessmentTask)
-        use_gpu = os.getenv("USE_GPU", "true").lower() == "true"
-        device = torch.device('cuda' if use_gpu and torch.cuda.is_available() else 'cpu')
-        if QualityAssessmentTask.model is None:
-            QualityAssessmentTask.model = pyiqa.create_metric('topiq_nr', device=device)
-        else:
-            QualityAssessmentTask.model.to(device)
+        self.backend = get_backend("quality_assessment")
+        self.backend.acquire()
+
+    def warm_up(self, batch_size: int, side: int):
+        """Runs TOPIQ once on a batch of blank images."""
+        self.load_model()
+        blank = self.backend.to_input(Image.new("RGB", (side, side), (128, 128, 128)))
+        self.backend.score([blank] * batch_size)
+
+    def _store_score(self, cur, image_id: str, score: float):
+        """Stores a quality score and promotes the image to project cover if it scores best.
+
+        The caller commits.
+
+        Args:
+            cur (psycopg2.extensions.cursor): The database cursor.
+            image_id (str): The ID of the scored image.
+            score (float): The TOPIQ score of the image.
+        """
+        # The 'quality_score' table has a 'musiq_score' column. Storing the 'topiq'
+        # score in this column as per the existing schema.
+        cur.execute(
+            """
+            INSERT INTO quality_score (id, image_id, musiq_score, model_version, created_at, updated_at)
+            VALUES (%s, %s, %s, %s, NOW(), NOW())
+            ON CONFLICT (image_id) DO UPDATE SET
+                musiq_score = EXCLUDED.musiq_score,
+                model_version = EXCLUDED.model_version,
+                updated_at = NOW();
+            """,
+            (str(uuid.uuid4()), image_id, score, self.version)
+        )
+        publish_for_image(cur, {"type": "quality_score", "score": float(score), "model_version": self.version}, image_id)
+
+        # Check if we need to update the project cover image
+        cur.execute("SELECT project_id FROM image WHERE id = %s", (image_id,))
+        project_id_tuple = cur.fetchone()
+        
+        if project_id_tuple:
+            project_id = project_id_tuple[0]
+            cur.execute("SELECT cover_image_id FROM project WHERE id = %s", (project_id,))
+            cover_image_tuple = cur.fetchone()
+            
+            should_update = False
+            if not cover_image_tuple or not cover_image_tuple[0]:
+                # No cover image set, so update it
+                should_update = True
+            else:
+                current_cover_id = cover_image_tuple[0]
+                if current_cover_id != image_id:
+                    # Check score of current cover image
+                    cur.execute("SELECT musiq_score FROM quality_score WHERE image_id = %s", (current_cover_id,))
+                    cover_score_tuple = cur.fetchone()
+                    
+                    if not cover_score_tuple or cover_score_tuple[0] is None:
+                         # Current cover has no score, so update
+                        should_update = True
+                    else:
+                        try:
+                            current_cover_score = float(cover_score_tuple[0])
+                            if score > current_cover_score:
+                                should_update = True
+                        except (ValueError, TypeError):
+                            should_update = True
+
+            if should_update:
+                cur.execute(
+                    "UPDATE project SET cover_image_id = %s, updated_at = NOW() WHERE id = %s",
+                    (image_id, project_id)
+                )
 
     def run(self, image_id: str):
         """The main execution method for the task.
@@ -44,7 +190,7 @@ class QualityAssessmentTask(ImageProcessingTask):
         Args:
             image_id (str): The ID of the image to be processed.
         """
-        self._load_model()
+        self.load_model()
 
         conn = None
         cur = None
@@ -59,69 +205,148 @@ class QualityAssessmentTask(ImageProcessingTask):
 
             image_path = image_path_tuple[0]
 
-            storage_base_path = os.getenv("STORAGE_BASE_PATH", "/home/p4b/Documents/photocurator/backend")
-            full_image_path = os.path.join(storage_base_path, image_path)
-
-            score = self.model(full_image_path).item()
-
-            # The 'quality_score' table has a 'musiq_score' column. Storing the 'topiq'
-            # score in this column as per the existing schema.
-            cur.execute(
-                """
-                INSERT INTO quality_score (id, image_id, musiq_score, model_version, created_at, updated_at)
-                VALUES (%s, %s, %s, %s, NOW(), NOW())
-                ON CONFLICT (image_id) DO UPDATE SET
-                    musiq_score = EXCLUDED.musiq_score,
-                    model_version = EXCLUDED.model_version,
-                    updated_at = NOW();
-                """,
-                (str(uuid.uuid4()), image_id, score, "topiq_nr")
-            )
-            
+            full_image_path = resolve_storage_path(image_path)
+
+            with Image.open(full_image_path) as img:
+                score = self.backend.score([self.backend.to_input(img.convert("RGB"))])[0]
+            self._store_score(cur, image_id, score)
             conn.commit()
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                release_db_connection(conn)
 
-            # Check if we need to update the project cover image
-            cur.execute("SELECT project_id FROM image WHERE id = %s", (image_id,))
-            project_id_tuple = cur.fetchone()
-            
-            if project_id_tuple:
-                project_id = project_id_tuple[0]
-                cur.execute("SELECT cover_image_id FROM project WHERE id = %s", (project_id,))
-                cover_image_tuple = cur.fetchone()
-                
-                should_update = False
-                if not cover_image_tuple or not cover_image_tuple[0]:
-                    # No cover image set, so update it
-                    should_update = True
-                else:
-                    current_cover_id = cover_image_tuple[0]
-                    if current_cover_id != image_id:
-                        # Check score of current cover image
-                        cur.execute("SELECT musiq_score FROM quality_score WHERE image_id = %s", (current_cover_id,))
-                        cover_score_tuple = cur.fetchone()
-                        
-                        if not cover_score_tuple or cover_score_tuple[0] is None:
-                             # Current cover has no score, so update
-                            should_update = True
-                        else:
-                            try:
-                                current_cover_score = float(cover_score_tuple[0])
-                                if score > current_cover_score:
-                                    should_update = True
-                            except (ValueError, TypeError):
-                                should_update = True
+    def run_decoded(self, image_id: str, decoded):
+        """Scores an image already decoded by the analyze pipeline.
+
+        Scores have always been computed on the image as stored, without its EXIF
+        orientation applied, so the pipeline's upright image is transposed back.
 
-                if should_update:
-                    cur.execute(
-                        "UPDATE project SET cover_image_id = %s, updated_at = NOW() WHERE id = %s",
-                        (image_id, project_id)
-                    )
-                    conn.commit()
+        Args:
+            image_id (str): The ID of the image to be processed.
+            decoded (src.imaging.DecodedImage): The shared, decoded original image.
+        """
+        self.load_model()
+
+        conn = None
+        cur = None
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor()
 
-            # conn.commit() is already called above for score insertion and potentially cover update
+            score = self.backend.score([self.backend.to_input(decoded.stored_image)])[0]
+            self._store_score(cur, image_id, score)
+            conn.commit()
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                release_db_connection(conn)
+
+    def run_batch(self, image_ids: list[str]) -> dict:
+        """Scores several images with batched TOPIQ forward passes.
+
+        TOPIQ works on the native resolution of each image, so only images that share
+        the same dimensions are stacked into one forward pass. Photos from the same
+        camera usually do, which covers the common case of a project upload. A pass holds
+        at most `QUALITY_BATCH_MAX_PIXELS` pixels, and images are only decoded when their
+        pass runs, so large photos are scored one at a time.
+
+        Args:
+            image_ids (list[str]): The IDs of the images to be processed.
+
+        Returns:
+            dict: A mapping of image ID to the exception raised while loading that image.
+        """
+        self.load_model()
+
+        errors = {}
+        conn = None
+        cur = None
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor()
 
+            cur.execute("SELECT id, storage_path FROM image WHERE id = ANY(%s)", (list(image_ids),))
+            image_paths = dict(cur.fetchall())
+
+            # Group by the dimensions in the file header, without decoding. Like every entry
+            # point, this scores images in their stored orientation, so the header size is
+            # the size of the input.
+            paths_by_size = {}
+            for image_id in image_ids:
+                if image_id not in image_paths:
+                    continue
+                path = resolve_storage_path(image_paths[image_id])
+                try:
+                    with Image.open(path) as img:
+                        size = img.size
+                except Exception as e:
+                    errors[image_id] = e
+                    continue
+                paths_by_size.setdefault(size, []).append((image_id, path))
+
+            for (width, height), paths in paths_by_size.items():
+                for batch_paths in pixel_batches(paths, width, height):
+                    batch = []
+                    for image_id, path in batch_paths:
+                        try:
+                            with Image.open(path) as img:
+                                batch.append((image_id, self.backend.to_input(img.convert("RGB"))))
+                        except Exception as e:
+                            errors[image_id] = e
+                    if not batch:
+                        continue
+                    scores = self.backend.score([tensor for _, tensor in batch])
+                    for (image_id, _), score in zip(batch, scores):
+                        self._store_score(cur, image_id, score)
+
+            conn.commit()
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                release_db_connection(conn)
+        return errors
+
+    def prepare(self, decoded):
+        """Converts a decoded image, in its stored orientation, to the CHW float input TOPIQ takes."""
+        return get_backend("quality_assessment").to_input(decoded.stored_image)
+
+    def run_prepared_batch(self, items: list) -> dict:
+        """Scores prepared images, stacking images of the same dimensions into forward passes.
+
+        A pass holds at most `QUALITY_BATCH_MAX_PIXELS` pixels.
+
+        Args:
+            items (list): (image_id, tensor) pairs, see `prepare`.
+
+        Returns:
+            dict: Always empty; an error fails the whole batch.
+        """
+        self.load_model()
+
+        conn = None
+        cur = None
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor()
+
+            batches_by_shape = {}
+            for image_id, tensor in items:
+                batches_by_shape.setdefault(tuple(tensor.shape), []).append((image_id, tensor))
+
+            for shape, shape_items in batches_by_shape.items():
+                for batch in pixel_batches(shape_items, shape[-1], shape[-2]):
+                    scores = self.backend.score([tensor for _, tensor in batch])
+                    for (image_id, _), score in zip(batch, scores):
+                        self._store_score(cur, image_id, score)
+
+            conn.commit()
         finally:
             if cur:
                 cur.close()
             if conn:
                 release_db_connection(conn)
+        return {}
@@ -1,26 +1,264 @@
 """This module defines the Celery task for grouping similar images."""
+import io
+import logging
 import os
+import threading
+import time
 import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
-from PIL import Image
 import imagehash
+import numpy as np
+from psycopg2.extras import execute_values
+from ..clustering import UnionFind, windowed_hamming_pairs
 from ..db import get_db_connection, release_db_connection
+from ..group_writer import add_group_members, replace_project_groups
+from ..hash_index import HammingIndex, hash_to_int
+from ..imaging import load_reduced, resolve_storage_path
 from . import register_task
 from .base import ImageProcessingTask
 
+logger = logging.getLogger(__name__)
+
+HASH_INDEX_MAX_PROJECTS = int(os.getenv("HASH_INDEX_MAX_PROJECTS", "16"))
+HASH_INDEX_MAX_AGE_S = int(os.getenv("HASH_INDEX_MAX_AGE_S", "600"))
+# Incremental refreshes also re-read rows updated shortly before the previous refresh, so
+# that transactions which committed after it with an older `updated_at` are not missed.
+HASH_INDEX_REFRESH_OVERLAP = timedelta(seconds=10)
+
+def perceptual_hash(source, min_side: int) -> str:
+    """Computes the perceptual hash of an image file.
+
+    Every hashing path goes through here, so that hashes stay comparable. The image is
+    hashed as stored, without applying its EXIF orientation, like the hashes computed
+    before reduced decoding. It is decoded at reduced resolution: pHash only looks at a
+    32x32 grayscale version, which barely depends on the decoded size.
+
+    Args:
+        source (str | file): The path or file object of the image.
+        min_side (int): The shortest side to decode at, see `src.imaging.load_reduced`.
+
+    Returns:
+        str: The hash as a hex string.
+    """
+    return str(imagehash.phash(load_reduced(source, min_side, exif_transpose=False)))
+
+class ProjectHashIndex:
+    """The perceptual hashes of one project, kept in sync with the `image` table.
+
+    The index is built from a single query on first use. Later refreshes only read the
+    rows whose `updated_at` is later than the previous refresh, and the whole index is
+    rebuilt after `HASH_INDEX_MAX_AGE_S` seconds to drop deleted images.
+    """
+
+    def __init__(self, project_id: str):
+        self.project_id = project_id
+        self.index = HammingIndex()
+        self.refreshed_at = None
+        self.built_at = time.monotonic()
+
+    def refresh(self, cur):
+        """Loads the images added or changed since the last refresh.
+
+        Args:
+            cur (psycopg2.extensions.cursor): The database cursor.
+        """
+        cur.execute("SELECT LOCALTIMESTAMP")
+        refreshed_at = cur.fetchone()[0]
+        if self.refreshed_at is None:
+            cur.execute(
+                """
+                SELECT id, perceptual_hash, COALESCE(capture_datetime, upload_datetime)
+                FROM image
+                WHERE project_id = %s AND perceptual_hash IS NOT NULL
+                """,
+                (self.project_id,)
+            )
+        else:
+            cur.execute(
+                """
+                SELECT id, perceptual_hash, COALESCE(capture_datetime, upload_datetime)
+                FROM image
+                WHERE project_id = %s AND updated_at > %s
+                """,
+                (self.project_id, self.refreshed_at - HASH_INDEX_REFRESH_OVERLAP)
+            )
+        for image_id, hash_str, reference_time in cur.fetchall():
+            value = hash_to_int(hash_str)
+            if value is None or reference_time is None:
+                self.index.remove(image_id)
+            elif self.index.get(image_id) != (value, reference_time):
+                self.index.add(image_id, value, reference_time)
+        self.refreshed_at = refreshed_at
+
+_project_indexes = OrderedDict()
+_project_indexes_lock = threading.Lock()
+
+def get_project_index(cur, project_id: str) -> HammingIndex:
+    """Returns the up-to-date hash index of a project, building it on first use.
+
+    The most recently used `HASH_INDEX_MAX_PROJECTS` indexes are kept in memory.
+
+    Args:
+        cur (psycopg2.extensions.cursor): The database cursor.
+        project_id (str): The ID of the project.
+
+    Returns:
+        HammingIndex: The index, mapping image IDs to their hash and reference time.
+    """
+    with _project_indexes_lock:
+        entry = _project_indexes.get(project_id)
+        if entry is None or time.monotonic() - entry.built_at > HASH_INDEX_MAX_AGE_S:
+            entry = _project_indexes[project_id] = ProjectHashIndex(project_id)
+        _project_indexes.move_to_end(project_id)
+        while len(_project_indexes) > HASH_INDEX_MAX_PROJECTS:
+            _project_indexes.popitem(last=False)
+        entry.refresh(cur)
+        return entry.index
+
 @register_task("similarity_grouping")
 class SimilarityGroupingTask(ImageProcessingTask):
+    # Images are similar if their hashes differ in at most this many bits...
+    hamming_threshold = 10
+    # ...and they were taken within this time of each other.
+    time_window = timedelta(minutes=5)
+
     @property
     def version(self):
         return "1.0.0"
 
-
     def run(self, image_id: str):
         """The main execution method for the task.
 
         Args:
             image_id (str): The ID of the image to be processed.
         """
+        self._group_image(
+            image_id,
+            lambda storage_path: perceptual_hash(resolve_storage_path(storage_path), self.decode_min_side)
+        )
+
+    def run_decoded(self, image_id: str, decoded):
+        """Groups an image whose hash, if needed, is computed from the pipeline's copy of the original.
+
+        The hash is computed from the file's bytes rather than `decoded.image`, which has
+        its EXIF orientation applied, so it matches the hashes of the other paths.
+
+        Args:
+            image_id (str): The ID of the image to be processed.
+            decoded (src.imaging.DecodedImage): The shared, decoded original image.
+        """
+        self._group_image(image_id, lambda storage_path: perceptual_hash(io.BytesIO(decoded.data), self.decode_min_side))
+
+    def run_project(self, project_id: str) -> dict:
+        """Regroups all images of a project at once.
+
+        Missing hashes are computed first. The hashes are then loaded into a uint64 array
+        sorted by capture time, all pairs within the time window and Hamming threshold are
+        found with vectorized XOR popcounts, and the connected components of those pairs
+        become the project's 'similar' groups. Unlike running the per-image task over the
+        project, the result does not depend on the processing order, and groups that are
+        bridged by an image are merged.
+
+        Args:
+            project_id (str): The ID of the project.
+
+        Returns:
+            dict: A mapping of image ID to the exception raised while hashing that image.
+        """
+        errors = {}
+        conn = None
+        cur = None
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor()
+
+            cur.execute(
+                """
+                SELECT id, perceptual_hash, COALESCE(capture_datetime, upload_datetime), storage_path
+                FROM image
+                WHERE project_id = %s
+                ORDER BY 3, 1
+                """,
+                (project_id,)
+            )
+            rows = cur.fetchall()
+
+            missing = [(image_id, storage_path) for image_id, hash_str, _, storage_path in rows if hash_to_int(hash_str) is None]
+            computed = {}
+            if missing:
+                computed, errors = self._hash_images(missing)
+                if computed:
+                    execute_values(cur, """
+                        UPDATE image SET perceptual_hash = v.perceptual_hash, updated_at = NOW()
+                        FROM (VALUES %s) AS v(id, perceptual_hash)
+                        WHERE image.id = v.id
+                    """, list(computed.items()), page_size=len(computed))
+
+            image_ids, values, times = [], [], []
+            for image_id, hash_str, reference_time, _ in rows:
+                value = hash_to_int(computed.get(image_id, hash_str))
+                if value is None or reference_time is None:
+                    continue
+                image_ids.append(image_id)
+                values.append(value)
+                times.append(reference_time)
+
+            pairs_i, pairs_j = windowed_hamming_pairs(
+                np.array(values, dtype=np.uint64),
+                np.array(times, dtype="datetime64[us]").astype(np.int64),
+                self.time_window // timedelta(microseconds=1),
+                self.hamming_threshold,
+            )
+            union_find = UnionFind(len(image_ids))
+            union_find.union_pairs(pairs_i, pairs_j)
+            groups = [
+                [(image_ids[index], times[index]) for index in component]
+                for component in union_find.components()
+            ]
+
+            replace_project_groups(cur, project_id, 'similar', groups)
+            conn.commit()
+            logger.debug("Grouped %d images of project %s into %d similarity groups", len(image_ids), project_id, len(groups))
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                release_db_connection(conn)
+        return errors
+
+    def _hash_images(self, images: list[tuple[str, str]]) -> tuple[dict, dict]:
+        """Computes the perceptual hashes of several images on a thread pool.
+
+        Args:
+            images (list[tuple[str, str]]): (image ID, storage path) pairs.
+
+        Returns:
+            tuple: A mapping of image ID to hash string, and a mapping of image ID to the
+                   exception raised while hashing that image.
+        """
+        def compute(storage_path):
+            return perceptual_hash(resolve_storage_path(storage_path), self.decode_min_side)
+
+        hashes, errors = {}, {}
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            futures = [(image_id, executor.submit(compute, storage_path)) for image_id, storage_path in images]
+            for image_id, future in futures:
+                try:
+                    hashes[image_id] = future.result()
+                except Exception as e:
+                    print(f"Failed to calculate hash for {image_id}: {e}")
+                    errors[image_id] = e
+        return hashes, errors
+
+    def _group_image(self, image_id: str, compute_hash):
+        """Computes the perceptual hash of an image if missing and adds it to a similarity group.
+
+        Args:
+            image_id (str): The ID of the image to be processed.
+            compute_hash (callable): Returns the perceptual hash of the image, given its storage path.
+        """
         conn = None
         cur = None
         try:
@@ -39,16 +277,11 @@ class SimilarityGroupingTask(ImageProcessingTask):
             storage_path, project_id, capture_datetime, existing_hash, upload_datetime = row
             
             # 2. Calculate Hash if not exists
-            p_hash_obj = None
             p_hash_str = existing_hash
 
             if not p_hash_str:
-                storage_base_path = os.getenv("STORAGE_BASE_PATH", "/storage")
-                full_image_path = os.path.join(storage_base_path, storage_path)
                 try:
-                    img = Image.open(full_image_path)
-                    p_hash_obj = imagehash.phash(img)
-                    p_hash_str = str(p_hash_obj)
+                    p_hash_str = compute_hash(storage_path)
                     
                     # Update DB
                     cur.execute(
@@ -59,8 +292,11 @@ class SimilarityGroupingTask(ImageProcessingTask):
                 except Exception as e:
                     print(f"Failed to calculate hash for {image_id}: {e}")
                     return
-            else:
-                p_hash_obj = imagehash.hex_to_hash(p_hash_str)
+
+            p_hash = hash_to_int(p_hash_str)
+            if p_hash is None:
+                print(f"Image {image_id} has an unsupported perceptual hash {p_hash_str!r}. Skipping similarity grouping.")
+                return
 
             reference_time = capture_datetime if capture_datetime else upload_datetime
 
@@ -69,32 +305,19 @@ class SimilarityGroupingTask(ImageProcessingTask):
                 print(f"Image {image_id} has no capture_datetime or upload_datetime. Skipping similarity grouping.")
                 return
 
-            # 3. Find candidates in time window
+            # 3. Find similar hashes in the project index, then keep those in the time window
             # Window is +/- 5 minutes
-            time_window = timedelta(minutes=5)
-            start_time = reference_time - time_window
-            end_time = reference_time + time_window
-
-            cur.execute(
-                """
-                SELECT id, perceptual_hash 
-                FROM image 
-                WHERE project_id = %s 
-                  AND id != %s 
-                  AND COALESCE(capture_datetime, upload_datetime) BETWEEN %s AND %s
-                  AND perceptual_hash IS NOT NULL
-                """,
-                (project_id, image_id, start_time, end_time)
-            )
-            candidates = cur.fetchall()
+            start_time = reference_time - self.time_window
+            end_time = reference_time + self.time_window
 
-            threshold = 10 # Hamming distance threshold
-            matching_image_ids = []
-
-            for cand_id, cand_hash_str in candidates:
-                cand_hash_obj = imagehash.hex_to_hash(cand_hash_str)
-                if p_hash_obj - cand_hash_obj <= threshold:
-                    matching_image_ids.append(cand_id)
+            threshold = self.hamming_threshold
+            project_index = get_project_index(cur, project_id)
+            project_index.add(image_id, p_hash, reference_time)
+            matching_image_ids = [
+                cand_id
+                for cand_id, _, cand_time in project_index.query(p_hash, threshold)
+                if cand_id != image_id and start_time <= cand_time <= end_time
+            ]
 
             if not matching_image_ids:
                 return
@@ -112,11 +335,10 @@ class SimilarityGroupingTask(ImageProcessingTask):
             cur.execute(query, tuple(matching_image_ids))
             existing_groups = cur.fetchall()
 
-            group_id = None
-
             if existing_groups:
                 # Join the first found group (simple logic)
                 group_id = existing_groups[0][0]
+                new_members = [image_id]
             else:
                 # Create new group
                 group_id = str(uuid.uuid4())
@@ -127,39 +349,10 @@ class SimilarityGroupingTask(ImageProcessingTask):
                     """,
                     (group_id, project_id)
                 )
-                
-                # Add the matching image(s) to this new group
-                # Note: If we matched multiple images that weren't in groups, we add them all?
-                # Or just the one we matched? Logic: If A matches B and C, and B, C are not in groups.
-                # We create group with A, B, C.
-                for match_id in matching_image_ids:
-                    # Check if already in group to be safe
-                    cur.execute(
-                        "SELECT 1 FROM image_group_membership WHERE group_id = %s AND image_id = %s",
-                        (group_id, match_id)
-                    )
-                    if not cur.fetchone():
-                        cur.execute(
-                            """
-                            INSERT INTO image_group_membership (id, group_id, image_id, added_at)
-                            VALUES (%s, %s, %s, NOW())
-                            """,
-                            (str(uuid.uuid4()), group_id, match_id)
-                        )
-
-            # Add current image to the group
-            cur.execute(
-                "SELECT 1 FROM image_group_membership WHERE group_id = %s AND image_id = %s",
-                (group_id, image_id)
-            )
-            if not cur.fetchone():
-                cur.execute(
-                    """
-                    INSERT INTO image_group_membership (id, group_id, image_id, added_at)
-                    VALUES (%s, %s, %s, NOW())
-                    """,
-                    (str(uuid.uuid4()), group_id, image_id)
-                )
+                # If A matches B and C, and B, C are not in groups, we create a group with A, B, C.
+                new_members = matching_image_ids + [image_id]
+
+            add_group_members(cur, group_id, new_members)
 
             conn.commit()
 
@@ -1,12 +1,16 @@
 """This module defines the Celery task for generating thumbnails for images."""
-from PIL import Image, ImageOps
+from PIL import Image
 import os
 from ..db import get_db_connection, release_db_connection
+from ..events import publish
+from ..imaging import load_reduced, resolve_storage_path, storage_base_path
 from . import register_task
 from .base import ImageProcessingTask
 
 @register_task("thumbnail_generation")
 class ThumbnailGenerationTask(ImageProcessingTask):
+    processed_query = "SELECT id FROM image WHERE id = ANY(%(image_ids)s) AND thumbnail_path IS NOT NULL"
+
     @property
     def version(self):
         return "1.0.0"
@@ -19,6 +23,49 @@ class ThumbnailGenerationTask(ImageProcessingTask):
         row = cur.fetchone()
         return row and row[0] is not None
 
+    def _save_thumbnail(self, cur, image_id: str, project_id: str, img):
+        """Resizes an upright image to a thumbnail, saves it as WebP and records its path.
+
+        Args:
+            cur (psycopg2.extensions.cursor): The database cursor.
+            image_id (str): The ID of the image.
+            project_id (str): The ID of the project the image belongs to.
+            img (PIL.Image.Image): The image with its EXIF orientation already applied.
+        """
+        # Convert to RGB if necessary (e.g. for RGBA -> JPEG/WebP)
+        if img.mode in ("RGBA", "P"):
+            img = img.convert("RGB")
+        
+        # Resize logic: Max width 256px, preserve aspect ratio
+        max_width = 256
+        width_percent = (max_width / float(img.size[0]))
+        if width_percent < 1: # Only scale down
+            h_size = int((float(img.size[1]) * float(width_percent)))
+            img = img.resize((max_width, h_size), Image.Resampling.LANCZOS)
+        
+        # Determine thumbnail path
+        # Original: storage/images/{projectId}/{imageId}.ext
+        # Thumbnail: storage/thumbnails/{projectId}/{imageId}.webp
+        
+        thumbnails_dir = os.path.join(storage_base_path(), "storage", "thumbnails", project_id)
+        os.makedirs(thumbnails_dir, exist_ok=True)
+        
+        thumbnail_filename = f"{image_id}.webp"
+        thumbnail_full_path = os.path.join(thumbnails_dir, thumbnail_filename)
+        
+        # Save as WebP
+        img.save(thumbnail_full_path, "WEBP", quality=80)
+        
+        # DB path should match format of storage_path (relative to where app expects)
+        # if original is `storage/images/...`, thumbnail should be `storage/thumbnails/...`
+        db_thumbnail_path = f"storage/thumbnails/{project_id}/{thumbnail_filename}"
+        
+        cur.execute(
+            "UPDATE image SET thumbnail_path = %s WHERE id = %s",
+            (db_thumbnail_path, image_id)
+        )
+        publish(cur, {"type": "thumbnail", "project_id": project_id, "image_id": image_id, "thumbnail_path": db_thumbnail_path})
+
     def run(self, image_id: str):
         """The main execution method for the task.
 
@@ -43,56 +90,16 @@ class ThumbnailGenerationTask(ImageProcessingTask):
             original_image_path = image_path_tuple[0]
             project_id = image_path_tuple[1]
             
-            storage_base_path = os.getenv("STORAGE_BASE_PATH", ".") # Default to current dir if not set (for local dev)
-            
-            # Handle potential absolute path in DB or relative
-            if original_image_path.startswith("/"):
-                full_original_path = original_image_path
-            else:
-                full_original_path = os.path.join(storage_base_path, original_image_path)
+            full_original_path = resolve_storage_path(original_image_path)
 
             if not os.path.exists(full_original_path):
                 print(f"Original image not found at {full_original_path}")
                 return
 
             try:
-                with Image.open(full_original_path) as img:
-                    # Fix orientation based on EXIF
-                    img = ImageOps.exif_transpose(img)
-                    
-                    # Convert to RGB if necessary (e.g. for RGBA -> JPEG/WebP)
-                    if img.mode in ("RGBA", "P"):
-                        img = img.convert("RGB")
-                    
-                    # Resize logic: Max width 256px, preserve aspect ratio
-                    max_width = 256
-                    width_percent = (max_width / float(img.size[0]))
-                    if width_percent < 1: # Only scale down
-                        h_size = int((float(img.size[1]) * float(width_percent)))
-                        img = img.resize((max_width, h_size), Image.Resampling.LANCZOS)
-                    
-                    # Determine thumbnail path
-                    # Original: storage/images/{projectId}/{imageId}.ext
-                    # Thumbnail: storage/thumbnails/{projectId}/{imageId}.webp
-                    
-                    thumbnails_dir = os.path.join(storage_base_path, "storage", "thumbnails", project_id)
-                    os.makedirs(thumbnails_dir, exist_ok=True)
-                    
-                    thumbnail_filename = f"{image_id}.webp"
-                    thumbnail_full_path = os.path.join(thumbnails_dir, thumbnail_filename)
-                    
-                    # Save as WebP
-                    img.save(thumbnail_full_path, "WEBP", quality=80)
-                    
-                    # DB path should match format of storage_path (relative to where app expects)
-                    # if original is `storage/images/...`, thumbnail should be `storage/thumbnails/...`
-                    db_thumbnail_path = f"storage/thumbnails/{project_id}/{thumbnail_filename}"
-                    
-                    cur.execute(
-                        "UPDATE image SET thumbnail_path = %s WHERE id = %s",
-                        (db_thumbnail_path, image_id)
-                    )
-                    
+                # Decode at reduced resolution (JPEG DCT scaling) with the EXIF orientation applied
+                with load_reduced(full_original_path, self.decode_min_side) as img:
+                    self._save_thumbnail(cur, image_id, project_id, img)
                     conn.commit()
 
             except Exception as e:
@@ -104,3 +111,33 @@ class ThumbnailGenerationTask(ImageProcessingTask):
                 cur.close()
             if conn:
                 release_db_connection(conn)
+
+    def run_decoded(self, image_id: str, decoded):
+        """Generates a thumbnail from an image already decoded by the analyze pipeline.
+
+        Args:
+            image_id (str): The ID of the image to be processed.
+            decoded (src.imaging.DecodedImage): The shared, decoded original image.
+        """
+        conn = None
+        cur = None
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor()
+
+            cur.execute("SELECT project_id FROM image WHERE id = %s", (image_id,))
+            project_id_tuple = cur.fetchone()
+            if not project_id_tuple:
+                return
+
+            try:
+                self._save_thumbnail(cur, image_id, project_id_tuple[0], decoded.image)
+                conn.commit()
+            except Exception as e:
+                print(f"Error generating thumbnail for {image_id}: {e}")
+                return
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                release_db_connection(conn)
@@ -0,0 +1,106 @@
+"""This module loads and warms up the models of a worker's tasks before the worker takes messages."""
+import os
+import sys
+import threading
+import time
+from .batching import BATCH_MAX_SIZE
+from .tasks import TASK_SPECS, get_task_class
+from .tasks.base import ImageProcessingTask
+
+# Whether a worker loads its tasks' models and runs them once before it consumes messages.
+WORKER_WARMUP = os.getenv("WORKER_WARMUP", "true").lower() == "true"
+# The side, in pixels, of the blank square images the warm-up inference runs on.
+WARMUP_IMAGE_SIDE = int(os.getenv("WARMUP_IMAGE_SIDE", "640"))
+
+def warmup_batch_sizes(task_name: str) -> list[int]:
+    """Returns the batch sizes a task's model runs at: single images and full batches.
+
+    Args:
+        task_name (str): The name of the task.
+
+    Returns:
+        list[int]: The batch sizes, in increasing order.
+    """
+    spec = TASK_SPECS[task_name]
+    if not spec.supports_batching:
+        return [1]
+    return sorted({1, spec.max_batch_size or BATCH_MAX_SIZE})
+
+def _synchronize():
+    """Waits for the queued GPU work, so that timings include it."""
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+class WarmupRecorder:
+    """Warms up task models and records the load and warm-up time of each."""
+
+    def __init__(self):
+        """Initializes the recorder."""
+        self._stats = {}
+        self._lock = threading.Lock()
+        self.ready = False
+
+    def warm_up(self, task_names, side: int = WARMUP_IMAGE_SIDE):
+        """Loads the model of every given task and runs it on blank images at each batch size.
+
+        Tasks without a model are skipped. A task whose model fails to load or run is
+        reported and skipped; it loads its model on first use as usual.
+
+        Args:
+            task_names (iterable[str]): The names of the tasks.
+            side (int): The side of the blank images, in pixels.
+        """
+        started = time.perf_counter()
+        for task_name in task_names:
+            task_class = get_task_class(task_name)
+            if task_class is None or task_class.load_model is ImageProcessingTask.load_model:
+                continue
+            task_instance = task_class()
+            entry = {"load_seconds": None, "warmup_seconds": {}, "error": None}
+            with self._lock:
+                self._stats[task_name] = entry
+            try:
+                load_started = time.perf_counter()
+                task_instance.load_model()
+                _synchronize()
+                entry["load_seconds"] = time.perf_counter() - load_started
+                for batch_size in warmup_batch_sizes(task_name):
+                    batch_started = time.perf_counter()
+                    task_instance.warm_up(batch_size, side)
+                    _synchronize()
+                    entry["warmup_seconds"][batch_size] = time.perf_counter() - batch_started
+            except Exception as exc:
+                entry["error"] = str(exc)
+                print(f"Warm-up of {task_name} failed: {exc}")
+                continue
+            print(
+                f"Warmed up {task_name}: loaded in {entry['load_seconds']:.2f}s, "
+                + ", ".join(f"batch of {size} in {seconds:.2f}s" for size, seconds in entry["warmup_seconds"].items())
+            )
+        self.ready = True
+        print(f"Warm-up finished in {time.perf_counter() - started:.2f}s")
+
+    def stats(self) -> dict:
+        """Returns the warm-up statistics.
+
+        Returns:
+            dict: Whether the warm-up has finished, and one entry per model with its load
+                  time, its warm-up time per batch size and the error, if any.
+        """
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "models": [
+                    {
+                        "model": name,
+                        "load_seconds": entry["load_seconds"],
+                        # Celery replies are JSON: keys must be strings.
+                        "warmup_seconds": {str(size): seconds for size, seconds in entry["warmup_seconds"].items()},
+                        "error": entry["error"],
+                    }
+                    for name, entry in sorted(self._stats.items())
+                ],
+            }
+
+WARMUP = WarmupRecorder()
@@ -1,9 +1,24 @@
 """This module defines the Celery worker and the main task for processing images."""
-from celery import Celery, states
-from src.tasks import TASK_REGISTRY
-from src.db import get_db_connection, release_db_connection
+from celery import Celery, chain, states
+from celery.signals import worker_init, worker_process_shutdown, worker_shutdown
+from celery.worker.control import inspect_command
+from kombu import Exchange, Queue
+from src.tasks import TASK_SPECS, DEFAULT_QUEUE, get_task_class, task_queue
+from src.db import DB_POOL_MAX_SIZE, get_db_connection, release_db_connection
+from src.batching import BATCH_MAX_SIZE, BATCH_STATS
+from src.job_status import JOB_STATUS
+from src.scheduling import plan_request
+from src.residency import MODEL_RESIDENCY
+from src.imaging import DecodedImage, resolve_storage_path
+from src.prefetch import PREFETCH_DEPTH, PREFETCH_MESSAGE_BATCHES, Prefetcher
+from src.execution import WORKER_CONCURRENCY, execute, shutdown as shutdown_execution, uses_concurrency
+from src.warmup import WARMUP, WORKER_WARMUP
+from src.inference import GENERATION_STATS
+import atexit
+import gc
 import os
-import importlib
+import sys
+import time
 
 broker_url = os.getenv("CELERY_BROKER_URL", "pyamqp://guest@localhost//")
 backend_url = os.getenv("CELERY_RESULT_BACKEND", "rpc://")
@@ -13,7 +28,6 @@ app = Celery(
     broker=broker_url,
     backend=backend_url
 )
-app.conf.worker_pool = 'solo'
 
 def get_db_conn_and_cursor():
     """Gets a database connection and cursor.
@@ -36,78 +50,573 @@ def close_db_conn_and_cursor(conn, cursor):
     if conn:
         release_db_connection(conn)
 
-def register_tasks():
-    """Dynamically imports all tasks from the `src/tasks` directory to ensure they are registered in the TASK_REGISTRY."""
-    tasks_dir = os.path.join(os.path.dirname(__file__), "src", "tasks")
-    for filename in os.listdir(tasks_dir):
-        if filename.endswith(".py") and not filename.startswith("__"):
-            module_name = f"src.tasks.{filename[:-3]}"
-            importlib.import_module(module_name)
-            print(f"Registered task: {module_name}")
+def query(fn):
+    """Runs `fn` with a cursor on a pooled connection, which is released before returning.
 
-register_tasks()
+    The Celery tasks only hold a connection for their own lookups. Task methods and the job
+    status recorder take connections of their own, so a thread that kept one while calling
+    them would need two at once, and `WORKER_CONCURRENCY` such threads could exhaust the pool.
 
-import gc
-import torch
+    Args:
+        fn (callable): Called with the cursor; returns the result.
+
+    Returns:
+        The result of `fn`.
+    """
+    conn, cur = None, None
+    try:
+        conn, cur = get_db_conn_and_cursor()
+        return fn(cur)
+    finally:
+        close_db_conn_and_cursor(conn, cur)
+
+# Comma-separated names of the tasks this worker runs. Empty means all tasks.
+WORKER_TASKS = [name.strip() for name in os.getenv("WORKER_TASKS", "").split(",") if name.strip()]
+
+def register_tasks() -> dict:
+    """Selects the tasks this worker runs from `TASK_SPECS`.
+
+    Nothing is imported here: a task's module, and its model libraries, are imported when
+    the worker first executes the task (see `src.tasks.get_task_class`).
+
+    Returns:
+        dict: The `TaskSpec` of every task this worker runs, by name: the tasks listed in
+              `WORKER_TASKS`, or all tasks if it is empty.
+
+    Raises:
+        ValueError: If `WORKER_TASKS` names an unknown task.
+    """
+    unknown = [name for name in WORKER_TASKS if name not in TASK_SPECS]
+    if unknown:
+        raise ValueError(f"Unknown task(s) in WORKER_TASKS: {', '.join(unknown)}. Available: {', '.join(sorted(TASK_SPECS))}")
+    specs = {name: TASK_SPECS[name] for name in WORKER_TASKS or sorted(TASK_SPECS)}
+    for name, spec in specs.items():
+        print(f"Registered task: {name} (queue {spec.queue}, {spec.execution})")
+    return specs
+
+WORKER_TASK_SPECS = register_tasks()
+
+@worker_init.connect
+def warm_up_models(**kwargs):
+    """Loads and warms up the models of this worker's tasks before it consumes any message.
+
+    Celery only starts consuming, and logs that the worker is ready, once this returns, so
+    the first images of a job do not pay for loading a model. See `src.warmup`.
+    """
+    if WORKER_WARMUP:
+        WARMUP.warm_up(WORKER_TASK_SPECS)
+    else:
+        WARMUP.ready = True
+
+@worker_shutdown.connect
+@worker_process_shutdown.connect
+def flush_job_status(**kwargs):
+    """Writes the buffered job item status transitions before the worker exits."""
+    JOB_STATUS.flush()
+
+atexit.register(JOB_STATUS.flush)
+
+@worker_shutdown.connect
+def stop_process_pool(**kwargs):
+    """Stops the pool of the tasks with the "process" execution policy."""
+    shutdown_execution()
+
+# Model tasks need the solo pool: one message at a time, with the model loaded in this
+# process. A worker that also runs thread or process tasks handles several messages at
+# once on threads; its inline tasks still run one at a time (see `src.execution`).
+if uses_concurrency(WORKER_TASK_SPECS.values()):
+    # One connection per message, and one for the job status recorder's background flush.
+    if WORKER_CONCURRENCY >= DB_POOL_MAX_SIZE:
+        raise ValueError(
+            f"WORKER_CONCURRENCY ({WORKER_CONCURRENCY}) must be lower than DB_POOL_MAX_SIZE ({DB_POOL_MAX_SIZE}), "
+            "or the worker's threads would wait on each other for database connections."
+        )
+    app.conf.worker_pool = 'threads'
+    app.conf.worker_concurrency = WORKER_CONCURRENCY
+else:
+    app.conf.worker_pool = 'solo'
+
+# Consume the queues of the registered tasks only: a worker started with WORKER_TASKS=object_detection
+# receives nothing but detection messages and keeps YOLO loaded for the whole job.
+app.conf.task_queues = [Queue(name, Exchange(name), routing_key=name) for name in sorted({spec.queue for spec in WORKER_TASK_SPECS.values()})]
+app.conf.task_default_queue = DEFAULT_QUEUE
+
+@inspect_command()
+def worker_stats(state):
+    """Remote control command that reports the batching, model residency, warm-up and generation statistics of this worker.
+
+    Returns:
+        dict: The batch throughput, the model residency, the model warm-up and the generation statistics.
+    """
+    return {
+        "batching": BATCH_STATS.summary(),
+        "model_residency": MODEL_RESIDENCY.stats(),
+        "warmup": WARMUP.stats(),
+        "generation": GENERATION_STATS.summary(),
+    }
+
+def free_memory():
+    """Collects garbage and, once a model task has loaded torch, empties the CUDA cache."""
+    gc.collect()
+    # Only model tasks import torch; a worker that has not run one has no CUDA cache.
+    torch = sys.modules.get("torch")
+    use_gpu = os.getenv("USE_GPU", "true").lower() == "true"
+    if torch is not None and use_gpu and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+def retry_or_fail(task, exc: Exception, job_item_ids: list[str], args: tuple | None = None):
+    """Retries a failed Celery task, or marks its job items failed once its retries are used up.
+
+    Args:
+        task (celery.Task): The bound task that failed.
+        exc (Exception): The error.
+        job_item_ids (list[str]): The IDs of the job items the task was processing.
+        args (tuple | None): The arguments to retry with, or None to retry with the same ones.
+    """
+    if task.request.retries < task.max_retries:
+        # The retry may run on another worker: write this attempt's status first.
+        JOB_STATUS.flush()
+        raise task.retry(args=args, exc=exc)
+    JOB_STATUS.failed(job_item_ids)
+    task.update_state(state=states.FAILURE, meta={'exc': exc})
 
 @app.task(bind=True, max_retries=3, default_retry_delay=5)
 def process_image(self, task_name: str, image_id: str, job_item_id: str):
     """The main Celery task for processing an image.
 
-    This task retrieves the appropriate task class from the TASK_REGISTRY,
-    updates the job item status in the database, runs the task, and handles
-    retries and failures.
+    This task retrieves the appropriate task class (see `src.tasks.get_task_class`),
+    records the job item status transitions (see `src.job_status`), runs the task,
+    and handles retries and failures.
 
     Args:
         task_name (str): The name of the task to run.
         image_id (str): The ID of the image to process.
         job_item_id (str): The ID of the analysis job item.
     """
-    conn, cur = None, None
     try:
         # Aggressively clean up memory before starting a task
-        gc.collect()
-        use_gpu = os.getenv("USE_GPU", "true").lower() == "true"
-        if use_gpu and torch.cuda.is_available():
-            torch.cuda.empty_cache()
-            
-        conn, cur = get_db_conn_and_cursor()
+        free_memory()
 
-        cur.execute("UPDATE analysis_job_item SET item_status = 'processing', started_at = NOW() WHERE id = %s", (job_item_id,))
-        conn.commit()
+        JOB_STATUS.processing([job_item_id], retry=self.request.retries > 0)
 
-        task_class = TASK_REGISTRY.get(task_name)
+        task_class = get_task_class(task_name)
         if not task_class:
             raise ValueError(f"Task '{task_name}' not found in registry.")
 
         task_instance = task_class()
         
-        if task_instance.check_already_processed(cur, image_id):
+        if query(lambda cur: task_instance.check_already_processed(cur, image_id)):
             print(f"Task {task_name} for image {image_id} already processed (version {task_instance.version}). Skipping.")
-            cur.execute("UPDATE analysis_job_item SET item_status = 'skipped', completed_at = NOW() WHERE id = %s", (job_item_id,))
-            conn.commit()
+            JOB_STATUS.skipped([job_item_id])
             return
 
-        task_instance.run(image_id)
+        execute(task_name, task_instance, "run", image_id)
 
-        cur.execute("UPDATE analysis_job_item SET item_status = 'completed', completed_at = NOW() WHERE id = %s", (job_item_id,))
-        conn.commit()
+        JOB_STATUS.completed([job_item_id])
+
+    except Exception as exc:
+        JOB_STATUS.error([job_item_id], str(exc))
+
+        retry_or_fail(self, exc, [job_item_id])
+
+def run_prefetched(task_name: str, task_instance, image_ids: list[str]) -> dict:
+    """Runs a task over many images in model-sized batches, loading upcoming images in the background.
+
+    While the model works on one batch, prefetch threads read, decode and `prepare` the
+    images of the next ones (see `src.prefetch`), so the model no longer waits for disk
+    reads and decoding between batches.
+
+    Args:
+        task_name (str): The name of the task.
+        task_instance (ImageProcessingTask): The task, which must support prefetching.
+        image_ids (list[str]): The IDs of the images to process.
+
+    Returns:
+        dict: A mapping of image ID to the exception raised while processing that image.
+    """
+    def lookup(cur):
+        cur.execute("SELECT id, storage_path FROM image WHERE id = ANY(%s)", (image_ids,))
+        return dict(cur.fetchall())
+
+    storage_paths = query(lookup)
+    errors = {image_id: ValueError(f"Image '{image_id}' not found.") for image_id in image_ids if image_id not in storage_paths}
+
+    def load(image_id):
+        decoded = DecodedImage.from_path(resolve_storage_path(storage_paths[image_id]), task_instance.decode_min_side)
+        return task_instance.prepare(decoded)
+
+    started = time.perf_counter()
+    busy = 0.0
+    prefetcher = Prefetcher(load, [image_id for image_id in image_ids if image_id in storage_paths])
+    for batch in prefetcher.batches(task_instance.max_batch_size or BATCH_MAX_SIZE):
+        ready = []
+        for image_id, prepared, error in batch:
+            if error is not None:
+                errors[image_id] = error
+            else:
+                ready.append((image_id, prepared))
+        if not ready:
+            continue
+        batch_started = time.perf_counter()
+        errors.update(execute(task_name, task_instance, "run_prepared_batch", ready))
+        elapsed = time.perf_counter() - batch_started
+        busy += elapsed
+        average = BATCH_STATS.record(task_name, len(ready), elapsed)
+        print(
+            f"Batch {task_name} x{len(ready)} took {elapsed:.2f}s "
+            f"({len(ready) / elapsed if elapsed > 0 else 0.0:.2f} images/s, "
+            f"{average:.2f} images/s on average at this batch size)"
+        )
+    total = time.perf_counter() - started
+    print(
+        f"Prefetched {task_name} x{len(image_ids)} in {total:.2f}s: model busy {busy / total if total > 0 else 0.0:.0%}, "
+        f"{prefetcher.wait_seconds:.2f}s waiting for images"
+    )
+    return errors
+
+@app.task(bind=True, max_retries=3, default_retry_delay=5)
+def process_image_batch(self, task_name: str, items: list):
+    """Celery task for processing several images of the same task in one batch.
+
+    Every item keeps its own analysis job item status. Items that fail inside the batch
+    are handed over to `process_image` so that each of them gets its own retries. For tasks
+    that support prefetching, the items run in model-sized batches through `run_prefetched`.
+
+    Args:
+        task_name (str): The name of the task to run.
+        items (list): A list of [image_id, job_item_id] pairs.
+    """
+    job_item_ids = [job_item_id for _, job_item_id in items]
+    try:
+        free_memory()
+
+        JOB_STATUS.processing(job_item_ids, retry=self.request.retries > 0)
+
+        task_class = get_task_class(task_name)
+        if not task_class:
+            raise ValueError(f"Task '{task_name}' not found in registry.")
+
+        task_instance = task_class()
+
+        done = query(lambda cur: task_instance.filter_already_processed(cur, [image_id for image_id, _ in items]))
+        pending = [(image_id, job_item_id) for image_id, job_item_id in items if image_id not in done]
+        skipped_item_ids = [job_item_id for image_id, job_item_id in items if image_id in done]
+
+        if skipped_item_ids:
+            print(f"Task {task_name}: {len(skipped_item_ids)} image(s) already processed (version {task_instance.version}). Skipping.")
+            JOB_STATUS.skipped(skipped_item_ids)
+
+        if not pending:
+            return
+
+        if PREFETCH_DEPTH > 0 and task_instance.supports_prefetch:
+            errors = run_prefetched(task_name, task_instance, [image_id for image_id, _ in pending])
+        else:
+            started = time.perf_counter()
+            errors = execute(task_name, task_instance, "run_batch", [image_id for image_id, _ in pending])
+            elapsed = time.perf_counter() - started
+            average = BATCH_STATS.record(task_name, len(pending), elapsed)
+            print(
+                f"Batch {task_name} x{len(pending)} took {elapsed:.2f}s "
+                f"({len(pending) / elapsed if elapsed > 0 else 0.0:.2f} images/s, "
+                f"{average:.2f} images/s on average at this batch size)"
+            )
+
+        JOB_STATUS.completed([job_item_id for image_id, job_item_id in pending if image_id not in errors])
+
+        if errors:
+            for image_id, job_item_id in pending:
+                if image_id in errors:
+                    JOB_STATUS.error([job_item_id], str(errors[image_id]))
+            # The failed items are retried by other messages: write their status first.
+            JOB_STATUS.flush()
+            for image_id, job_item_id in pending:
+                if image_id in errors:
+                    process_image.apply_async((task_name, image_id, job_item_id), queue=task_queue(task_name))
+
+    except Exception as exc:
+        JOB_STATUS.error(job_item_ids, str(exc))
+
+        retry_or_fail(self, exc, job_item_ids)
+
+@app.task(bind=True, max_retries=3, default_retry_delay=5)
+def analyze_image(self, image_id: str, stages: list):
+    """Celery task that runs several tasks on one image, reading and decoding the original only once.
+
+    The original file is read into memory once and decoded lazily, with its EXIF orientation
+    applied, the first time a stage needs pixels. Every stage receives the shared
+    `DecodedImage` through `run_decoded` and keeps its own analysis job item status.
+    Stages that fail are handed over to `process_image` so that each gets its own retries.
+    If the image itself cannot be loaded, the task is retried with only the stages that
+    have not reached a final status yet.
+
+    Args:
+        image_id (str): The ID of the image to process.
+        stages (list): A list of [task_name, job_item_id] pairs, run in the given order.
+    """
+    job_item_ids = [job_item_id for _, job_item_id in stages]
+    finished = set()
+    try:
+        free_memory()
+
+        JOB_STATUS.processing(job_item_ids, retry=self.request.retries > 0)
+
+        def lookup(cur):
+            cur.execute("SELECT storage_path FROM image WHERE id = %s", (image_id,))
+            return cur.fetchone()
+
+        image_path_tuple = query(lookup)
+        if not image_path_tuple:
+            raise ValueError(f"Image '{image_id}' not found.")
+
+        # Decode at reduced resolution unless one of the stages needs every pixel.
+        min_sides = [TASK_SPECS[name].decode_min_side for name, _ in stages if name in TASK_SPECS]
+        min_side = None if None in min_sides else max(min_sides, default=0)
+        decoded = DecodedImage.from_path(resolve_storage_path(image_path_tuple[0]), min_side)
+
+        for task_name, job_item_id in stages:
+            # A stage is finished once its final status is recorded or it is handed over.
+            try:
+                task_class = get_task_class(task_name)
+                if not task_class:
+                    JOB_STATUS.failed([job_item_id], f"Task '{task_name}' not found in registry.")
+                    finished.add(job_item_id)
+                    continue
+
+                task_instance = task_class()
+
+                if query(lambda cur: task_instance.check_already_processed(cur, image_id)):
+                    print(f"Task {task_name} for image {image_id} already processed (version {task_instance.version}). Skipping.")
+                    JOB_STATUS.skipped([job_item_id])
+                    finished.add(job_item_id)
+                    continue
+
+                execute(task_name, task_instance, "run_decoded", image_id, decoded)
+            except Exception as exc:
+                JOB_STATUS.error([job_item_id], str(exc))
+                JOB_STATUS.flush()
+                process_image.apply_async((task_name, image_id, job_item_id), queue=task_queue(task_name))
+                finished.add(job_item_id)
+                continue
+
+            JOB_STATUS.completed([job_item_id])
+            finished.add(job_item_id)
 
     except Exception as exc:
-        if conn and cur:
-            conn.rollback() # Rollback any partial changes
+        # Stages that already finished or were handed over keep their status, and are not
+        # run again by the retry.
+        unfinished_stages = [[task_name, job_item_id] for task_name, job_item_id in stages if job_item_id not in finished]
+        unfinished_item_ids = [job_item_id for _, job_item_id in unfinished_stages]
+        JOB_STATUS.error(unfinished_item_ids, str(exc))
+
+        retry_or_fail(self, exc, unfinished_item_ids, args=(image_id, unfinished_stages))
+
+@app.task(bind=True, max_retries=3, default_retry_delay=5)
+def process_project(self, task_name: str, project_id: str, items: list | None = None):
+    """Celery task that runs a task over all unprocessed images of a project at once.
+
+    Args:
+        task_name (str): The name of the task to run.
+        project_id (str): The ID of the project.
+        items (list | None): Optional [image_id, job_item_id] pairs whose analysis job
+            items are updated with the outcome of their image.
+    """
+    items = items or []
+    job_item_ids = [job_item_id for _, job_item_id in items]
+    try:
+        JOB_STATUS.processing(job_item_ids, retry=self.request.retries > 0)
+
+        task_class = get_task_class(task_name)
+        if not task_class:
+            raise ValueError(f"Task '{task_name}' not found in registry.")
+
+        started = time.perf_counter()
+        errors = execute(task_name, task_class(), "run_project", project_id)
+        print(f"Project run of {task_name} for project {project_id} took {time.perf_counter() - started:.2f}s ({len(errors)} error(s))")
+
+        for image_id, job_item_id in items:
+            if image_id in errors:
+                JOB_STATUS.failed([job_item_id], str(errors[image_id]))
+        JOB_STATUS.completed([job_item_id for image_id, job_item_id in items if image_id not in errors])
+
+    except Exception as exc:
+        JOB_STATUS.error(job_item_ids, str(exc))
+
+        retry_or_fail(self, exc, job_item_ids)
+
+def enqueue_items(items: list, published: set | None = None):
+    """Enqueues (image_id, task_name, job_item_id) items on their tasks' queues.
+
+    Items of tasks that support batching are sent in batches of the task's maximum batch size,
+    or of several of them for tasks the worker prefetches images for.
+
+    Args:
+        items (list): The items to enqueue.
+        published (set | None): If given, the job item IDs of every message are added to it
+            once the message is sent.
+    """
+    if published is None:
+        published = set()
+    pairs_by_task = {}
+    for image_id, task_name, job_item_id in items:
+        pairs_by_task.setdefault(task_name, []).append([image_id, job_item_id])
+    for task_name, pairs in pairs_by_task.items():
+        spec = TASK_SPECS.get(task_name)
+        queue = task_queue(task_name)
+        if spec and spec.supports_batching:
+            batch_size = spec.max_batch_size or BATCH_MAX_SIZE
+            if PREFETCH_DEPTH > 0 and spec.supports_prefetch:
+                # Give the worker upcoming images to load while the model runs on a batch.
+                batch_size *= max(1, PREFETCH_MESSAGE_BATCHES)
+            for start in range(0, len(pairs), batch_size):
+                process_image_batch.apply_async((task_name, pairs[start:start + batch_size]), queue=queue)
+                published.update(job_item_id for _, job_item_id in pairs[start:start + batch_size])
+        else:
+            for image_id, job_item_id in pairs:
+                process_image.apply_async((task_name, image_id, job_item_id), queue=queue)
+                published.add(job_item_id)
+
+@app.task
+def fan_out(items: list):
+    """Celery task that enqueues per-image work once the steps before it in a project schedule are done.
+
+    Args:
+        items (list): (image_id, task_name, job_item_id) items, see `enqueue_items`.
+    """
+    enqueue_items(items)
+
+def project_chain(project_id: str, steps: list):
+    """Builds the Celery chain that runs the steps of a project schedule one after the other.
+
+    Failed items do not break the chain: the tasks record the failure on the job item and
+    return, so later steps still run for the images that succeeded. A chain needs no result
+    backend, unlike a chord.
+
+    Args:
+        project_id (str): The ID of the project.
+        steps (list): The project's steps, as planned by `src.scheduling.plan_request`.
+
+    Returns:
+        celery.canvas.Signature: The chain, ready for `apply_async`.
+    """
+    signatures = []
+    for step in steps:
+        if step[0] == "fan_out":
+            signatures.append(fan_out.si(step[1]).set(queue=DEFAULT_QUEUE))
+        elif step[0] == "batch":
+            signatures.append(process_image_batch.si(step[1], step[2]).set(queue=task_queue(step[1])))
+        else:
+            _, task_name, pairs = step
+            signatures.append(process_project.si(task_name, project_id, pairs).set(queue=task_queue(task_name)))
+    return chain(*signatures)
+
+def schedule_job_item_ids(steps: list) -> list:
+    """Returns the IDs of the job items that the steps of a project schedule process.
+
+    Args:
+        steps (list): The project's steps, as planned by `src.scheduling.plan_request`.
+
+    Returns:
+        list: The job item IDs.
+    """
+    job_item_ids = []
+    for step in steps:
+        if step[0] == "fan_out":
+            job_item_ids.extend(job_item_id for _, _, job_item_id in step[1])
+        else:
+            job_item_ids.extend(job_item_id for _, job_item_id in step[2])
+    return job_item_ids
+
+def skip_processed(items: list) -> list:
+    """Marks the items whose image their task has already processed as skipped and drops them.
+
+    Every task is asked once, with a set-based query, which of the images it has already
+    processed at its current version; the job items of those images are marked skipped
+    with a single UPDATE.
+
+    Args:
+        items (list): (image_id, task_name, job_item_id) items.
+
+    Returns:
+        list: The items that still need to be processed.
+    """
+    image_ids_by_task = {}
+    for image_id, task_name, _ in items:
+        image_ids_by_task.setdefault(task_name, set()).add(image_id)
+
+    conn, cur = None, None
+    try:
+        conn, cur = get_db_conn_and_cursor()
+        done = {}
+        for task_name, image_ids in image_ids_by_task.items():
+            task_class = get_task_class(task_name)
+            if task_class:
+                done[task_name] = task_class().filter_already_processed(cur, sorted(image_ids))
+
+        skipped_item_ids = [job_item_id for image_id, task_name, job_item_id in items if image_id in done.get(task_name, ())]
+        if skipped_item_ids:
             cur.execute(
-                "UPDATE analysis_job_item SET error_message = %s WHERE id = %s",
-                (str(exc), job_item_id)
+                "UPDATE analysis_job_item SET item_status = 'skipped', completed_at = NOW() WHERE id = ANY(%s)",
+                (skipped_item_ids,)
             )
-            conn.commit()
-
-        try:
-            raise self.retry(exc=exc)
-        except self.MaxRetriesExceededError:
-            if conn and cur:
-                cur.execute("UPDATE analysis_job_item SET item_status = 'failed' WHERE id = %s", (job_item_id,))
-                conn.commit()
-            self.update_state(state=states.FAILURE, meta={'exc': exc})
+            print(f"Skipped {len(skipped_item_ids)} of {len(items)} item(s) that are already processed")
+        conn.commit()
+    finally:
+        close_db_conn_and_cursor(conn, cur)
+    return [item for item in items if item[0] not in done.get(item[1], ())]
+
+def image_projects(image_ids: list[str]) -> dict:
+    """Returns the project ID of every given image that exists."""
+    conn, cur = None, None
+    try:
+        conn, cur = get_db_conn_and_cursor()
+        cur.execute("SELECT id, project_id FROM image WHERE id = ANY(%s)", (image_ids,))
+        return dict(cur.fetchall())
     finally:
         close_db_conn_and_cursor(conn, cur)
+
+@app.task(bind=True, max_retries=3, default_retry_delay=5)
+def expand_batch(self, items: list, pipeline: bool = False):
+    """Celery task that turns an analysis request into the messages that process it.
+
+    `/batch-analyze` publishes a request as this single message and returns. Here, items
+    that are already processed are skipped, tasks with dependencies are scheduled per
+    project (see `src.scheduling`), and the remaining items are enqueued on their tasks'
+    queues, in batches for tasks that support batching. With `pipeline` set, the tasks of
+    each image that share a queue are sent together to `analyze_image` instead.
+
+    A retry only covers the items that no message was published for yet, so a failure
+    halfway through publishing does not enqueue the other items twice.
+
+    Args:
+        items (list): (image_id, task_name, job_item_id) items.
+        pipeline (bool): Whether to run the tasks of each image in one `analyze_image` message.
+    """
+    pending = items
+    published = set()
+    try:
+        started = time.perf_counter()
+        remaining = skip_processed(items)
+        # The skipped items are recorded: only the remaining ones are left to publish.
+        pending = remaining
+        remaining, plans = plan_request(remaining, image_projects)
+        for project_id, steps in plans.items():
+            project_chain(project_id, steps).apply_async()
+            published.update(schedule_job_item_ids(steps))
+
+        if pipeline:
+            stages_by_queue = {}
+            for image_id, task_name, job_item_id in remaining:
+                stages_by_image = stages_by_queue.setdefault(task_queue(task_name), {})
+                stages_by_image.setdefault(image_id, []).append([task_name, job_item_id])
+            for queue, stages_by_image in stages_by_queue.items():
+                for image_id, stages in stages_by_image.items():
+                    analyze_image.apply_async((image_id, stages), queue=queue)
+                    published.update(job_item_id for _, job_item_id in stages)
+        else:
+            enqueue_items(remaining, published)
+        print(f"Expanded {len(items)} item(s) into {len(plans)} project schedule(s) and {len(remaining)} item(s) in {time.perf_counter() - started:.2f}s")
+    except Exception as exc:
+        unpublished = [item for item in pending if item[2] not in published]
+        print(f"Error expanding a batch of {len(items)} item(s), {len(unpublished)} not yet published: {exc}")
+        retry_or_fail(self, exc, [job_item_id for _, _, job_item_id in unpublished], args=(unpublished, pipeline))
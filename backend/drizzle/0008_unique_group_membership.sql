@@ -0,0 +1,2 @@
+DELETE FROM "image_group_membership" AS "duplicate" USING "image_group_membership" AS "kept" WHERE "duplicate"."group_id" = "kept"."group_id" AND "duplicate"."image_id" = "kept"."image_id" AND "duplicate"."id" > "kept"."id";--> statement-breakpoint
+ALTER TABLE "image_group_membership" ADD CONSTRAINT "unique_group_membership" UNIQUE("group_id","image_id");
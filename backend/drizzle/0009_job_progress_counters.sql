@@ -0,0 +1,104 @@
+ALTER TABLE "analysis_job" ADD COLUMN "total_items" integer DEFAULT 0 NOT NULL;--> statement-breakpoint
+ALTER TABLE "analysis_job" ADD COLUMN "pending_items" integer DEFAULT 0 NOT NULL;--> statement-breakpoint
+ALTER TABLE "analysis_job" ADD COLUMN "processing_items" integer DEFAULT 0 NOT NULL;--> statement-breakpoint
+ALTER TABLE "analysis_job" ADD COLUMN "completed_items" integer DEFAULT 0 NOT NULL;--> statement-breakpoint
+ALTER TABLE "analysis_job" ADD COLUMN "skipped_items" integer DEFAULT 0 NOT NULL;--> statement-breakpoint
+ALTER TABLE "analysis_job" ADD COLUMN "failed_items" integer DEFAULT 0 NOT NULL;--> statement-breakpoint
+UPDATE "analysis_job" AS "j" SET
+	"total_items" = "c"."total",
+	"pending_items" = "c"."pending",
+	"processing_items" = "c"."processing",
+	"completed_items" = "c"."completed",
+	"skipped_items" = "c"."skipped",
+	"failed_items" = "c"."failed"
+FROM (
+	SELECT "job_id",
+		count(*) AS "total",
+		count(*) FILTER (WHERE "item_status" = 'pending') AS "pending",
+		count(*) FILTER (WHERE "item_status" = 'processing') AS "processing",
+		count(*) FILTER (WHERE "item_status" = 'completed') AS "completed",
+		count(*) FILTER (WHERE "item_status" = 'skipped') AS "skipped",
+		count(*) FILTER (WHERE "item_status" = 'failed') AS "failed"
+	FROM "analysis_job_item"
+	GROUP BY "job_id"
+) AS "c"
+WHERE "j"."id" = "c"."job_id";--> statement-breakpoint
+-- Keeps the item counters of "analysis_job" in step with its items, and moves the job to
+-- 'processing' when its first item leaves 'pending' and to 'completed' when its last item
+-- finishes. Runs once per statement on its transition tables, so a bulk status update of
+-- thousands of items changes each affected job row only once.
+CREATE OR REPLACE FUNCTION "analysis_job_item_count_changes"() RETURNS trigger AS $$
+DECLARE
+	"changes" text;
+BEGIN
+	IF TG_OP = 'INSERT' THEN
+		"changes" := 'SELECT "job_id", "item_status", 1 AS "delta", "started_at" FROM "new_items"';
+	ELSIF TG_OP = 'UPDATE' THEN
+		"changes" := 'SELECT "job_id", "item_status", 1 AS "delta", "started_at" FROM "new_items"
+			UNION ALL SELECT "job_id", "item_status", -1, NULL FROM "old_items"';
+	ELSE
+		"changes" := 'SELECT "job_id", "item_status", -1 AS "delta", NULL::timestamp AS "started_at" FROM "old_items"';
+	END IF;
+
+	-- Locks the affected job rows in id order before updating them, so that two
+	-- statements touching the same jobs queue up instead of deadlocking on each other.
+	EXECUTE format($sql$
+		SELECT 1 FROM "analysis_job"
+		WHERE "id" IN (SELECT "job_id" FROM (%s) AS "changes")
+		ORDER BY "id"
+		FOR UPDATE
+	$sql$, "changes");
+
+	EXECUTE format($sql$
+		WITH "s" AS (
+			-- Net change per job and status; updates that keep the status cancel out.
+			SELECT "job_id", "item_status", sum("delta") AS "delta", min("started_at") AS "started_at"
+			FROM (%s) AS "changes"
+			GROUP BY "job_id", "item_status"
+			HAVING sum("delta") <> 0
+		), "d" AS (
+			SELECT "job_id",
+				sum("delta") AS "total",
+				min("started_at") AS "started_at",
+				coalesce(sum("delta") FILTER (WHERE "item_status" = 'pending'), 0) AS "pending",
+				coalesce(sum("delta") FILTER (WHERE "item_status" = 'processing'), 0) AS "processing",
+				coalesce(sum("delta") FILTER (WHERE "item_status" = 'completed'), 0) AS "completed",
+				coalesce(sum("delta") FILTER (WHERE "item_status" = 'skipped'), 0) AS "skipped",
+				coalesce(sum("delta") FILTER (WHERE "item_status" = 'failed'), 0) AS "failed"
+			FROM "s"
+			GROUP BY "job_id"
+		)
+		-- Every expression adds to the current row, which is re-read if a concurrent
+		-- statement updated it first, so concurrent workers never lose counts.
+		UPDATE "analysis_job" AS "j" SET
+			"total_items" = "j"."total_items" + "d"."total",
+			"pending_items" = "j"."pending_items" + "d"."pending",
+			"processing_items" = "j"."processing_items" + "d"."processing",
+			"completed_items" = "j"."completed_items" + "d"."completed",
+			"skipped_items" = "j"."skipped_items" + "d"."skipped",
+			"failed_items" = "j"."failed_items" + "d"."failed",
+			"job_status" = CASE
+				WHEN "j"."job_status" = 'cancelled' THEN "j"."job_status"
+				WHEN "j"."total_items" + "d"."total" > 0
+					AND "j"."pending_items" + "d"."pending" + "j"."processing_items" + "d"."processing" = 0 THEN 'completed'
+				WHEN "j"."total_items" + "d"."total" > "j"."pending_items" + "d"."pending" THEN 'processing'
+				ELSE "j"."job_status"
+			END,
+			"started_at" = CASE
+				WHEN "j"."total_items" + "d"."total" > "j"."pending_items" + "d"."pending" THEN coalesce("j"."started_at", "d"."started_at", NOW())
+				ELSE "j"."started_at"
+			END,
+			"completed_at" = CASE
+				WHEN "j"."total_items" + "d"."total" > 0
+					AND "j"."pending_items" + "d"."pending" + "j"."processing_items" + "d"."processing" = 0 THEN coalesce("j"."completed_at", NOW())
+			END,
+			"updated_at" = NOW()
+		FROM "d"
+		WHERE "j"."id" = "d"."job_id"
+	$sql$, "changes");
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;--> statement-breakpoint
+CREATE TRIGGER "analysis_job_item_counts_insert" AFTER INSERT ON "analysis_job_item" REFERENCING NEW TABLE AS "new_items" FOR EACH STATEMENT EXECUTE FUNCTION "analysis_job_item_count_changes"();--> statement-breakpoint
+CREATE TRIGGER "analysis_job_item_counts_update" AFTER UPDATE ON "analysis_job_item" REFERENCING OLD TABLE AS "old_items" NEW TABLE AS "new_items" FOR EACH STATEMENT EXECUTE FUNCTION "analysis_job_item_count_changes"();--> statement-breakpoint
+CREATE TRIGGER "analysis_job_item_counts_delete" AFTER DELETE ON "analysis_job_item" REFERENCING OLD TABLE AS "old_items" FOR EACH STATEMENT EXECUTE FUNCTION "analysis_job_item_count_changes"();
@@ -2,7 +2,7 @@
  * @module db/schema/imageGroup
  * This file defines the database schema for image groups and their memberships.
  */
-import { pgTable, text, timestamp, decimal, integer } from "drizzle-orm/pg-core";
+import { pgTable, text, timestamp, decimal, integer, unique } from "drizzle-orm/pg-core";
 import { relations } from "drizzle-orm";
 import { groupTypeEnum } from "./enums";
 import { project } from "./project";
@@ -45,7 +45,9 @@ export const imageGroupMembership = pgTable("image_group_membership", {
   addedAt: timestamp("added_at")
     .$defaultFn(() => new Date())
     .notNull(),
-});
+}, (t) => ([
+  unique('unique_group_membership').on(t.groupId, t.imageId),
+]));
 
 // Relations
 /**
@@ -23,6 +23,14 @@ export const analysisJob = pgTable("analysis_job", {
   jobType: jobTypeEnum("job_type").notNull(),
   jobStatus: jobStatusEnum("job_status").default("pending").notNull(),
   errorMessage: text("error_message"),
+  // Item counts per status, kept up to date by a trigger on `analysis_job_item`
+  // (see drizzle/0009_job_progress_counters.sql), which also sets the job status.
+  totalItems: integer("total_items").default(0).notNull(),
+  pendingItems: integer("pending_items").default(0).notNull(),
+  processingItems: integer("processing_items").default(0).notNull(),
+  completedItems: integer("completed_items").default(0).notNull(),
+  skippedItems: integer("skipped_items").default(0).notNull(),
+  failedItems: integer("failed_items").default(0).notNull(),
   startedAt: timestamp("started_at"),
   completedAt: timestamp("completed_at"),
   createdAt: timestamp("created_at")
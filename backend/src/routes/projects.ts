@@ -685,45 +685,13 @@ const getAnalysisStatusHandler: AppRouteHandler<typeof getAnalysisStatusRoute> =
         return c.json({ error: 'No analysis job found' }, 404);
     }
 
-    const jobItems = await db
-        .select()
-        .from(analysisJobItem)
-        .where(eq(analysisJobItem.jobId, latestJob[0].id));
-
-    const completedItems = jobItems.filter(item => item.itemStatus === 'completed').length;
-    const failedItems = jobItems.filter(item => item.itemStatus === 'failed').length;
-    const skippedItems = jobItems.filter(item => item.itemStatus === 'skipped').length;
-    const processingItems = jobItems.filter(item => item.itemStatus === 'processing').length;
-    const totalItems = jobItems.length;
-    
+    // The item counters and the job status are maintained by a trigger on the job items.
+    const { completedItems, failedItems, skippedItems, totalItems } = latestJob[0];
+
     // Calculate progress based on items that have reached a terminal state (completed, failed, or skipped)
     const processedItems = completedItems + failedItems + skippedItems;
     const progressPercentage = totalItems > 0 ? (processedItems / totalItems) * 100 : 0;
 
-    let newStatus = latestJob[0].jobStatus;
-
-    if (totalItems > 0) {
-        if (processedItems === totalItems) {
-            newStatus = 'completed';
-        } else if (processedItems > 0 || processingItems > 0) {
-            if (newStatus === 'pending') {
-                newStatus = 'processing';
-            }
-        }
-    }
-
-    if (newStatus !== latestJob[0].jobStatus) {
-        await db.update(analysisJob)
-            .set({ 
-                jobStatus: newStatus,
-                completedAt: newStatus === 'completed' ? new Date() : null,
-                updatedAt: new Date(),
-            })
-            .where(eq(analysisJob.id, latestJob[0].id));
-        
-        latestJob[0].jobStatus = newStatus;
-    }
-
     return c.json({
         jobId: latestJob[0].id,
         status: latestJob[0].jobStatus,